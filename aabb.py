@@ -1,4 +1,15 @@
-from ray import Ray
+import numpy as np
+from vec3 import Vec3
+
+def ffmin(a, b):
+    if a < b:
+        return a
+    return b
+
+def ffmax(a, b):
+    if a > b:
+        return a
+    return b
 
 class AABB():
 ##    axis aligned bounding boxes
@@ -6,44 +17,66 @@ class AABB():
         self.min_hit = min_hit
         self.max_hit = max_hit
 
+    def __reduce__(self):
+        return AABB, (self.min_hit, self.max_hit)
+
     def ffmin(self, a, b):
-        if a < b:
-            return a
-        return b
+        return ffmin(a, b)
 
     def ffmax(self, a, b):
-        if a > b:
-            return a
-        else:
-            return b
-
-##    def hit(self, ray, t_min, t_max):
-##        for a in range(0, 3):
-##            t0 = self.ffmin(())
-        
+        return ffmax(a, b)
+
+    # slab test, one axis at a time
     def hit(self, ray, t_min, t_max):
-        for a in range(0, 3):
-            invD = 1 / ray.direction[a]
-            t0 = (self.min_hit[a] - ray.origin[a]) * invD
-            t1 = (self.max_hit[a] - ray.origin[a]) * invD
+        o = ray.origin
+        d = ray.direction
+        for origin, direction, low, high in ((o.x, d.x, self.min_hit.x, self.max_hit.x),
+                                             (o.y, d.y, self.min_hit.y, self.max_hit.y),
+                                             (o.z, d.z, self.min_hit.z, self.max_hit.z)):
+            if direction == 0:
+                # parallel to the slab, either always inside or never
+                if origin < low or origin > high:
+                    return False
+                continue
+            invD = 1 / direction
+            t0 = (low - origin) * invD
+            t1 = (high - origin) * invD
             if invD < 0:
                 t0, t1 = t1, t0
             if t0 > t_min:
                 t_min = t0
             if t1 < t_max:
                 t_max = t1
-            if tmax <= tmin:
+            if t_max <= t_min:
                 return False
         return True
 
+    # same slab test over a RayBatch, t_min and t_max may be per-ray arrays
+    def hit_batch(self, rays, t_min, t_max):
+        o = rays.origin
+        d = rays.direction
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for origin, direction, low, high in ((o.x, d.x, self.min_hit.x, self.max_hit.x),
+                                                 (o.y, d.y, self.min_hit.y, self.max_hit.y),
+                                                 (o.z, d.z, self.min_hit.z, self.max_hit.z)):
+                invD = 1 / direction
+                t0 = (low - origin) * invD
+                t1 = (high - origin) * invD
+                t_min = np.fmax(t_min, np.fmin(t0, t1))
+                t_max = np.fmin(t_max, np.fmax(t0, t1))
+        return t_max > t_min
+
+    def centroid(self):
+        return 0.5 * (self.min_hit + self.max_hit)
 
     def surrounding_box(self, box0, box1):
-        small = Vec3( self.ffmin(box0.min().x, box1.min().x),
-                      self.ffmin(box0.min().y, box1.min().y),
-                      self.ffmin(box0.min().z, box1.min().z)
-               )
-        big = Vec3( self.ffmax(box0.max().x, box1.max().x),
-                    self.ffmax(box0.max().y, box1.max().y),
-                    self.ffmax(box0.max().z, box1.max().z)
-               )
-        return aabb(small,big)
+        return surrounding_box(box0, box1)
+
+def surrounding_box(box0, box1):
+    small = Vec3(ffmin(box0.min_hit.x, box1.min_hit.x),
+                 ffmin(box0.min_hit.y, box1.min_hit.y),
+                 ffmin(box0.min_hit.z, box1.min_hit.z))
+    big = Vec3(ffmax(box0.max_hit.x, box1.max_hit.x),
+               ffmax(box0.max_hit.y, box1.max_hit.y),
+               ffmax(box0.max_hit.z, box1.max_hit.z))
+    return AABB(small, big)
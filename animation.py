@@ -0,0 +1,73 @@
+from bisect import bisect_right
+import transform
+from hitable import Hitable
+
+# Keyframed animation. A Track moves an Instance through keys of (time,
+# translation, (x, y, z) rotation in degrees, scale), interpolated linearly
+# between keys and held before the first and after the last. The instance
+# is scaled, turned about x, y and then z, and moved, so a track with one
+# key is the matrix translation @ rotation_y(angle) of a static instance.
+#
+# Animation wraps a world holding such instances. set_time() puts every
+# track at the frame's time and refits the world's BVH: the boxes are
+# recomputed from the leaves up, the tree keeps the split it was built
+# with. Objects that only move a little from frame to frame keep a good
+# tree that way for a fraction of the cost of building it again, and the
+# world stays the same objects, so pool workers that were handed the
+# scene once can render any frame of it.
+
+class Track:
+    def __init__(self, instance, keys):
+        if not keys:
+            raise ValueError('a track needs at least one key')
+        self.instance = instance
+        self.keys = sorted(keys, key=lambda key: key[0])
+        self.times = [key[0] for key in self.keys]
+
+    # translation, rotation and scale at time
+    def pose(self, time):
+        i = bisect_right(self.times, time)
+        if i == 0:
+            return self.keys[0][1:]
+        if i == len(self.keys):
+            return self.keys[-1][1:]
+        (time0, translation0, rotation0, scale0), (time1, translation1, rotation1, scale1) = self.keys[i - 1], self.keys[i]
+        s = (time - time0) / (time1 - time0)
+        translation = translation0 + s * (translation1 - translation0)
+        rotation = tuple(a + s * (b - a) for a, b in zip(rotation0, rotation1))
+        return translation, rotation, scale0 + s * (scale1 - scale0)
+
+    def matrix(self, time):
+        offset, (x, y, z), scale = self.pose(time)
+        return (transform.translation(offset) @ transform.rotation_z(z) @ transform.rotation_y(y)
+                @ transform.rotation_x(x) @ transform.scaling(scale))
+
+    def apply(self, time):
+        self.instance.set_matrix(self.matrix(time))
+
+class Animation(Hitable):
+    def __init__(self, world, tracks, time0=0, time1=0):
+        self.world = world
+        self.tracks = tracks
+        self.time = None
+        self.set_time(time0, time1)
+
+    # the scene at time0, its boxes covering what moves on to time1 (moving
+    # spheres, which blur over the shutter); returns the world's new box
+    def set_time(self, time0, time1):
+        for track in self.tracks:
+            track.apply(time0)
+        self.time = time0
+        return self.world.refit(time0, time1)
+
+    def hit(self, ray, t_min, t_max):
+        return self.world.hit(ray, t_min, t_max)
+
+    def hit_batch(self, rays, t_min, rec):
+        return self.world.hit_batch(rays, t_min, rec)
+
+    def bounding_box(self, t0, t1):
+        return self.world.bounding_box(t0, t1)
+
+    def refit(self, t0, t1):
+        return self.world.refit(t0, t1)
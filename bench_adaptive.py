@@ -0,0 +1,71 @@
+import os
+import sys
+import tempfile
+from time import perf_counter
+import numpy as np
+import main_next01
+from framebuffer import FrameBuffer, Accumulator, to_bytes, luminance
+
+# Uniform against adaptive sampling of cornell_box with the wavefront
+# integrator: wall time, mean samples per pixel and the error of the 8 bit
+# image against a high sample reference, both as RMS over the image and as
+# the 90th percentile of the RMS of 4x4 blocks (the visible blotches), and
+# the bias of the mean linear luminance, each the mean over a few seeds, so
+# the adaptive rows can be read against the uniform rows of equal error.
+# Adaptive runs spend their samples per pixel on average, split by noise,
+# and may stop early where the noise is under the threshold.
+# python bench_adaptive.py [size reference_samples]
+
+size = 32
+reference_samples = 1024
+uniform_samples = (32, 48, 64)
+adaptive_runs = ((0.02, 32), (0.02, 40), (0.02, 48), (0.1, 64))
+seeds = (1, 3, 5, 7)
+
+def render(folder, label, samples, threshold, seed=1):
+    m = main_next01
+    m.noise_threshold = threshold
+    m.seed = seed
+    accumulator = Accumulator(os.path.join(folder, label + '.npy'), m.nx, m.ny)
+    start = perf_counter()
+    m.render_passes(map, accumulator, m.tile_list, samples)
+    elapsed = perf_counter() - start
+    return accumulator, elapsed
+
+def main():
+    global size, reference_samples
+    if len(sys.argv) > 2:
+        size, reference_samples = (int(i) for i in sys.argv[1:3])
+    m = main_next01
+    m.integrator = 'wavefront'
+    m.nx = m.ny = size
+    m.tile_list = m.scheduler.make_tiles(size, size, m.tile_size)
+    m.cam = m.MoBlurCamera(m.lookfrom, m.lookat, m.Vec3(0, 1, 0), m.vfov, 1, m.aperture, m.dist_to_focus, 0, 1)
+    m.world = m.BVHNode(m.group_primitives(m.cornell_box(), 32), 0, 1)
+    m.frame = FrameBuffer(size, size, m.frame_channels)
+    np.seterr(all='ignore')
+    with tempfile.TemporaryDirectory() as folder:
+        reference, seconds = render(folder, 'reference', reference_samples, 0, seed=2)
+        truth = to_bytes(reference.frame().pixels).astype(np.float64)
+        brightness = luminance(reference.frame().pixels).mean()
+        del reference
+        print('{0}x{0} cornell_box, reference {1} spp in {2:.1f}s, means over {3} seeds'.format(size, reference_samples, seconds, len(seeds)))
+        print('{:>10} {:>7} {:>8} {:>7} {:>10} {:>10} {:>8}'.format('threshold', 'budget', 'seconds', 'spp', 'rms error', 'p90 block', 'bias'))
+        runs = [('uniform', n, 0) for n in uniform_samples] + [(t, n, t) for t, n in adaptive_runs]
+        for label, budget, threshold in runs:
+            results = []
+            for seed in seeds:
+                accumulator, seconds = render(folder, '{}.{}.{}'.format(label, budget, seed), budget, threshold, seed)
+                pixels = accumulator.frame().pixels
+                image = to_bytes(pixels).astype(np.float64)
+                squared = ((image - truth) ** 2).mean(axis=2)
+                h = size // 4 * 4
+                blocks = np.sqrt(squared[:h, :h].reshape(h // 4, 4, h // 4, 4).mean(axis=(1, 3)))
+                results.append((seconds, accumulator.counts.mean(), np.sqrt(squared.mean()), np.percentile(blocks, 90),
+                                luminance(pixels).mean() / brightness - 1))
+                del accumulator
+            seconds, spp, rms, block, bias = np.mean(results, axis=0)
+            print('{:>10} {:>7} {:>8.2f} {:>7.1f} {:>10.2f} {:>10.2f} {:>+8.1%}'.format(label, budget, seconds, spp, rms, block, bias))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+import hashlib
+from time import perf_counter
+from collections import Counter
+import numpy as np
+import rng
+import main_next01 as m
+from vec3 import Vec3
+from ray import Ray
+from onb import ONB
+from hitable import HitRecord
+from material import ScatterRecord
+from pdf import CosinePDF, HitablePDF, MixturePDF
+
+# Cost of the scalar hot path per sample on the Cornell box: the best time
+# of three renders and the objects of the core classes made per sample,
+# counted in a separate render with their constructors wrapped. The digest
+# of the samples shows whether a change to the core kept the output
+# identical.
+
+size = 24
+samples = 16
+
+def render():
+    out = np.zeros((size, size, samples, 3))
+    for y in range(size):
+        for x in range(size):
+            px = (y + 88) * m.nx + x + 88
+            values = rng.uniforms(m.seed, px, np.arange(samples))
+            for s in range(samples):
+                rng.begin(m.seed, px, s, values[s])
+                c, segments = m.sample(x + 88, y + 88)
+                out[y, x, s] = (c.x, c.y, c.z)
+    return out
+
+classes = (Vec3, Ray, HitRecord, ScatterRecord, ONB, CosinePDF, HitablePDF, MixturePDF)
+
+def count_objects():
+    counts = Counter()
+    wrapped = []
+    for cls in classes:
+        method = '__init__' if '__init__' in cls.__dict__ else '__new__'
+        function = cls.__dict__[method]
+        def counted(*args, function=function, name=cls.__name__):
+            counts[name] += 1
+            return function(*args)
+        setattr(cls, method, staticmethod(counted) if method == '__new__' else counted)
+        wrapped.append((cls, method, function))
+    try:
+        render()
+    finally:
+        for cls, method, function in wrapped:
+            setattr(cls, method, function)
+    return counts
+
+def main():
+    seconds = []
+    for i in range(3):
+        start = perf_counter()
+        out = render()
+        seconds.append(perf_counter() - start)
+    n = size * size * samples
+    print('{} samples: {:.1f} us per sample'.format(n, min(seconds) / n * 1e6))
+    print('digest {}'.format(hashlib.sha1(out.tobytes()).hexdigest()[:16]))
+    counts = count_objects()
+    print('objects per sample: {:.1f}'.format(sum(counts.values()) / n))
+    for name, count in counts.most_common():
+        print('  {:<14} {:6.1f}'.format(name, count / n))
+
+if __name__ == '__main__':
+    main()
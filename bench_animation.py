@@ -0,0 +1,132 @@
+import os
+import sys
+import argparse
+import subprocess
+import tempfile
+from time import perf_counter
+from multiprocessing import Pool
+import numpy as np
+from vec3 import Vec3
+from hitable import Sphere
+from material import Lambertian
+from texture import ConstantTexture
+from framebuffer import SharedFrameBuffer, Accumulator
+import main_next01 as m
+import scheduler
+import sharedscene
+
+# Animation frames: the animated cornell box rendered once per frame the
+# way separate runs would, building the scene and starting a pool for each,
+# and then as main_next01 --frames does, one pool for all of them whose
+# workers refit their copy of the scene when a job of a new frame comes.
+# Reports the seconds a frame spends outside the render in each, the
+# seconds to build the scene and to refit it, and whether both gave the
+# same images. A separate run also pays for a new interpreter importing
+# the renderer, measured apart. --objects adds small static spheres to the
+# box so that a build has more to do.
+#
+#   python bench_animation.py [--size 64] [--samples 4] [--frames 6] [--objects 5000]
+
+original_box = m.cornell_box
+
+def spheres_box(count):
+    generator = np.random.RandomState(14)
+    def box():
+        scene = original_box()
+        gray = Lambertian(ConstantTexture(Vec3(0.5, 0.5, 0.5)))
+        placed = 0
+        while placed < count:
+            x, z = generator.uniform(20, 535, 2).tolist()
+            # clear of the glass sphere, the light pdf of which takes
+            # points to be outside it
+            if (x - 190) ** 2 + (z - 190) ** 2 > 100 ** 2:
+                scene.append(Sphere(Vec3(x, 8, z), 8, gray))
+                placed += 1
+        return scene
+    return box
+
+def build(objects):
+    m.cornell_box = spheres_box(objects)
+    try:
+        return m.cornell_scene(animated=True)
+    finally:
+        m.cornell_box = original_box
+
+def render_frame(run, folder, index, samples):
+    accumulator = Accumulator(os.path.join(folder, 'frame.{}.accum.npy'.format(index)), m.nx, m.ny)
+    start = perf_counter()
+    m.render_passes(run, accumulator, scheduler.make_tiles(m.nx, m.ny, m.tile_size), samples, frame_index=index)
+    seconds = perf_counter() - start
+    image = accumulator.frame().pixels.copy()
+    del accumulator
+    return seconds, image
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', type=int, default=64)
+    parser.add_argument('--samples', type=int, default=4)
+    parser.add_argument('--frames', type=int, default=6)
+    parser.add_argument('--objects', type=int, default=5000, help='static spheres added to the box')
+    parser.add_argument('--integrator', default='iterative', choices=('iterative', 'recursive', 'wavefront'))
+    args = parser.parse_args()
+    m.nx = m.ny = args.size
+    m.integrator = args.integrator
+    frame = SharedFrameBuffer(args.size, args.size, channels=m.frame_channels)
+    m.frame = frame
+    frames = range(args.frames)
+    fresh = []
+    images = []
+    try:
+        with tempfile.TemporaryDirectory() as folder:
+            builds = []
+            for index in frames:
+                start = perf_counter()
+                m.shown_frame = None
+                build_start = perf_counter()
+                m.world, m.cam, m.hlist = build(args.objects)
+                builds.append(perf_counter() - build_start)
+                m.show_frame(index)
+                shared = sharedscene.publish((m.world, m.cam, m.hlist))
+                try:
+                    with Pool(m.threads, m.attach_frame, (frame.name, args.size, args.size, False, shared)) as p:
+                        seconds, image = render_frame(lambda render, jobs: scheduler.run(p, render, jobs), folder, index, args.samples)
+                finally:
+                    sharedscene.release()
+                fresh.append((perf_counter() - start, seconds))
+                images.append(image)
+            refit = []
+            refits = []
+            same = True
+            start = perf_counter()
+            m.shown_frame = None
+            m.world, m.cam, m.hlist = build(args.objects)
+            shared = sharedscene.publish((m.world, m.cam, m.hlist))
+            try:
+                with Pool(m.threads, m.attach_frame, (frame.name, args.size, args.size, False, shared)) as p:
+                    for index in frames:
+                        refit_start = perf_counter()
+                        m.show_frame(index)
+                        refits.append(perf_counter() - refit_start)
+                        seconds, image = render_frame(lambda render, jobs: scheduler.run(p, render, jobs), folder, index, args.samples)
+                        refit.append((perf_counter() - start, seconds))
+                        start = perf_counter()
+                        same = same and np.array_equal(image, images[index])
+            finally:
+                sharedscene.release()
+    finally:
+        frame.close()
+        frame.unlink()
+    print('{} frames of {}x{} at {} samples, {} extra spheres, {} workers'.format(
+        args.frames, args.size, args.size, args.samples, args.objects, m.threads))
+    start = perf_counter()
+    subprocess.run([sys.executable, '-c', 'import main_next01'], check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    print('new interpreter importing main_next01 {:.3f} s'.format(perf_counter() - start))
+    print('scene build {:.3f} s, refit {:.4f} s (mean per frame)'.format(np.mean(builds), np.mean(refits)))
+    print('{:<24} {:>10} {:>10} {:>12}'.format('', 'frame s', 'render s', 'overhead s'))
+    for label, times in (('fresh run per frame', fresh), ('one pool, refit', refit)):
+        total, render = np.mean(times, axis=0)
+        print('{:<24} {:>10.3f} {:>10.3f} {:>12.3f}'.format(label, total, render, total - render))
+    print('same images: {}'.format('yes' if same else 'NO'))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+import random
+import sys
+from time import perf_counter
+import hitable
+import main_next01
+from vec3 import Vec3
+from ray import Ray
+from hitable import Box, HitableList, FlipNormals, XYRect, XZRect, YZRect, HitRecord
+
+# Slab-test Box against the old six-rect Box on the Cornell scenes: time per
+# ray and objects constructed per ray while tracing random rays through the
+# world (cornell_smoke's ConstantMedium asks each box for the interval
+# inside it, which the rect box finds with two hits).
+
+ray_count = 20000
+
+# the previous Box, rebuilding its faces on every hit
+class RectBox(Box):
+    def hit(self, ray, t_min, t_max):
+        p0 = self.p0
+        p1 = self.p1
+        m = self.ptr
+        hit_list = [XYRect(p0.x, p1.x, p0.y, p1.y, p1.z, m),
+                    FlipNormals(XYRect(p0.x, p1.x, p0.y, p1.y, p0.z, m)),
+                    XZRect(p0.x, p1.x, p0.z, p1.z, p1.y, m),
+                    FlipNormals(XZRect(p0.x, p1.x, p0.z, p1.z, p0.y, m)),
+                    YZRect(p0.y, p1.y, p0.z, p1.z, p1.x, m),
+                    FlipNormals(YZRect(p0.y, p1.y, p0.z, p1.z, p0.x, m))]
+        return HitableList(hit_list).hit(ray, t_min, t_max)
+
+    interval = hitable.Hitable.interval
+
+counted = [Vec3, Ray, HitRecord, XYRect, XZRect, YZRect, FlipNormals, HitableList]
+count = [0]
+
+def counting(cls):
+    init = cls.__init__
+    def __init__(self, *args, **kwargs):
+        count[0] += 1
+        init(self, *args, **kwargs)
+    cls.__init__ = __init__
+    return init
+
+def count_objects(trace):
+    originals = [counting(cls) for cls in counted]
+    count[0] = 0
+    try:
+        trace()
+    finally:
+        for cls, init in zip(counted, originals):
+            cls.__init__ = init
+    return count[0]
+
+def random_rays(rng):
+    rays = []
+    for i in range(ray_count):
+        origin = Vec3(rng.uniform(1, 554), rng.uniform(1, 554), rng.uniform(1, 554))
+        rays.append(Ray(origin, Vec3(rng.uniform(-1, 1), rng.uniform(-1, 1), rng.uniform(-1, 1)), rng.random()))
+    return rays
+
+def build(scene, box_class):
+    main_next01.Box = box_class
+    try:
+        return hitable.BVHNode(scene(), 0, 1)
+    finally:
+        main_next01.Box = Box
+
+def main():
+    print('{:>14} {:>8} {:>12} {:>14} {:>8}'.format('scene', 'box', 'us/ray', 'objects/ray', 'hits'))
+    for scene in (main_next01.cornell_box, main_next01.cornell_smoke):
+        rays = random_rays(random.Random(1))
+        for label, box_class in (('rects', RectBox), ('slabs', Box)):
+            world = build(scene, box_class)
+            random.seed(14)
+            start = perf_counter()
+            hits = sum(1 for r in rays if world.hit(r, 0.001, sys.float_info.max))
+            elapsed = perf_counter() - start
+            random.seed(14)
+            objects = count_objects(lambda: [world.hit(r, 0.001, sys.float_info.max) for r in rays])
+            print('{:>14} {:>8} {:>12.2f} {:>14.1f} {:>8}'.format(
+                scene.__name__, label, elapsed / ray_count * 1e6, objects / ray_count, hits))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+import random
+import sys
+from time import perf_counter
+from vec3 import Vec3
+from ray import Ray
+from hitable import HitableList, BVHNode, Sphere
+from material import Lambertian
+from texture import ConstantTexture
+
+# Per-ray cost of HitableList vs BVHNode for growing sphere counts.
+# A linear list should scale with n, the BVH with log(n).
+
+rays_per_run = 2000
+sizes = [16, 64, 256, 1024, 4096]
+
+def sphere_field(count, rng):
+    material = Lambertian(ConstantTexture(Vec3(0.5, 0.5, 0.5)))
+    side = count ** 0.5
+    spheres = []
+    for i in range(count):
+        center = Vec3(rng.uniform(-side, side), rng.uniform(0, 1), rng.uniform(-side, side))
+        spheres.append(Sphere(center, 0.2, material))
+    return spheres
+
+def random_rays(count, rng):
+    rays = []
+    for i in range(count):
+        origin = Vec3(rng.uniform(-1, 1), 5, rng.uniform(-1, 1))
+        direction = Vec3(rng.uniform(-1, 1), -rng.uniform(0.2, 1), rng.uniform(-1, 1))
+        rays.append(Ray(origin, direction))
+    return rays
+
+def time_per_ray(world, rays):
+    start = perf_counter()
+    hits = 0
+    for r in rays:
+        if world.hit(r, 0.001, sys.float_info.max):
+            hits += 1
+    return (perf_counter() - start) / len(rays), hits
+
+def main():
+    rng = random.Random(14)
+    rays = random_rays(rays_per_run, rng)
+    print('{:>8} {:>14} {:>14} {:>10} {:>10}'.format('objects', 'list us/ray', 'bvh us/ray', 'speedup', 'build s'))
+    for count in sizes:
+        spheres = sphere_field(count, rng)
+        linear = HitableList(spheres)
+        start = perf_counter()
+        bvh = BVHNode(spheres)
+        build = perf_counter() - start
+        list_time, list_hits = time_per_ray(linear, rays)
+        bvh_time, bvh_hits = time_per_ray(bvh, rays)
+        assert list_hits == bvh_hits
+        print('{:>8} {:>14.2f} {:>14.2f} {:>10.1f} {:>10.3f}'.format(
+            count, list_time * 1e6, bvh_time * 1e6, list_time / bvh_time, build))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+import os
+import argparse
+import tempfile
+from time import perf_counter
+import numpy as np
+from framebuffer import FrameBuffer, Accumulator
+import main_next01 as m
+import benchmark
+import scheduler
+import denoise
+
+# Denoising the cornell box: renders it with many samples as the reference,
+# then with few, plain and filtered with denoise.py, and reports the
+# seconds and the relative error of each against the reference. Renders go
+# through the renderer's own passes in this process.
+#
+#   python bench_denoise.py [--size 64] [--reference 1024]
+
+def render(size, samples):
+    m.frame = FrameBuffer(size, size, m.frame_channels)
+    with tempfile.TemporaryDirectory() as directory:
+        accumulator = Accumulator(os.path.join(directory, 'bench.accum.npy'), size, size)
+        start = perf_counter()
+        m.render_passes(map, accumulator, scheduler.make_tiles(size, size, m.tile_size), samples)
+        seconds = perf_counter() - start
+        image = accumulator.frame().pixels.astype(np.float64)
+        variance = accumulator.variance()
+        del accumulator
+    return seconds, image, variance
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', type=int, default=64)
+    parser.add_argument('--reference', type=int, default=1024, help='samples per pixel of the reference')
+    parser.add_argument('--samples', type=int, nargs='*', default=[8, 32, 128])
+    parser.add_argument('--integrator', default='wavefront', choices=('iterative', 'recursive', 'wavefront'))
+    parser.add_argument('--output', help='write the images as <output>.<samples>.ppm')
+    args = parser.parse_args()
+    benchmark.use_scene('cornell_box', args.size, args.integrator)
+    start = perf_counter()
+    aovs = m.render_aovs(map, scheduler.make_tiles(args.size, args.size, m.tile_size))
+    print('first hit buffers in {:.2f} s'.format(perf_counter() - start))
+    seconds, reference, variance = render(args.size, args.reference)
+    print('{} samples reference in {:.1f} s'.format(args.reference, seconds))
+    print('{:>8} {:>10} {:>14} {:>12} {:>14}'.format('samples', 'render s', 'error', 'denoise s', 'denoised error'))
+    for samples in args.samples:
+        seconds, image, variance = render(args.size, samples)
+        start = perf_counter()
+        filtered = denoise.denoise(image, variance, aovs)
+        filter_seconds = perf_counter() - start
+        print('{:>8} {:>10.1f} {:>14.4f} {:>12.2f} {:>14.4f}'.format(samples, seconds, denoise.relative_error(image, reference),
+                                                                     filter_seconds, denoise.relative_error(filtered, reference)))
+        if args.output:
+            for label, pixels in (('', image), ('.denoised', filtered)):
+                frame = FrameBuffer(args.size, args.size)
+                frame.pixels[:] = pixels
+                frame.write_ppm('{}.{}{}.ppm'.format(args.output, samples, label))
+
+if __name__ == '__main__':
+    main()
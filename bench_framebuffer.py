@@ -0,0 +1,81 @@
+import os
+import resource
+import sys
+import tempfile
+from multiprocessing import Pool
+from time import perf_counter
+import numpy as np
+from vec3 import Vec3
+from framebuffer import FrameBuffer, PPMWriter, PFMWriter, read_pfm
+
+# Write time and peak memory for a 4K frame: the old P3 text path (a Vec3
+# per pixel, str.format per channel, one joined string) against the binary
+# P6 and PFM writers, whole-buffer and tile by tile. Each writer runs in a
+# fresh process and its peak is the growth of max RSS over the framebuffer.
+# python bench_framebuffer.py [width height]
+
+width = 3840
+height = 2160
+tile = 64
+
+def float_to_int8(value):
+    return min(max(int(value * 255), 0), 255)
+
+def color_to_string(color):
+    return '{} {} {}'.format(float_to_int8(color.x), float_to_int8(color.y), float_to_int8(color.z))
+
+# the P3 writer main_next01 used, fed the list of gamma corrected Vec3 it built
+def write_p3(name, frame):
+    colors = [Vec3(*c) for c in np.sqrt(frame.pixels).reshape(-1, 3).tolist()]
+    ppm_header = 'P3\n{} {}\n255\n'.format(frame.width, frame.height)
+    ppm_colors = '\n'.join(color_to_string(color) for color in colors)
+    with open(name, 'w') as image:
+        image.write(ppm_header + ppm_colors + '\n')
+
+def write_tiles(writer, name, frame):
+    with writer(name, frame.width, frame.height) as image:
+        for y in range(0, frame.height, tile):
+            for x in range(0, frame.width, tile):
+                image.write_tile(x, y, frame.tile(x, y, x + tile, y + tile))
+
+def make_frame(w, h):
+    frame = FrameBuffer(w, h)
+    frame.pixels[:] = np.random.default_rng(14).random((h, w, 3), dtype=np.float32) * 1.5
+    return frame
+
+writers = {
+    'P3 text': write_p3,
+    'P6': lambda name, frame: frame.write_ppm(name),
+    'P6 tiles': lambda name, frame: write_tiles(PPMWriter, name, frame),
+    'PFM': lambda name, frame: frame.write_pfm(name),
+    'PFM tiles': lambda name, frame: write_tiles(PFMWriter, name, frame),
+}
+
+def measure(job):
+    label, name, w, h = job
+    frame = make_frame(w, h)
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = perf_counter()
+    writers[label](name, frame)
+    elapsed = perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before
+    return elapsed, peak * 1024, os.path.getsize(name)
+
+def main():
+    w, h = (int(i) for i in sys.argv[1:3]) if len(sys.argv) > 2 else (width, height)
+    frame = make_frame(w, h)
+    print('{}x{}, framebuffer {:.1f} MB'.format(w, h, frame.pixels.nbytes / 1e6))
+    print('{:>12} {:>10} {:>12} {:>12}'.format('writer', 'seconds', 'peak MB', 'file MB'))
+    files = {'P3 text': 'p3.ppm', 'P6': 'whole.ppm', 'P6 tiles': 'tiles.ppm', 'PFM': 'whole.pfm', 'PFM tiles': 'tiles.pfm'}
+    with tempfile.TemporaryDirectory() as folder:
+        for label in writers:
+            name = os.path.join(folder, files[label])
+            with Pool(1) as p:
+                elapsed, peak, size = p.apply(measure, ((label, name, w, h),))
+            print('{:>12} {:>10.3f} {:>12.1f} {:>12.1f}'.format(label, elapsed, peak / 1e6, size / 1e6))
+        same = open(os.path.join(folder, 'whole.ppm'), 'rb').read() == open(os.path.join(folder, 'tiles.ppm'), 'rb').read()
+        hdr = np.array_equal(read_pfm(os.path.join(folder, 'tiles.pfm')), frame.pixels)
+        print('tiled P6 matches whole: {}, PFM round trip exact: {}'.format(same, hdr))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+import random
+import tracemalloc
+from time import perf_counter
+from collections import Counter
+from vec3 import Vec3
+from ray import Ray
+from hitable import Box, Translate, RotateY, Instance, BVHNode, HitRecord
+from transform import translation, rotation_y, scaling
+
+# A field of boxes, each turned and moved, built two ways: a Box of its own
+# under RotateY and Translate per box, and one unit Box shared by Instances
+# that also scale it. Reports the memory of scene and BVH, time and
+# objects made per ray, and whether both give the same hits.
+
+boxes = 3000
+rays = 20000
+
+def placements():
+    local_random = random.Random(14)
+    for i in range(boxes):
+        size = Vec3(local_random.uniform(2, 8), local_random.uniform(2, 20), local_random.uniform(2, 8))
+        offset = Vec3(local_random.uniform(0, 1000), 0, local_random.uniform(0, 1000))
+        yield size, offset, local_random.uniform(0, 90)
+
+def chains():
+    return [Translate(RotateY(Box(Vec3(0, 0, 0), size), angle), offset) for size, offset, angle in placements()]
+
+def instances():
+    unit = Box(Vec3(0, 0, 0), Vec3(1, 1, 1))
+    return [Instance(unit, translation(offset) @ rotation_y(angle) @ scaling(size.x, size.y, size.z))
+            for size, offset, angle in placements()]
+
+def build(make):
+    tracemalloc.start()
+    world = BVHNode(make(), 0, 1)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return world, size
+
+def make_rays():
+    local_random = random.Random(15)
+    for i in range(rays):
+        origin = Vec3(local_random.uniform(0, 1000), 30, local_random.uniform(0, 1000))
+        yield Ray(origin, Vec3(local_random.uniform(-1, 1), -local_random.uniform(0.2, 1), local_random.uniform(-1, 1)))
+
+def trace(world, all_rays):
+    return [world.hit(ray, 0.001, 1e30) for ray in all_rays]
+
+def count_objects(world, all_rays):
+    counts = Counter()
+    wrapped = []
+    for cls in (Vec3, Ray, HitRecord):
+        function = cls.__init__
+        def counted(*args, function=function, name=cls.__name__):
+            counts[name] += 1
+            return function(*args)
+        cls.__init__ = counted
+        wrapped.append((cls, function))
+    try:
+        trace(world, all_rays)
+    finally:
+        for cls, function in wrapped:
+            cls.__init__ = function
+    return counts
+
+def main():
+    all_rays = list(make_rays())
+    results = {}
+    print('{} boxes, {} rays'.format(boxes, rays))
+    print('{:<10} {:>10} {:>10} {:>14}'.format('', 'heap MB', 'us/ray', 'objects/ray'))
+    for name, make in (('chains', chains), ('instances', instances)):
+        world, size = build(make)
+        start = perf_counter()
+        results[name] = trace(world, all_rays)
+        seconds = perf_counter() - start
+        counts = count_objects(world, all_rays)
+        print('{:<10} {:>10.2f} {:>10.1f} {:>14.1f}'.format(name, size / 2 ** 20, seconds / rays * 1e6, sum(counts.values()) / rays))
+    worst = 0.0
+    same = True
+    for a, b in zip(results['chains'], results['instances']):
+        same = same and bool(a) == bool(b)
+        if a and b:
+            worst = max(worst, abs(a.t - b.t) / a.t, (a.normal - b.normal).length())
+    print('same hits: {}, largest difference in t (relative) or normal: {:.1e}'.format(same, worst))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+import random
+import argparse
+from time import perf_counter
+import numpy as np
+import rng
+from vec3 import Vec3
+from ray import Ray
+from hitable import HitableList, BVHNode, Sphere
+from material import Lambertian, DiffuseLight
+from texture import ConstantTexture
+from camera import MoBlurCamera
+from framebuffer import FrameBuffer
+from lights import LightSet, find_lights
+import main_next01 as m
+import benchmark
+
+# Many lights: 1000 emissive spheres of very different power over a
+# ground plane, their light sampled by a HitableList of them all (uniform
+# choice, every light asked for every pdf) and by a LightSet (alias table
+# by power, pdf from the lights along the direction). Reports the cost of
+# one light sample with its pdf, the relative variance of the direct light
+# estimate at points on the ground and the samples per second of a small
+# render.
+
+def scene(count):
+    local_random = random.Random(14)
+    hit_list = [Sphere(Vec3(0, -1000, 0), 1000, Lambertian(ConstantTexture(Vec3(0.5, 0.5, 0.5))))]
+    for i in range(count):
+        # a few bright lights among many dim ones
+        strength = local_random.lognormvariate(0, 1.5)
+        color = Vec3(local_random.random(), local_random.random(), local_random.random())
+        center = Vec3(local_random.uniform(-100, 100), local_random.uniform(2, 20), local_random.uniform(-100, 100))
+        hit_list.append(Sphere(center, local_random.uniform(0.2, 1.5), DiffuseLight(ConstantTexture(strength * color))))
+    return BVHNode(HitableList(hit_list), 0, 1)
+
+def points(count):
+    local_random = random.Random(15)
+    return [Vec3(local_random.uniform(-80, 80), 0.001, local_random.uniform(-80, 80)) for i in range(count)]
+
+def sample_cost(light_shape, origins):
+    start = perf_counter()
+    for o in origins:
+        light_shape.pdf_value(o, light_shape.random(o))
+    return (perf_counter() - start) / len(origins) * 1e6
+
+# mean over the points of variance / mean^2 of the light sampled estimate
+# of the light reaching the ground
+def relative_variance(world, light_shape, origins, samples):
+    up = Vec3(0, 1, 0)
+    ratios = []
+    for o in origins:
+        values = []
+        for s in range(samples):
+            direction = light_shape.random(o)
+            value = 0.0
+            cosine = direction.unit().dot(up)
+            if cosine > 0:
+                rec = world.hit(Ray(o, direction), 0.001, 1e30)
+                if rec and isinstance(rec.material, DiffuseLight):
+                    e = rec.material.emitted(Ray(o, direction), rec, rec.u, rec.v, rec.p)
+                    value = (e.x * 0.2126 + e.y * 0.7152 + e.z * 0.0722) * cosine / light_shape.pdf_value(o, direction)
+            values.append(value)
+        mean = np.mean(values)
+        if mean > 0:
+            ratios.append(np.var(values) / mean ** 2)
+    return np.mean(ratios)
+
+def render_rate(world, light_shape, size, samples):
+    m.world = world
+    m.cam = MoBlurCamera(Vec3(0, 60, 160), Vec3(0, 0, 0), Vec3(0, 1, 0), 60, 1.0, 0.0, 10, 0, 1)
+    m.hlist = light_shape
+    m.nx = m.ny = size
+    m.integrator = 'iterative'
+    m.frame = FrameBuffer(size, size, m.frame_channels)
+    seconds, image = benchmark.render(map, size, samples)
+    return size * size * samples / seconds
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--lights', type=int, default=1000)
+    parser.add_argument('--points', type=int, default=200)
+    parser.add_argument('--samples', type=int, default=64, help='light samples per point')
+    parser.add_argument('--size', type=int, default=16, help='of the render')
+    args = parser.parse_args()
+    world = scene(args.lights)
+    start = perf_counter()
+    found = find_lights(world)
+    light_set = LightSet(found)
+    print('found {} lights, LightSet built in {:.3f} s'.format(len(found), perf_counter() - start))
+    rng.reset(14)
+    origins = points(args.points)
+    print('{:<12} {:>18} {:>20} {:>12}'.format('', 'us/sample+pdf', 'relative variance', 'samples/s'))
+    for name, light_shape in (('HitableList', HitableList(found)), ('LightSet', light_set)):
+        cost = sample_cost(light_shape, origins)
+        variance = relative_variance(world, light_shape, origins, args.samples)
+        rate = render_rate(world, light_shape, args.size, 2)
+        print('{:<12} {:>18.1f} {:>20.3f} {:>12.1f}'.format(name, cost, variance, rate))
+
+if __name__ == '__main__':
+    main()
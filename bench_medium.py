@@ -0,0 +1,118 @@
+import os
+import sys
+import argparse
+import tempfile
+from math import log
+from time import perf_counter
+import numpy as np
+import rng
+import hitable
+import main_next01
+from vec3 import Vec3
+from vec3batch import Vec3Batch
+from ray import Ray
+from raybatch import RayBatch
+from hitable import HitRecord, HitRecordBatch, ConstantMedium
+from texture import ConstantTexture
+from medium import GridMedium
+
+# Sparse smoke: a grid of a few dense puffs in mostly empty space, traced
+# with one majorant for the whole grid (plain delta tracking) and with a
+# majorant per block of 8^3 voxels stepped through by DDA. Reports the cost
+# of a ray, one at a time and in a batch, and the fraction of rays that
+# scatter, which both should agree on.
+#
+# Then cornell_smoke with the previous ConstantMedium, which hit its
+# boundary twice over the whole ray, against the one that asks it for the
+# interval inside once.
+#
+#   python bench_medium.py [--size 128] [--rays 20000]
+
+# the previous ConstantMedium
+class TwoHitMedium(ConstantMedium):
+    def hit(self, ray, t_min, t_max):
+        rec1 = self.boundary.hit(ray, -sys.float_info.max, sys.float_info.max)
+        if rec1:
+            rec2 = self.boundary.hit(ray, rec1.t + 0.0001, sys.float_info.max)
+            if rec2:
+                rec1_t = max(rec1.t, t_min)
+                rec2_t = min(rec2.t, t_max)
+                if rec1_t < 0:
+                    return False
+                distInsideBoundary = (rec2_t - rec1_t) * ray.direction.length()
+                hitDistance = -(1.0 / self.density) * log(rng.random())
+                if hitDistance < distInsideBoundary:
+                    t = rec1_t + hitDistance / ray.direction.length()
+                    return HitRecord(t, 0, 0, ray.point_at_parameter(t), Vec3(1,0,0), self.material)
+        return False
+
+def smoke(size):
+    generator = np.random.RandomState(14)
+    z, y, x = np.mgrid[:size, :size, :size] / size
+    grid = np.zeros((size, size, size), dtype=np.float32)
+    for i in range(6):
+        center = generator.uniform(0.15, 0.85, 3)
+        radius = generator.uniform(0.03, 0.08)
+        distance = ((x - center[0]) ** 2 + (y - center[1]) ** 2 + (z - center[2]) ** 2) / radius ** 2
+        grid += (20 * np.exp(-distance) * (distance < 4)).astype(np.float32)
+    return grid
+
+def smoke_rays(count):
+    generator = np.random.RandomState(15)
+    origin = generator.uniform(-1, 1, (count, 3)) + np.array([0, 0, -4])
+    target = generator.uniform(-1, 1, (count, 3))
+    return origin, target - origin
+
+def trace(medium, origin, direction):
+    rng.reset(14)
+    start = perf_counter()
+    hits = 0
+    for o, d in zip(origin.tolist(), direction.tolist()):
+        if medium.hit(Ray(Vec3(*o), Vec3(*d)), 0.001, sys.float_info.max):
+            hits += 1
+    scalar = (perf_counter() - start) / len(origin) * 1e6
+    rays = RayBatch(Vec3Batch.from_array(origin), Vec3Batch.from_array(direction), np.zeros(len(origin)))
+    start = perf_counter()
+    medium.hit_batch(rays, 0.001, HitRecordBatch.empty(len(origin)))
+    batch = (perf_counter() - start) / len(origin) * 1e6
+    return scalar, batch, hits / len(origin)
+
+def cornell_rays(count):
+    generator = np.random.RandomState(1)
+    return [Ray(Vec3(*o), Vec3(*d)) for o, d in zip(generator.uniform(1, 554, (count, 3)).tolist(),
+                                                    generator.uniform(-1, 1, (count, 3)).tolist())]
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', type=int, default=128, help='voxels along each side of the smoke')
+    parser.add_argument('--rays', type=int, default=20000)
+    args = parser.parse_args()
+    origin, direction = smoke_rays(args.rays)
+    with tempfile.TemporaryDirectory() as folder:
+        name = os.path.join(folder, 'smoke.npy')
+        grid = smoke(args.size)
+        np.save(name, grid)
+        print('{0}^3 smoke, {1:.1%} of the voxels not empty'.format(args.size, np.count_nonzero(grid) / grid.size))
+        print('{:<16} {:>12} {:>12} {:>10}'.format('majorant', 'us/ray', 'batch us/ray', 'scattered'))
+        white = ConstantTexture(Vec3(1, 1, 1))
+        for label, block in (('whole grid', args.size), ('8^3 blocks', 8)):
+            medium = GridMedium(name, Vec3(-1, -1, -1), Vec3(1, 1, 1), white, block=block)
+            scalar, batch, scattered = trace(medium, origin, direction)
+            print('{:<16} {:>12.1f} {:>12.1f} {:>10.3f}'.format(label, scalar, batch, scattered))
+            del medium
+    rays = cornell_rays(args.rays)
+    print('{:<16} {:>12}'.format('cornell_smoke', 'us/ray'))
+    for label, medium_class in (('two hits', TwoHitMedium), ('interval', ConstantMedium)):
+        main_next01.ConstantMedium = medium_class
+        try:
+            world = hitable.BVHNode(main_next01.cornell_smoke(), 0, 1)
+        finally:
+            main_next01.ConstantMedium = ConstantMedium
+        rng.reset(14)
+        start = perf_counter()
+        for r in rays:
+            world.hit(r, 0.001, sys.float_info.max)
+        print('{:<16} {:>12.2f}'.format(label, (perf_counter() - start) / len(rays) * 1e6))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+import os
+import argparse
+import tempfile
+import tracemalloc
+from math import pi
+from time import perf_counter
+import numpy as np
+from vec3 import Vec3
+from vec3batch import Vec3Batch
+from ray import Ray
+from raybatch import RayBatch
+from hitable import HitRecordBatch
+import mesh
+
+# A large mesh: writes a torus of 2 * rings * sides triangles (1M by
+# default) as an OBJ file with per vertex normals and quad faces, then
+# reports the seconds to load it (parse and build its BVH), the peak of the
+# memory allocated while loading, the bytes its arrays keep, and the cost
+# of one ray through it, one at a time and in batches.
+#
+#   python bench_mesh.py [--rings 1000] [--sides 500] [--rays 20000]
+
+def write_torus(name, rings, sides, radius=3.0, tube=1.0):
+    theta = np.linspace(0, 2 * pi, rings, endpoint=False)[:, None]
+    phi = np.linspace(0, 2 * pi, sides, endpoint=False)[None, :]
+    normals = np.stack(np.broadcast_arrays(np.cos(theta) * np.cos(phi), np.sin(phi), np.sin(theta) * np.cos(phi)), axis=-1).reshape(-1, 3)
+    centers = np.stack(np.broadcast_arrays(radius * np.cos(theta), 0 * phi, radius * np.sin(theta)), axis=-1).reshape(-1, 3)
+    vertices = centers + tube * normals
+    i = np.arange(rings)[:, None]
+    j = np.arange(sides)[None, :]
+    corners = [((i + di) % rings * sides + (j + dj) % sides + 1).reshape(-1) for di, dj in ((0, 0), (0, 1), (1, 1), (1, 0))]
+    with open(name, 'w') as f:
+        for start in range(0, len(vertices), 100000):
+            f.writelines('v {:.6f} {:.6f} {:.6f}\n'.format(*p) for p in vertices[start:start + 100000].tolist())
+        for start in range(0, len(normals), 100000):
+            f.writelines('vn {:.6f} {:.6f} {:.6f}\n'.format(*n) for n in normals[start:start + 100000].tolist())
+        faces = np.stack(corners, axis=1)
+        for start in range(0, len(faces), 100000):
+            f.writelines('f {0}//{0} {1}//{1} {2}//{2} {3}//{3}\n'.format(*c) for c in faces[start:start + 100000].tolist())
+
+def rays(count):
+    generator = np.random.RandomState(14)
+    origin = generator.uniform(-6, 6, (count, 3)) + np.array([0, 0, -12])
+    target = generator.uniform(-4, 4, (count, 3)) * np.array([1, 0.3, 1])
+    return origin, target - origin
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rings', type=int, default=1000)
+    parser.add_argument('--sides', type=int, default=500)
+    parser.add_argument('--rays', type=int, default=20000)
+    parser.add_argument('--batch', type=int, default=4096)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as folder:
+        name = os.path.join(folder, 'torus.obj')
+        start = perf_counter()
+        write_torus(name, args.rings, args.sides)
+        print('wrote {:.0f} MB of OBJ in {:.2f} s'.format(os.path.getsize(name) / 2 ** 20, perf_counter() - start))
+        start = perf_counter()
+        triangles = mesh.load_obj(name)
+        seconds = perf_counter() - start
+        # again to trace the memory, which slows it down several times
+        del triangles
+        tracemalloc.start()
+        triangles = mesh.load_obj(name)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    kept = sum(a.nbytes for a in (triangles.vertices, triangles.triangles, triangles.normals, triangles.normal_triangles,
+                                  triangles.bounds, triangles.next, triangles.count, triangles.axis))
+    print('{} triangles loaded in {:.2f} s, peak {:.0f} MB while loading, {:.0f} MB of arrays ({:.0f} bytes a triangle)'.format(
+        len(triangles), seconds, peak / 2 ** 20, kept / 2 ** 20, kept / len(triangles)))
+    origin, direction = rays(args.rays)
+    start = perf_counter()
+    hits = 0
+    for o, d in zip(origin.tolist(), direction.tolist()):
+        if triangles.hit(Ray(Vec3(*o), Vec3(*d)), 0.001, 1e30):
+            hits += 1
+    scalar = (perf_counter() - start) / args.rays * 1e6
+    start = perf_counter()
+    batch_hits = 0
+    for first in range(0, args.rays, args.batch):
+        o = Vec3Batch.from_array(origin[first:first + args.batch])
+        d = Vec3Batch.from_array(direction[first:first + args.batch])
+        rec = HitRecordBatch.empty(len(o))
+        batch_hits += int(triangles.hit_batch(RayBatch(o, d, np.zeros(len(o))), 0.001, rec).sum())
+    batch = (perf_counter() - start) / args.rays * 1e6
+    print('{} rays, {} hit: {:.1f} us a ray one at a time, {:.1f} us a ray in batches of {}'.format(
+        args.rays, hits, scalar, batch, args.batch))
+    if hits != batch_hits:
+        print('scalar and batch hits differ: {} and {}'.format(hits, batch_hits))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,31 @@
+import random
+from time import perf_counter
+import numpy as np
+from vec3 import Vec3
+from vec3batch import Vec3Batch
+from perlin import Perlin
+
+# Perlin noise and turbulence per point, one Vec3 at a time and as a
+# Vec3Batch, in microseconds, and how far the two paths disagree.
+
+count = 20000
+
+def timed(fn, n):
+    start = perf_counter()
+    result = fn()
+    return (perf_counter() - start) / n * 1e6, result
+
+def main():
+    local_random = random.Random(14)
+    points = [Vec3(local_random.uniform(-8, 8), local_random.uniform(-8, 8), local_random.uniform(-8, 8)) for i in range(count)]
+    batch = Vec3Batch.from_vec3_list(points)
+    perlin = Perlin()
+    print('{:<8} {:>10} {:>10} {:>12}'.format('', 'scalar us', 'batch us', 'difference'))
+    for name, scalar, vector in (('noise', perlin.noise, perlin.noise_batch), ('turb', perlin.turb, perlin.turb_batch)):
+        scalar_us, scalar_values = timed(lambda: [scalar(p) for p in points], count)
+        batch_us, batch_values = timed(lambda: vector(batch), count)
+        difference = np.abs(np.array(scalar_values) - batch_values).max()
+        print('{:<8} {:>10.2f} {:>10.3f} {:>12.1e}'.format(name, scalar_us, batch_us, difference))
+
+if __name__ == '__main__':
+    main()
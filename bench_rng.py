@@ -0,0 +1,74 @@
+import random
+from time import perf_counter
+import numpy as np
+import rng
+import main_next01 as m
+
+# The counter based streams of rng.py against the random module: the cost
+# of a draw and of setting up a sample, a few statistics of the values,
+# and the samples of a block of pixels rendered in two different orders.
+
+seed = 14
+draws = 1000000
+tile = 16
+samples = 4
+
+def per_draw(draw):
+    start = perf_counter()
+    for i in range(draws):
+        draw()
+    return (perf_counter() - start) / draws * 1e9
+
+def timings():
+    print('ns per draw, called the way the tracer does:')
+    print('  random.random()         {:6.1f}'.format(per_draw(lambda: random.random())))
+    local = random.Random(14)
+    print('  Random(14).random()     {:6.1f}'.format(per_draw(lambda: local.random())))
+    values = rng.uniforms(seed, np.arange(draws // rng.dimensions + 1)[:, None], np.zeros(1, dtype=np.int64))
+    rng.begin(seed, 0, 0, values.ravel())
+    print('  rng.random(), bulk      {:6.1f}'.format(per_draw(lambda: rng.random())))
+    rng.begin(seed, 0, 0, values[0, 0, :0])
+    print('  rng.random(), overflow  {:6.1f}'.format(per_draw(lambda: rng.random())))
+    pixels = np.arange(tile * tile)[:, None]
+    start = perf_counter()
+    for i in range(100):
+        block = rng.uniforms(seed, pixels, np.arange(samples) + i * samples)
+    print('uniforms() of a {0}x{0} tile, {1} samples: {2:.2f} ms'.format(tile, samples, (perf_counter() - start) * 10))
+    start = perf_counter()
+    for i in range(100000):
+        rng.begin(seed, i, 0, block[0, 0])
+    print('begin() per sample: {:.2f} us'.format((perf_counter() - start) * 10))
+
+def statistics():
+    values = rng.uniforms(seed, np.arange(256 * 256)[:, None], np.arange(16))
+    print('mean {:.5f} (0.5), variance {:.5f} ({:.5f})'.format(values.mean(), values.var(), 1 / 12))
+    # the same dimension of neighbouring pixels and samples, and
+    # neighbouring dimensions of one sample
+    for label, a, b in [('pixels', values[:-1, :, 0], values[1:, :, 0]),
+                        ('samples', values[:, :-1, 0], values[:, 1:, 0]),
+                        ('dimensions', values[..., :-1], values[..., 1:])]:
+        print('correlation of neighbouring {:<10} {:+.5f}'.format(label, np.corrcoef(a.ravel(), b.ravel())[0, 1]))
+    # chi square of the pixel jitter over a 16x16 grid, 255 degrees of freedom
+    counts = np.histogram2d(values[..., 0].ravel(), values[..., 1].ravel(), bins=16, range=((0, 1), (0, 1)))[0]
+    expected = counts.sum() / counts.size
+    print('chi square of the jitter: {:.1f} (255 +- 23)'.format(((counts - expected) ** 2 / expected).sum()))
+
+def render(order):
+    image = {}
+    for y, x in order:
+        for s in range(samples):
+            rng.begin(seed, y * m.nx + x, s, rng.uniforms(seed, y * m.nx + x, s))
+            c, segments = m.sample(x, y)
+            image[(y, x, s)] = (c.x, c.y, c.z)
+    return image
+
+def reproducibility():
+    block = [(y, x) for y in range(100, 108) for x in range(100, 108)]
+    forwards = render(block)
+    backwards = render(block[::-1])
+    print('8x8 pixels rendered forwards and backwards: {}'.format('identical' if forwards == backwards else 'DIFFERENT'))
+
+if __name__ == '__main__':
+    timings()
+    statistics()
+    reproducibility()
@@ -0,0 +1,82 @@
+import math
+import random
+from time import perf_counter
+import numpy as np
+from vec3 import Vec3
+from hitable import Hitable, HitableList, BVHNode, Sphere, XZRect
+from camera import MoBlurCamera
+from main_next01 import color, trace, de_nan, cornell_box, cornell_smoke
+
+# Recursive color() against the iterative trace(), with and without Russian
+# roulette, on the Cornell scenes: time, segments traced per sample, the
+# mean radiance of the image with its z score against color(), and the
+# path length histogram of the roulette run.
+
+nx = 24
+ny = 24
+ns = 64
+rr_depth = 3
+
+class CountingHitable(Hitable):
+    def __init__(self, hitable):
+        self.hitable = hitable
+        self.rays = 0
+
+    def hit(self, ray, t_min, t_max):
+        self.rays += 1
+        return self.hitable.hit(ray, t_min, t_max)
+
+def scenes():
+    cam = MoBlurCamera(Vec3(278, 278, -800), Vec3(278, 278, 0), Vec3(0, 1, 0), 40, nx/ny, 0.0, 10, 0, 1)
+    lights = HitableList([XZRect(213, 343, 227, 332, 554, 0), Sphere(Vec3(190, 90, 190), 90, 0)])
+    yield 'cornell_box', BVHNode(cornell_box(), 0, 1), cam, lights
+    yield 'cornell_smoke', BVHNode(cornell_smoke(), 0, 1), cam, lights
+
+def render(world, cam, lights, radiance):
+    samples = np.zeros((ny * nx, ns, 3))
+    for j in range(ny):
+        for i in range(nx):
+            for s in range(ns):
+                u = (i + random.random()) / nx
+                v = (ny - 1 - j + random.random()) / ny
+                c = de_nan(radiance(cam.get_ray(u, v), world, lights))
+                samples[j * nx + i, s] = (c.x, c.y, c.z)
+    return samples
+
+def summary(samples):
+    luminance = samples.mean(axis=2)
+    mean = luminance.mean()
+    stderr = math.sqrt((luminance.var(axis=1, ddof=1) / ns).sum()) / len(luminance)
+    return mean, stderr
+
+def main():
+    print('{}x{} pixels, {} samples per pixel'.format(nx, ny, ns))
+    for name, world, cam, lights in scenes():
+        lengths = np.zeros(10, dtype=np.int64)
+        def roulette(ray, world, lights):
+            c, segments = trace(ray, world, lights, 8, rr_depth)
+            lengths[segments] += 1
+            return c
+        integrators = [('color()', lambda ray, world, lights: color(ray, world, lights, 0)),
+                       ('trace()', lambda ray, world, lights: trace(ray, world, lights, 8, None)[0]),
+                       ('trace() rr', roulette)]
+        print(name)
+        results = []
+        for label, radiance in integrators:
+            random.seed(14)
+            counter = CountingHitable(world)
+            start = perf_counter()
+            mean, stderr = summary(render(counter, cam, lights, radiance))
+            elapsed = perf_counter() - start
+            results.append((mean, stderr))
+            m0, e0 = results[0]
+            z = (mean - m0) / math.sqrt(e0 * e0 + stderr * stderr) if len(results) > 1 else 0.0
+            print('  {:>10}: {:7.2f} s {:6.2f} segments/sample  mean {:.5f} +- {:.5f}  z {:5.2f}'.format(
+                label, elapsed, counter.rays / (nx * ny * ns), mean, stderr, z))
+        total = lengths.sum()
+        print('  path segments with roulette from segment {}:'.format(rr_depth))
+        for segments in range(1, len(lengths)):
+            print('  {:>4} {:6.1%}'.format(segments, lengths[segments] / total))
+
+if __name__ == '__main__':
+    main()
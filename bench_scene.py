@@ -0,0 +1,79 @@
+import os
+import json
+import random
+import argparse
+import tempfile
+from time import perf_counter
+from vec3 import Vec3
+from ray import Ray
+from hitable import HitableList, BVHNode, Sphere
+from material import Lambertian, Metal
+from texture import ConstantTexture
+import scenefile
+
+# Loading a large scene file: writes a JSON field of spheres, then times
+# building the same scene in Python with BVHNode, the first load of the
+# file (parse, build and write the cache) and a load from the cache, and
+# checks that the loaded world hits what the Python one hits.
+
+def description(count):
+    local_random = random.Random(14)
+    objects = [{'type': 'sphere', 'center': [0, -1000, 0], 'radius': 1000, 'material': 'ground'}]
+    for i in range(count):
+        center = [local_random.uniform(-100, 100), 0.2, local_random.uniform(-100, 100)]
+        if local_random.random() < 0.8:
+            material = {'type': 'lambertian', 'albedo': [local_random.random(), local_random.random(), local_random.random()]}
+        else:
+            material = {'type': 'metal', 'albedo': [0.7, 0.6, 0.5], 'fuzz': local_random.random() / 2}
+        objects.append({'type': 'sphere', 'center': center, 'radius': 0.2, 'material': material})
+    return {'camera': {'lookfrom': [13, 2, 3], 'lookat': [0, 0, 0], 'vfov': 20},
+            'materials': {'ground': {'type': 'lambertian', 'albedo': [0.5, 0.5, 0.5]}},
+            'objects': objects}
+
+def python_world(scene):
+    hit_list = []
+    for value in scene['objects']:
+        material = value['material']
+        if material == 'ground':
+            material = Lambertian(ConstantTexture(Vec3(0.5, 0.5, 0.5)))
+        elif material['type'] == 'lambertian':
+            material = Lambertian(ConstantTexture(Vec3(*material['albedo'])))
+        else:
+            material = Metal(Vec3(*material['albedo']), material['fuzz'])
+        hit_list.append(Sphere(Vec3(*value['center']), value['radius'], material))
+    return BVHNode(HitableList(hit_list), 0, 1)
+
+def timed(function, *args):
+    start = perf_counter()
+    result = function(*args)
+    return result, perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--count', type=int, default=20000, help='spheres')
+    parser.add_argument('--rays', type=int, default=20000)
+    args = parser.parse_args()
+    scene = description(args.count)
+    with tempfile.TemporaryDirectory() as folder:
+        name = os.path.join(folder, 'spheres.json')
+        with open(name, 'w') as f:
+            json.dump(scene, f)
+        python, python_seconds = timed(python_world, scene)
+        (world, cam, lights), first = timed(scenefile.load, name, 1.0)
+        (world, cam, lights), cached = timed(scenefile.load, name, 1.0)
+        print('{} spheres'.format(args.count + 1))
+        print('{:<28} {:>8.3f} s'.format('python scene + BVHNode', python_seconds))
+        print('{:<28} {:>8.3f} s'.format('first load (compile)', first))
+        print('{:<28} {:>8.3f} s'.format('cached load (mapped)', cached))
+        local_random = random.Random(15)
+        same = True
+        for i in range(args.rays):
+            origin = Vec3(local_random.uniform(-100, 100), 5, local_random.uniform(-100, 100))
+            ray = Ray(origin, Vec3(local_random.uniform(-1, 1), -local_random.uniform(0.2, 1), local_random.uniform(-1, 1)))
+            a = python.hit(ray, 0.001, 1e30)
+            b = world.hit(ray, 0.001, 1e30)
+            same = same and bool(a) == bool(b) and (not a or a.t == b.t)
+        print('same hits for {} rays: {}'.format(args.rays, same))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+import random
+import sys
+from time import perf_counter
+import numpy as np
+from vec3 import Vec3
+from vec3batch import Vec3Batch
+from ray import Ray
+from raybatch import RayBatch
+from hitable import HitableList, HitRecordBatch, BVHNode, Sphere, XZRect, group_primitives
+from camera import MoBlurCamera
+import pdf
+import wavefront
+from main_next01 import cornell_box, cornell_smoke, random_scene
+
+# Per-object hitables against SphereSet/RectSet grouping, for single rays
+# (hit) and for batches (hit_batch), then a wavefront render of each scene
+# both ways from the same random stream to show the image is unchanged
+# (cornell_smoke differs: its media draw randoms per BVH subset).
+
+ray_count = 4000
+nx = ny = 24
+ns = 4
+
+def scenes():
+    cornell_cam = MoBlurCamera(Vec3(278, 278, -800), Vec3(278, 278, 0), Vec3(0, 1, 0), 40, 1, 0.0, 10, 0, 1)
+    cornell_lights = HitableList([XZRect(213, 343, 227, 332, 554, 0), Sphere(Vec3(190, 90, 190), 90, 0)])
+    yield 'cornell_box', cornell_box(), cornell_cam, cornell_lights, (1, 554, 1, 554)
+    yield 'cornell_smoke', cornell_smoke(), cornell_cam, cornell_lights, (1, 554, 1, 554)
+    random.seed(14)
+    random_cam = MoBlurCamera(Vec3(13, 2, 3), Vec3(0, 0, 0), Vec3(0, 1, 0), 20, 1, 0.08, 10, 0, 1)
+    yield 'random_scene', random_scene(), random_cam, HitableList([Sphere(Vec3(0, 20, 0), 5, 0)]), (-10, 10, 0.1, 3)
+
+def random_rays(bounds, rng):
+    lo, hi, y_lo, y_hi = bounds
+    rays = []
+    for i in range(ray_count):
+        origin = Vec3(rng.uniform(lo, hi), rng.uniform(y_lo, y_hi), rng.uniform(lo, hi))
+        rays.append(Ray(origin, Vec3(rng.uniform(-1, 1), rng.uniform(-1, 1), rng.uniform(-1, 1)), rng.random()))
+    batch = RayBatch(Vec3Batch.from_vec3_list([r.origin for r in rays]),
+                     Vec3Batch.from_vec3_list([r.direction for r in rays]),
+                     np.array([r.time for r in rays]))
+    return rays, batch
+
+def render(world, cam, lights):
+    pdf.seed_batch_random(14)
+    return wavefront.render_tile(cam, world, lights, nx, ny, ns, 0, 0, nx, ny)
+
+def main():
+    np.seterr(all='ignore')
+    print('{:>14} {:>12} {:>14} {:>14}'.format('scene', 'world', 'hit us/ray', 'batch us/ray'))
+    for name, scene, cam, lights, bounds in scenes():
+        rays, batch = random_rays(bounds, random.Random(1))
+        worlds = [('objects', BVHNode(scene, 0, 1)), ('sets', BVHNode(group_primitives(scene, 32), 0, 1))]
+        for label, world in worlds:
+            start = perf_counter()
+            for r in rays:
+                world.hit(r, 0.001, sys.float_info.max)
+            scalar = perf_counter() - start
+            start = perf_counter()
+            world.hit_batch(batch, 0.001, HitRecordBatch.empty(len(batch)))
+            batched = perf_counter() - start
+            print('{:>14} {:>12} {:>14.2f} {:>14.2f}'.format(name, label, scalar / ray_count * 1e6, batched / ray_count * 1e6))
+        times = []
+        images = []
+        for label, world in worlds:
+            start = perf_counter()
+            images.append(render(world, cam, lights))
+            times.append(perf_counter() - start)
+        print('{:>14} wavefront render {:.2f} s -> {:.2f} s, max pixel difference {:.2g}'.format(
+            name, times[0], times[1], np.abs(images[0] - images[1]).max()))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+import json
+import pickle
+import resource
+import subprocess
+import sys
+from multiprocessing import Pool, cpu_count
+from time import perf_counter
+import numpy as np
+from vec3 import Vec3
+from hitable import BVHNode, HitRecordBatch
+from camera import MoBlurCamera
+from framebuffer import FrameBuffer, SharedFrameBuffer
+import scheduler
+import wavefront
+from main_next01 import cornell_box
+
+# How tiles get back to the parent on an 800x800 render: the original
+# Pool.map of Vec3 lists flattened into one all_col list, a float32 array
+# per tile streamed through imap_unordered, or workers writing into a
+# SharedFrameBuffer and returning only tile and timing. Pixels are a primary-hit normal shade so the run is dominated
+# by moving results, not by tracing. Each mode runs in its own process so
+# the parent's peak RSS is its own; IPC bytes are the pickled size of
+# everything the pool sent back.
+# python bench_shared.py [size]
+
+size = 800
+tile_size = 16
+modes = ('vec3 list', 'array', 'shared')
+
+world = BVHNode(cornell_box(), 0, 1)
+cam = MoBlurCamera(Vec3(278, 278, -800), Vec3(278, 278, 0), Vec3(0, 1, 0), 40, 1, 0.0, 10, 0, 1)
+frame = None
+
+def shade(tile):
+    rays = wavefront.camera_rays(cam, size, size, tile.x0, tile.y0, tile.x1, tile.y1)
+    rec = HitRecordBatch.empty(len(rays))
+    world.hit_batch(rays, 0.001, rec)
+    return np.abs(rec.normal.to_array()).reshape(tile.y1 - tile.y0, tile.x1 - tile.x0, 3).astype(np.float32)
+
+def render_list(tile):
+    start = perf_counter()
+    colors = [Vec3(*c) for c in shade(tile).reshape(-1, 3).tolist()]
+    return tile, colors, perf_counter() - start
+
+def render_array(tile):
+    start = perf_counter()
+    pixels = shade(tile)
+    return tile, pixels, perf_counter() - start
+
+def attach_frame(name):
+    global frame
+    frame = SharedFrameBuffer(size, size, name)
+
+def render_shared(tile):
+    start = perf_counter()
+    frame.set_tile(tile.x0, tile.y0, shade(tile))
+    return tile, perf_counter() - start
+
+def run(mode):
+    tiles = scheduler.make_tiles(size, size, tile_size)
+    workers = max(cpu_count() - 1, 1)
+    ipc = 0
+    start = perf_counter()
+    if mode == 'shared':
+        image = SharedFrameBuffer(size, size)
+        with Pool(workers, attach_frame, (image.name,)) as p:
+            for result in scheduler.run(p, render_shared, tiles):
+                ipc += len(pickle.dumps(result))
+    elif mode == 'array':
+        image = FrameBuffer(size, size)
+        with Pool(workers) as p:
+            for tile, pixels, seconds in scheduler.run(p, render_array, tiles):
+                ipc += len(pickle.dumps((tile, pixels, seconds)))
+                image.set_tile(tile.x0, tile.y0, pixels)
+    else:
+        image = FrameBuffer(size, size)
+        with Pool(workers) as p:
+            results = p.map(render_list, tiles)
+        ipc = sum(len(pickle.dumps(result)) for result in results)
+        all_col = []
+        for tile, colors, seconds in results:
+            all_col.extend(colors)
+        # tiles were appended in scanline order, put them back in place
+        offset = 0
+        for tile, colors, seconds in results:
+            count = (tile.y1 - tile.y0) * (tile.x1 - tile.x0)
+            pixels = np.array([(c.x, c.y, c.z) for c in all_col[offset:offset + count]], dtype=np.float32)
+            image.set_tile(tile.x0, tile.y0, pixels.reshape(tile.y1 - tile.y0, tile.x1 - tile.x0, 3))
+            offset += count
+    wall = perf_counter() - start
+    checksum = float(image.pixels.sum(dtype=np.float64))
+    if mode == 'shared':
+        image.close()
+        image.unlink()
+    return {'seconds': wall, 'ipc_bytes': ipc, 'peak_rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+            'checksum': checksum}
+
+def main():
+    global size
+    if len(sys.argv) > 3 and sys.argv[1] == '--mode':
+        size = int(sys.argv[3])
+        print(json.dumps(run(sys.argv[2])))
+        return
+    if len(sys.argv) > 1:
+        size = int(sys.argv[1])
+    print('{0}x{0}, {1}px tiles'.format(size, tile_size))
+    print('{:>10} {:>10} {:>12} {:>14} {:>14}'.format('mode', 'seconds', 'IPC MB', 'parent RSS MB', 'checksum'))
+    for mode in modes:
+        out = subprocess.run([sys.executable, __file__, '--mode', mode, str(size)],
+                             check=True, capture_output=True, text=True).stdout
+        r = json.loads(out.splitlines()[-1])
+        print('{:>10} {:>10.2f} {:>12.2f} {:>14.1f} {:>14.1f}'.format(
+            mode, r['seconds'], r['ipc_bytes'] / 1e6, r['peak_rss'] / 1e6, r['checksum']))
+
+if __name__ == '__main__':
+    main()
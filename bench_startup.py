@@ -0,0 +1,155 @@
+import os
+import gc
+import json
+import random
+import argparse
+import tempfile
+import multiprocessing
+from time import perf_counter
+import numpy as np
+from vec3 import Vec3
+from hitable import HitableList, BVHNode, group_primitives, Sphere
+from material import Lambertian, DiffuseLight
+from texture import ConstantTexture
+from camera import MoBlurCamera
+from framebuffer import SharedFrameBuffer
+import main_next01 as m
+import scheduler
+import sharedscene
+import scenefile
+
+# Pool start up with a large scene: a field of spheres rendered by a pool
+# of workers that get the scene
+#
+#   fork               inherited from the parent as main_next01 does today
+#   fork, frozen       inherited after sharedscene.publish()'s gc.freeze()
+#   spawn, rebuild     built again by every worker
+#   spawn, shared      unpickled from sharedscene's shared memory block
+#   spawn, scene file  loaded from the compiled cache of a scene file
+#
+# and reports the seconds from making the pool to the first finished tile
+# and to the whole image, and the mean memory of a worker after it: its
+# RSS, its proportional share of the pages it shares (PSS) and the pages
+# only it has (private, what copy-on-write cost it). The world is built as
+# main_next01 builds it for --integrator: a BVHNode over the spheres, or
+# over SphereSets of them for the wavefront integrator, whose arrays a
+# spawned worker maps from the shared block.
+#
+#   python bench_startup.py [--objects 50000] [--workers 16] [--integrator iterative]
+
+size = 64
+tile_size = 16
+modes = ('fork', 'fork, frozen', 'spawn, rebuild', 'spawn, shared', 'spawn, scene file')
+
+def description(count):
+    local_random = random.Random(14)
+    objects = [{'type': 'sphere', 'center': [0, -1000, 0], 'radius': 1000, 'material': {'type': 'lambertian', 'albedo': [0.5, 0.5, 0.5]}},
+               {'type': 'sphere', 'center': [0, 60, 0], 'radius': 20, 'material': {'type': 'diffuse_light', 'emit': [4, 4, 4]}}]
+    for i in range(count - 2):
+        objects.append({'type': 'sphere', 'center': [local_random.uniform(-150, 150), 0.4, local_random.uniform(-150, 150)],
+                        'radius': 0.4, 'material': {'type': 'lambertian', 'albedo': [local_random.random() for c in range(3)]}})
+    return {'camera': {'lookfrom': [0, 80, 200], 'lookat': [0, 0, 0], 'vfov': 60},
+            'objects': objects,
+            'lights': [{'type': 'sphere', 'center': [0, 60, 0], 'radius': 20}]}
+
+def build(description):
+    hit_list = []
+    for value in description['objects']:
+        material = value['material']
+        if material['type'] == 'lambertian':
+            material = Lambertian(ConstantTexture(Vec3(*material['albedo'])))
+        else:
+            material = DiffuseLight(ConstantTexture(Vec3(*material['emit'])))
+        hit_list.append(Sphere(Vec3(*value['center']), value['radius'], material))
+    scene = HitableList(hit_list)
+    if m.integrator == 'wavefront':
+        scene = group_primitives(scene, 32)
+    cam = MoBlurCamera(Vec3(0, 80, 200), Vec3(0, 0, 0), Vec3(0, 1, 0), 60, 1.0, 0.0, 10, 0, 1)
+    return BVHNode(scene, 0, 1), cam, Sphere(Vec3(0, 60, 0), 20, 0)
+
+def memory():
+    values = {}
+    with open('/proc/self/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if parts[0] in ('Rss:', 'Pss:', 'Private_Clean:', 'Private_Dirty:'):
+                values[parts[0][:-1]] = int(parts[1]) / 1024
+    return values['Rss'], values['Pss'], values['Private_Clean'] + values['Private_Dirty']
+
+def init_worker(frame_name, handle, scene_json, integrator):
+    m.nx = m.ny = size
+    m.integrator = integrator
+    m.attach_frame(frame_name, size, size, False, handle)
+    if scene_json:
+        with open(scene_json) as f:
+            m.world, m.cam, m.hlist = build(json.load(f))
+
+# one per worker, all of them wait so that no worker takes two
+def report(barrier):
+    barrier.wait()
+    return os.getpid(), memory()
+
+def run(mode, scene, scene_name, workers):
+    context = multiprocessing.get_context(mode.split(',')[0])
+    m.nx = m.ny = size
+    m.world, m.cam, m.hlist = scene
+    handle = None
+    rebuild = None
+    if mode == 'fork, frozen' or mode == 'spawn, shared':
+        handle = sharedscene.publish(scene, method=context.get_start_method())
+    elif mode == 'spawn, scene file':
+        handle = sharedscene.publish(scene, scene_name, context.get_start_method())
+    elif mode == 'spawn, rebuild':
+        rebuild = scene_name
+    frame = SharedFrameBuffer(size, size, channels=m.frame_channels)
+    jobs = [(tile, np.zeros((tile.y1 - tile.y0, tile.x1 - tile.x0), dtype=np.int64), None, 1)
+            for tile in scheduler.make_tiles(size, size, tile_size)]
+    manager = context.Manager()
+    try:
+        start = perf_counter()
+        with context.Pool(workers, init_worker, (frame.name, handle, rebuild, m.integrator)) as pool:
+            first = None
+            for result in pool.imap_unordered(m.render_loop, jobs):
+                if first is None:
+                    first = perf_counter() - start
+            total = perf_counter() - start
+            barrier = manager.Barrier(workers)
+            reports = dict(pool.map(report, [barrier] * workers, chunksize=1))
+    finally:
+        manager.shutdown()
+        sharedscene.release()
+        frame.close()
+        frame.unlink()
+    rss, pss, private = np.mean(list(reports.values()), axis=0)
+    return first, total, rss, pss, private
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--objects', type=int, default=50000)
+    parser.add_argument('--workers', type=int, default=16)
+    parser.add_argument('--integrator', default='iterative', choices=('iterative', 'recursive', 'wavefront'))
+    parser.add_argument('modes', nargs='*', default=modes)
+    args = parser.parse_args()
+    m.integrator = args.integrator
+    with tempfile.TemporaryDirectory() as folder:
+        scene_name = os.path.join(folder, 'spheres.json')
+        with open(scene_name, 'w') as f:
+            json.dump(description(args.objects), f)
+        start = perf_counter()
+        with open(scene_name) as f:
+            scene = build(json.load(f))
+        print('{} objects built in {:.2f} s, parent RSS {:.0f} MB'.format(args.objects, perf_counter() - start, memory()[0]))
+        if 'spawn, scene file' in args.modes:
+            start = perf_counter()
+            scenefile.compile_scene(scene_name)
+            print('scene file compiled in {:.2f} s'.format(perf_counter() - start))
+        print('{} workers, {}x{} image, 1 sample per pixel, {} integrator, {} CPUs'.format(
+            args.workers, size, size, args.integrator, os.cpu_count()))
+        print('{:<18} {:>12} {:>10} {:>12} {:>12} {:>12}'.format('', 'first tile s', 'image s', 'RSS MB', 'PSS MB', 'private MB'))
+        for mode in args.modes:
+            gc.unfreeze()
+            first, total, rss, pss, private = run(mode, scene, scene_name, args.workers)
+            print('{:<18} {:>12.2f} {:>10.2f} {:>12.1f} {:>12.1f} {:>12.1f}'.format(mode, first, total, rss, pss, private))
+
+if __name__ == '__main__':
+    main()
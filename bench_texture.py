@@ -0,0 +1,68 @@
+import os
+import argparse
+import tempfile
+from time import perf_counter
+from multiprocessing import Pool
+import numpy as np
+from framebuffer import PPMWriter
+import mipmap
+from texture import ImageTexture
+
+# Memory and speed of ImageTexture with many large images: writes count
+# size x size PPMs, builds their mipmap caches, then samples all of them
+# at random in a worker process and reports its resident memory before and
+# after, against what holding the images as float32 arrays would take.
+
+def resident_mb():
+    with open('/proc/self/status') as status:
+        for line in status:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+
+# a smooth gradient with a pattern, written a band at a time
+def write_image(name, size, seed):
+    with PPMWriter(name, size, size) as image:
+        for y0 in range(0, size, 256):
+            ys, xs = np.mgrid[y0:min(y0 + 256, size), 0:size] / size
+            tile = np.stack((xs, ys, 0.5 + 0.5 * np.sin(40 * (xs + seed) * ys)), axis=-1)
+            image.write_tile(0, y0, tile)
+
+def sample(names, lookups, footprint):
+    textures = [ImageTexture(name, size=1.0) for name in names]
+    before = resident_mb()
+    local_random = np.random.RandomState(14)
+    u = local_random.rand(lookups)
+    v = local_random.rand(lookups)
+    which = local_random.randint(len(textures), size=lookups)
+    start = perf_counter()
+    for i in range(lookups):
+        textures[which[i]].value(u[i], v[i], None, footprint)
+    seconds = perf_counter() - start
+    return before, resident_mb(), seconds / lookups * 1e6, mipmap.tile_loads
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--count', type=int, default=4, help='images')
+    parser.add_argument('--size', type=int, default=4096, help='width and height of each image')
+    parser.add_argument('--lookups', type=int, default=100000, help='random lookups per run')
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as folder:
+        names = [os.path.join(folder, 'image{}.ppm'.format(i)) for i in range(args.count)]
+        start = perf_counter()
+        for i, name in enumerate(names):
+            write_image(name, args.size, i)
+        print('wrote {} {}x{} PPMs in {:.1f} s'.format(args.count, args.size, args.size, perf_counter() - start))
+        start = perf_counter()
+        for name in names:
+            ImageTexture(name)
+        cache_mb = sum(os.path.getsize(mipmap.cache_name(name)) for name in names) / 2 ** 20
+        print('built the mipmap caches in {:.1f} s, {:.0f} MB on disk'.format(perf_counter() - start, cache_mb))
+        print('as float32 arrays the images would take {:.0f} MB'.format(args.count * args.size ** 2 * 12 / 2 ** 20))
+        print('{:<22} {:>10} {:>10} {:>10} {:>12}'.format('worker', 'RSS MB', 'after MB', 'us/lookup', 'tiles read'))
+        for label, footprint in (('full resolution', 0), ('footprint 1/256', 1 / 256)):
+            with Pool(1) as pool:
+                before, after, us, loads = pool.apply(sample, (names, args.lookups, footprint))
+                print('{:<22} {:>10.1f} {:>10.1f} {:>10.2f} {:>12}'.format(label, before, after, us, loads))
+
+if __name__ == '__main__':
+    main()
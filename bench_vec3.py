@@ -0,0 +1,41 @@
+import random
+from time import perf_counter
+from vec3 import Vec3
+from vec3batch import Vec3Batch
+
+# Scalar Vec3 against Vec3Batch on the operations the renderer spends
+# its time in. Times are per vector, in nanoseconds.
+
+count = 200000
+
+def timed(fn):
+    start = perf_counter()
+    fn()
+    return (perf_counter() - start) / count * 1e9
+
+def main():
+    rng = random.Random(14)
+    a = [Vec3(rng.random(), rng.random(), rng.random()) for i in range(count)]
+    b = [Vec3(rng.random(), rng.random(), rng.random()) for i in range(count)]
+    ab = Vec3Batch.from_vec3_list(a)
+    bb = Vec3Batch.from_vec3_list(b)
+    cases = [
+        ('u + v', lambda: [u + v for u, v in zip(a, b)], lambda: ab + bb),
+        ('k * u', lambda: [0.5 * u for u in a], lambda: 0.5 * ab),
+        ('u + k * v', lambda: [u + 0.5 * v for u, v in zip(a, b)], lambda: ab + 0.5 * bb),
+        ('dot', lambda: [u.dot(v) for u, v in zip(a, b)], lambda: ab.dot(bb)),
+        ('cross', lambda: [u.cross(v) for u, v in zip(a, b)], lambda: ab.cross(bb)),
+        ('unit', lambda: [u.unit() for u in a], lambda: ab.unit()),
+        ('length', lambda: [u.length() for u in a], lambda: ab.length()),
+    ]
+    print('{} vectors'.format(count))
+    print('{:>10} {:>12} {:>12} {:>10}'.format('op', 'Vec3 ns', 'batch ns', 'speedup'))
+    for name, scalar, batch in cases:
+        scalar_ns = timed(scalar)
+        batch_ns = timed(batch)
+        print('{:>10} {:>12.1f} {:>12.2f} {:>10.1f}'.format(name, scalar_ns, batch_ns, scalar_ns / batch_ns))
+    print('{:>10} {:>12.1f}'.format('to list', timed(lambda: ab.to_vec3_list())))
+    print('{:>10} {:>12.1f}'.format('from list', timed(lambda: Vec3Batch.from_vec3_list(a))))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+import math
+import random
+import sys
+from time import perf_counter
+import numpy as np
+from vec3 import Vec3
+from hitable import Hitable, HitableList, BVHNode, group_primitives, Sphere, XZRect
+from material import DiffuseLight
+from texture import ConstantTexture
+from camera import MoBlurCamera
+import wavefront
+import main_next01
+import pdf
+import rng
+from main_next01 import color, de_nan, cornell_box, random_scene
+
+# Recursive color() against the wavefront integrator on the same scenes,
+# each integrator given the world main_next01 builds for it (the wavefront
+# one with the spheres and rects in array backed sets). Reports rays/sec
+# and samples/sec for both, and checks that the two agree statistically:
+# the image mean radiance (z score from the per pixel variances) and the
+# mean number of rays traced per sample. The random numbers of both come
+# from fixed seeds, so the z scores are the same on every run.
+#
+#   python bench_wavefront.py [samples per pixel]
+
+nx = 32
+ny = 32
+ns = 64
+
+class CountingHitable(Hitable):
+    def __init__(self, hitable):
+        self.hitable = hitable
+        self.rays = 0
+
+    def hit(self, ray, t_min, t_max):
+        self.rays += 1
+        return self.hitable.hit(ray, t_min, t_max)
+
+    def hit_batch(self, rays, t_min, rec):
+        self.rays += len(rays)
+        return self.hitable.hit_batch(rays, t_min, rec)
+
+# (name, world for color(), world for the wavefront integrator, camera, light shape)
+def scenes():
+    cornell_cam = MoBlurCamera(Vec3(278, 278, -800), Vec3(278, 278, 0), Vec3(0, 1, 0), 40, nx/ny, 0.0, 10, 0, 1)
+    cornell_lights = HitableList([XZRect(213, 343, 227, 332, 554, 0), Sphere(Vec3(190, 90, 190), 90, 0)])
+    scene = cornell_box()
+    yield 'cornell_box', BVHNode(scene, 0, 1), BVHNode(group_primitives(scene, 32), 0, 1), cornell_cam, cornell_lights
+    random.seed(14)
+    random_cam = MoBlurCamera(Vec3(13, 2, 3), Vec3(0, 0, 0), Vec3(0, 1, 0), 20, nx/ny, 0.08, 10, 0, 1)
+    # random_scene has no emitters of its own, a sphere light above it
+    # gives the two integrators some radiance to agree on
+    scene = random_scene()
+    scene.append(Sphere(Vec3(0, 20, 0), 5, DiffuseLight(ConstantTexture(Vec3(15, 15, 15)))))
+    random_lights = HitableList([Sphere(Vec3(0, 20, 0), 5, 0)])
+    yield 'random_scene', BVHNode(scene, 0, 1), BVHNode(group_primitives(scene, 32), 0, 1), random_cam, random_lights
+
+def render_scalar(world, cam, lights):
+    rng.reset(14)
+    samples = np.zeros((ny * nx, ns, 3))
+    for j in range(ny):
+        for i in range(nx):
+            for s in range(ns):
+                u = (i + rng.random()) / nx
+                v = (ny - 1 - j + rng.random()) / ny
+                c = de_nan(color(cam.get_ray(u, v), world, lights, 0))
+                samples[j * nx + i, s] = (c.x, c.y, c.z)
+    return samples
+
+def render_wavefront(world, cam, lights):
+    pdf.seed_batch_random(14)
+    samples = np.zeros((ny * nx, ns, 3))
+    for s in range(ns):
+        rays = wavefront.camera_rays(cam, nx, ny, 0, 0, nx, ny)
+        samples[:, s] = wavefront.de_nan(wavefront.trace_batch(rays, world, lights)).to_array()
+    return samples
+
+def summary(samples):
+    luminance = samples.mean(axis=2)
+    mean = luminance.mean()
+    stderr = math.sqrt((luminance.var(axis=1, ddof=1) / ns).sum()) / len(luminance)
+    return mean, stderr
+
+def main():
+    global ns
+    if len(sys.argv) > 1:
+        ns = int(sys.argv[1])
+    print('{}x{} pixels, {} samples per pixel'.format(nx, ny, ns))
+    for name, scalar_world, wavefront_world, cam, lights in scenes():
+        results = []
+        for label, render, world in (('color()', render_scalar, scalar_world), ('wavefront', render_wavefront, wavefront_world)):
+            counter = CountingHitable(world)
+            start = perf_counter()
+            samples = render(counter, cam, lights)
+            elapsed = perf_counter() - start
+            results.append((label, elapsed, counter.rays, summary(samples)))
+        print(name)
+        for label, elapsed, rays, (mean, stderr) in results:
+            print('  {:>10}: {:8.2f} s {:10.0f} rays/s {:9.0f} samples/s  {:.3f} rays/sample  mean {:.5f} +- {:.5f}'.format(
+                label, elapsed, rays / elapsed, nx * ny * ns / elapsed, rays / (nx * ny * ns), mean, stderr))
+        (_, t0, r0, (m0, e0)), (_, t1, r1, (m1, e1)) = results
+        z = (m1 - m0) / math.sqrt(e0 * e0 + e1 * e1) if e0 or e1 else 0.0
+        print('  speedup {:.1f}x in rays/s, mean radiance z score {:.2f}'.format((r1 / t1) / (r0 / t0), z))
+
+if __name__ == '__main__':
+    main()
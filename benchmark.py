@@ -0,0 +1,228 @@
+import os
+import sys
+import json
+import random
+import argparse
+import platform
+import resource
+import tempfile
+import tracemalloc
+from time import perf_counter
+from multiprocessing import Pool
+import numpy as np
+from vec3 import Vec3
+from aabb import AABB
+from hitable import HitableList, BVHNode, group_primitives, Sphere, MovingSphere, XYRect, XZRect, YZRect, Box, SphereSet, RectSet
+from camera import MoBlurCamera
+from framebuffer import FrameBuffer, SharedFrameBuffer, Accumulator
+import main_next01 as m
+import scheduler
+
+# Render throughput of every built-in scene at a small fixed size, once in
+# this process and once through a worker pool, with the renderer's own
+# passes and scheduler. Reports samples, rays and intersection tests per
+# second and peak memory, writes them as JSON and compares them with a
+# stored baseline:
+#
+#   python benchmark.py --output base.json
+#   ... change things ...
+#   python benchmark.py --baseline base.json --threshold 0.1
+#
+# exits with 1 when any scene got slower than the threshold allows.
+
+# builder, lookfrom, lookat, vertical fov, aperture, light shapes (None
+# for scenes lit by nothing the pdf can sample)
+scenes = {
+    'random_scene': (m.random_scene, Vec3(13, 2, 3), Vec3(0, 0, 0), 20, 0.08, lambda: None),
+    'two_sphere': (m.two_sphere, Vec3(13, 2, 3), Vec3(0, 0, 0), 20, 0.0, lambda: None),
+    'two_perlin_sphere': (m.two_perlin_sphere, Vec3(13, 2, 3), Vec3(0, 2, 0), 20, 0.0, lambda: None),
+    'two_marble_sphere': (m.two_marble_sphere, Vec3(13, 2, 3), Vec3(0, 2, 0), 20, 0.0, lambda: None),
+    'simple_light': (m.simple_light, Vec3(22, 3, 3), Vec3(0, 2, 0), 40, 0.0, lambda: Sphere(Vec3(0, 7, 0), 2, 0)),
+    'cornell_box': (m.cornell_box, Vec3(278, 278, -800), Vec3(278, 278, 0), 40, 0.0,
+                    lambda: HitableList([XZRect(213, 343, 227, 332, 554, 0), Sphere(Vec3(190, 90, 190), 90, 0)])),
+    'cornell_smoke': (m.cornell_smoke, Vec3(278, 278, -800), Vec3(278, 278, 0), 40, 0.0,
+                      lambda: XZRect(113, 443, 127, 432, 554, 0)),
+}
+
+# the throughput numbers compared with the baseline, higher is better
+compared = ('samples_per_sec', 'rays_per_sec', 'tests_per_sec')
+
+# point main_next01's renderer at a scene, in the parent and in each worker
+def use_scene(name, size, integrator):
+    builder, lookfrom, lookat, vfov, aperture, lights = scenes[name]
+    # random_scene places its spheres with the random module
+    random.seed(14)
+    scene = builder()
+    if integrator == 'wavefront':
+        scene = group_primitives(scene, 32)
+    m.world = BVHNode(scene, 0, 1)
+    m.cam = MoBlurCamera(lookfrom, lookat, Vec3(0, 1, 0), vfov, 1.0, aperture, 10, 0, 1)
+    m.hlist = lights()
+    m.nx = m.ny = size
+    m.integrator = integrator
+
+def init_worker(name, size, integrator, frame_name):
+    use_scene(name, size, integrator)
+    m.attach_frame(frame_name, size, size)
+
+# renders the whole image, run(render_loop, jobs) as in render_passes
+def render(run, size, samples):
+    with tempfile.TemporaryDirectory() as directory:
+        accumulator = Accumulator(os.path.join(directory, 'bench.accum.npy'), size, size)
+        start = perf_counter()
+        m.render_passes(run, accumulator, scheduler.make_tiles(size, size, m.tile_size), samples)
+        seconds = perf_counter() - start
+        image = accumulator.frame().pixels.copy()
+        del accumulator
+    return seconds, image
+
+# Counts rays (calls to the world) and intersection tests (calls to the
+# primitives and bounding boxes, a ray against every member of a
+# SphereSet/RectSet) of one render in this process. The random streams
+# are keyed by pixel and sample, so the counts hold for the timed renders
+# too. Also gives the peak of the Python heap while building and rendering.
+class Counter:
+    def __init__(self):
+        self.counts = {'rays': 0, 'tests': 0, 'box_tests': 0}
+
+    def wrap(self, cls, key):
+        counts = self.counts
+        hit = cls.__dict__['hit']
+        hit_batch = cls.__dict__.get('hit_batch')
+        def counted_hit(obj, ray, *args):
+            counts[key] += len(obj) if hasattr(obj, '__len__') else 1
+            return hit(obj, ray, *args)
+        cls.hit = counted_hit
+        if hit_batch:
+            def counted_hit_batch(obj, rays, *args):
+                counts[key] += len(rays) * (len(obj) if hasattr(obj, '__len__') else 1)
+                return hit_batch(obj, rays, *args)
+            cls.hit_batch = counted_hit_batch
+        return cls, hit, hit_batch
+
+    def run(self, name, size, samples, integrator):
+        wrapped = [self.wrap(cls, 'tests') for cls in (Sphere, MovingSphere, XYRect, XZRect, YZRect, Box, SphereSet, RectSet)]
+        wrapped.append(self.wrap(AABB, 'box_tests'))
+        tracemalloc.start()
+        try:
+            use_scene(name, size, integrator)
+            m.world = CountingWorld(m.world, self.counts)
+            m.frame = FrameBuffer(size, size, m.frame_channels)
+            render(map, size, samples)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+            for cls, hit, hit_batch in wrapped:
+                cls.hit = hit
+                if hit_batch:
+                    cls.hit_batch = hit_batch
+        return dict(self.counts, peak_heap_mb=peak / 2 ** 20)
+
+class CountingWorld:
+    def __init__(self, world, counts):
+        self.world = world
+        self.counts = counts
+
+    def hit(self, ray, t_min, t_max):
+        self.counts['rays'] += 1
+        return self.world.hit(ray, t_min, t_max)
+
+    def hit_batch(self, rays, t_min, rec):
+        self.counts['rays'] += len(rays)
+        return self.world.hit_batch(rays, t_min, rec)
+
+def throughput(seconds, counts, size, samples):
+    tests = counts['tests'] + counts['box_tests']
+    return {'seconds': seconds,
+            'samples_per_sec': size * size * samples / seconds,
+            'rays_per_sec': counts['rays'] / seconds,
+            'tests_per_sec': tests / seconds}
+
+def bench_scene(name, args):
+    counts = Counter().run(name, args.size, args.samples, args.integrator)
+    result = dict(counts)
+    use_scene(name, args.size, args.integrator)
+    m.frame = FrameBuffer(args.size, args.size, m.frame_channels)
+    seconds, serial_image = min((render(map, args.size, args.samples) for i in range(args.repeat)), key=lambda r: r[0])
+    result['serial'] = throughput(seconds, counts, args.size, args.samples)
+    frame = SharedFrameBuffer(args.size, args.size, channels=m.frame_channels)
+    m.frame = frame
+    try:
+        start = perf_counter()
+        with Pool(args.workers, init_worker, (name, args.size, args.integrator, frame.name)) as pool:
+            # the first job only returns once a worker is up
+            pool.apply(int)
+            startup = perf_counter() - start
+            seconds, pool_image = min((render(lambda render, jobs: scheduler.run(pool, render, jobs), args.size, args.samples)
+                                      for i in range(args.repeat)), key=lambda r: r[0])
+    finally:
+        frame.close()
+        frame.unlink()
+    result['pool'] = dict(throughput(seconds, counts, args.size, args.samples), workers=args.workers, startup=startup)
+    result['identical'] = bool(np.array_equal(serial_image, pool_image))
+    return result
+
+def compare(results, baseline, threshold):
+    regressions = []
+    for name, result in results['scenes'].items():
+        old = baseline['scenes'].get(name)
+        if not old:
+            continue
+        for mode in ('serial', 'pool'):
+            for key in compared:
+                if old[mode][key] and result[mode][key] < old[mode][key] * (1 - threshold):
+                    regressions.append((name, mode, key, old[mode][key], result[mode][key]))
+    return regressions
+
+def print_table(results, baseline=None):
+    print('{:<18} {:>6} {:>9} {:>11} {:>12} {:>9} {:>8}'.format(
+        'scene', 'mode', 'samples/s', 'rays/s', 'tests/s', 'heap MB', 'change'))
+    for name, result in results['scenes'].items():
+        for mode in ('serial', 'pool'):
+            r = result[mode]
+            change = ''
+            if baseline and name in baseline['scenes']:
+                change = '{:+.1%}'.format(r['samples_per_sec'] / baseline['scenes'][name][mode]['samples_per_sec'] - 1)
+            print('{:<18} {:>6} {:>9.1f} {:>11.0f} {:>12.0f} {:>9.1f} {:>8}'.format(
+                name, mode, r['samples_per_sec'], r['rays_per_sec'], r['tests_per_sec'], result['peak_heap_mb'], change))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('scenes', nargs='*', default=list(scenes), help='scenes to render, all by default')
+    parser.add_argument('--size', type=int, default=32, help='image width and height')
+    parser.add_argument('--samples', type=int, default=8, help='samples per pixel')
+    parser.add_argument('--workers', type=int, default=m.threads, help='processes of the pool mode')
+    parser.add_argument('--integrator', default=m.integrator, choices=('iterative', 'recursive', 'wavefront'))
+    parser.add_argument('--repeat', type=int, default=1, help='timed renders per mode, the fastest counts')
+    parser.add_argument('--output', default='benchmark.json', help='JSON results')
+    parser.add_argument('--baseline', help='JSON results to compare with')
+    parser.add_argument('--threshold', type=float, default=0.1, help='slowdown that counts as a regression')
+    args = parser.parse_args()
+    results = {'settings': {'size': args.size, 'samples': args.samples, 'workers': args.workers,
+                            'integrator': args.integrator, 'tile_size': m.tile_size, 'pass_samples': m.pass_samples,
+                            'python': platform.python_version(), 'machine': platform.machine()},
+               'scenes': {}}
+    for name in args.scenes:
+        results['scenes'][name] = bench_scene(name, args)
+    results['peak_rss_mb'] = {'parent': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+                              'workers': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024}
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_table(results, baseline)
+    print('Peak RSS: {parent:.0f} MB parent, {workers:.0f} MB largest worker'.format(**results['peak_rss_mb']))
+    for name, result in results['scenes'].items():
+        if not result['identical']:
+            print('{}: serial and pool images differ'.format(name))
+    if baseline:
+        regressions = compare(results, baseline, args.threshold)
+        for name, mode, key, old, new in regressions:
+            print('REGRESSION {} {} {}: {:.1f} -> {:.1f}'.format(name, mode, key, old, new))
+        if regressions:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
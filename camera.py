@@ -1,7 +1,11 @@
 from vec3 import Vec3
+from vec3batch import Vec3Batch, scaled
 from ray import Ray
+from raybatch import RayBatch
+from pdf import batch_random
 import math
-import random
+import rng
+import numpy as np
 
 class Camera:
     def __init__(self):
@@ -13,6 +17,9 @@ class Camera:
     def get_ray(self, u, v):
         return Ray(self._origin, self._lower_left_corner + u*self._horizontal + v*self._vertical)
 
+    def get_ray_batch(self, u, v):
+        return RayBatch(Vec3Batch.full(len(u), self._origin), self._lower_left_corner + scaled(self._horizontal, u) + scaled(self._vertical, v))
+
 class FOVCamera:
     def __init__(self, vfov, aspect):
         self.theta = vfov * math.pi/180
@@ -27,6 +34,9 @@ class FOVCamera:
     def get_ray(self, u, v):
         return Ray(self._origin, self._lower_left_corner + u*self._horizontal + v*self._vertical)
 
+    def get_ray_batch(self, u, v):
+        return RayBatch(Vec3Batch.full(len(u), self._origin), self._lower_left_corner + scaled(self._horizontal, u) + scaled(self._vertical, v))
+
 class PosCamera:
     def __init__(self, lookfrom, lookat, vup, vfov, aspect):
         self.theta = vfov * math.pi/180
@@ -46,12 +56,28 @@ class PosCamera:
     def get_ray(self, s, t):
         return Ray(self._origin, self._lower_left_corner + s*self._horizontal + t*self._vertical - self._origin)
 
+    def get_ray_batch(self, s, t):
+        return RayBatch(Vec3Batch.full(len(s), self._origin), self._lower_left_corner + scaled(self._horizontal, s) + scaled(self._vertical, t) - self._origin)
+
 def random_in_unit_disk():
     while True:
-        p = 2 * Vec3(random.random(), random.random(), 0) - Vec3(1, 1, 0)
+        p = 2 * Vec3(rng.random(), rng.random(), 0) - Vec3(1, 1, 0)
         if p.dot(p) < 1:
             return p
-        
+
+def random_in_unit_disk_batch(n):
+    x = np.zeros(n)
+    y = np.zeros(n)
+    todo = np.arange(n)
+    while len(todo):
+        px = 2 * batch_random.random(len(todo)) - 1
+        py = 2 * batch_random.random(len(todo)) - 1
+        inside = px*px + py*py < 1
+        x[todo[inside]] = px[inside]
+        y[todo[inside]] = py[inside]
+        todo = todo[~inside]
+    return Vec3Batch(x, y, np.zeros(n))
+
 class DofCamera:
     def __init__(self, lookfrom, lookat, vup, vfov, aspect, aperture, focus_dist):
         self._lens_radius = aperture / 2
@@ -73,6 +99,11 @@ class DofCamera:
         offset = rd.x * self._u +  rd.y * self._v
         return Ray(self._origin + offset, self._lower_left_corner + s*self._horizontal + t*self._vertical - self._origin - offset)
 
+    def get_ray_batch(self, s, t):
+        rd = self._lens_radius * random_in_unit_disk_batch(len(s))
+        offset = scaled(self._u, rd.x) + scaled(self._v, rd.y)
+        return RayBatch(self._origin + offset, self._lower_left_corner + scaled(self._horizontal, s) + scaled(self._vertical, t) - self._origin - offset)
+
 class MoBlurCamera:
     def __init__(self, lookfrom, lookat, vup, vfov, aspect, aperture, focus_dist, time0, time1):
         self.time0 = time0
@@ -94,6 +125,12 @@ class MoBlurCamera:
     def get_ray(self, s, t):
         rd = self._lens_radius * random_in_unit_disk()
         offset = rd.x * self._u +  rd.y * self._v
-        time = self.time0 + random.random() * (self.time1 - self.time0)
+        time = self.time0 + rng.random() * (self.time1 - self.time0)
         return Ray(self._origin + offset, self._lower_left_corner + s*self._horizontal + t*self._vertical - self._origin - offset, time)
 
+    def get_ray_batch(self, s, t):
+        rd = self._lens_radius * random_in_unit_disk_batch(len(s))
+        offset = scaled(self._u, rd.x) + scaled(self._v, rd.y)
+        time = self.time0 + batch_random.random(len(s)) * (self.time1 - self.time0)
+        return RayBatch(self._origin + offset, self._lower_left_corner + scaled(self._horizontal, s) + scaled(self._vertical, t) - self._origin - offset, time)
+
@@ -0,0 +1,91 @@
+import numpy as np
+from framebuffer import luminance
+
+# Edge-avoiding a-trous wavelet filter (Dammertz et al. 2010, with the
+# variance guided weights of SVGF) for renders with few samples. It is
+# guided by the first hit buffers the renderer writes next to the image:
+# albedo, normal (facing the camera) and the distance to the camera, all
+# zero where the camera ray missed.
+#
+# Fireflies are cut down first to clamp times the median luminance of
+# their 3 x 3 neighbourhood, which biases the result a little for much
+# less error at low sample counts. The lighting is filtered apart from the
+# texture (color / albedo) and multiplied back by it. Each of levels passes
+# blurs with the 5 x 5 B3 spline kernel, its taps 2^level pixels apart, and
+# weighs every tap down by how much its luminance differs from the pixel's
+# in units of the pixel's standard error, how far its normal turns and how
+# far its distance is off the pixel's plane. The variance is filtered
+# along, so the luminance weight tightens as the noise goes.
+
+# the first hit buffers: albedo 0-2, normal 3-5, distance 6
+aov_channels = 7
+
+kernel = (1 / 16, 1 / 4, 3 / 8, 1 / 4, 1 / 16)
+
+# pixels as the 3 x 3 shifts of values, (9, h, w)
+def neighbours(values):
+    padded = np.pad(values, 1, mode='edge')
+    h, w = values.shape
+    return np.array([padded[y:y + h, x:x + w] for y in range(3) for x in range(3)])
+
+# 3 x 3 binomial blur, the variance of a few samples is noisy itself
+def blur(values):
+    weights = np.outer((0.25, 0.5, 0.25), (0.25, 0.5, 0.25)).reshape(9, 1, 1)
+    return (weights * neighbours(values)).sum(axis=0)
+
+def clamp_fireflies(color, clamp):
+    brightness = luminance(color)
+    limit = clamp * np.median(neighbours(brightness), axis=0) + 1e-3
+    return color * np.minimum(1, limit / np.maximum(brightness, 1e-9))[..., None]
+
+# color (h, w, 3) mean radiance, variance (h, w) of its mean luminance,
+# aovs (h, w, aov_channels); the defaults came out best on the cornell box
+def denoise(color, variance, aovs, levels=5, sigma_luminance=4.0, sigma_normal=4.0, sigma_depth=64.0, clamp=10.0):
+    h, w = variance.shape
+    if clamp:
+        color = clamp_fireflies(color, clamp)
+    albedo = aovs[..., 0:3].astype(np.float64)
+    normal = aovs[..., 3:6].astype(np.float64)
+    depth = aovs[..., 6].astype(np.float64)
+    # untextured where there is no albedo to take out
+    albedo = np.where(albedo > 1e-3, albedo, 1.0)
+    light = color / albedo
+    light_variance = variance / np.maximum(luminance(albedo), 1e-3) ** 2
+    # change of distance per pixel across and down
+    depth_x = np.abs(np.gradient(depth, axis=1))
+    depth_y = np.abs(np.gradient(depth, axis=0))
+    for level in range(levels):
+        step = 1 << level
+        pad = 2 * step
+        def padded(values):
+            return np.pad(values, ((pad, pad), (pad, pad)) + ((0, 0),) * (values.ndim - 2))
+        light_luminance = luminance(light)
+        scale = sigma_luminance * np.sqrt(np.maximum(blur(light_variance), 0)) + 1e-6
+        sources = [padded(a) for a in (light, light_variance, light_luminance, normal, depth, np.ones((h, w)))]
+        weights = np.zeros((h, w))
+        light_sum = np.zeros((h, w, 3))
+        variance_sum = np.zeros((h, w))
+        for i, ky in enumerate(kernel):
+            for j, kx in enumerate(kernel):
+                dy = (i - 2) * step
+                dx = (j - 2) * step
+                window = (slice(pad + dy, pad + dy + h), slice(pad + dx, pad + dx + w))
+                q_light, q_variance, q_luminance, q_normal, q_depth, q_inside = (a[window] for a in sources)
+                if dx == 0 and dy == 0:
+                    weight = np.full((h, w), ky * kx)
+                else:
+                    normal_weight = np.clip((normal * q_normal).sum(axis=2), 0, 1) ** sigma_normal
+                    plane = sigma_depth * (depth_x * abs(dx) + depth_y * abs(dy)) + 1e-6
+                    weight = (ky * kx * q_inside * normal_weight * np.exp(-np.abs(light_luminance - q_luminance) / scale
+                                                                         - np.abs(depth - q_depth) / plane))
+                weights += weight
+                light_sum += weight[..., None] * q_light
+                variance_sum += weight * weight * q_variance
+        light = light_sum / weights[..., None]
+        light_variance = variance_sum / (weights * weights)
+    return light * albedo
+
+# root mean of the squared error relative to the reference, per channel
+# and pixel, the usual measure of render noise
+def relative_error(image, reference):
+    return np.sqrt(np.mean((image - reference) ** 2 / (reference ** 2 + 1e-2)))
@@ -0,0 +1,245 @@
+import numpy as np
+from multiprocessing import shared_memory
+
+# Linear float32 radiance for a width * height image, row 0 at the top.
+# Tiles are written into it as (h, w, 3) arrays; the writers below turn
+# whole buffers or single tiles into binary P6 / PFM without going through
+# a Python object per pixel. Extra channels past rgb can ride along for
+# the renderer, the writers only look at the first three.
+class FrameBuffer:
+    def __init__(self, width, height, channels=3):
+        self.width = width
+        self.height = height
+        self.pixels = np.zeros((height, width, channels), dtype=np.float32)
+
+    def set_tile(self, x0, y0, tile):
+        h, w = tile.shape[:2]
+        self.pixels[y0:y0 + h, x0:x0 + w] = tile
+
+    def tile(self, x0, y0, x1, y1):
+        return self.pixels[y0:y1, x0:x1]
+
+    def write_ppm(self, name):
+        with PPMWriter(name, self.width, self.height) as image:
+            image.write_tile(0, 0, self.pixels[..., :3])
+
+    def write_pfm(self, name):
+        with PFMWriter(name, self.width, self.height) as image:
+            image.write_tile(0, 0, self.pixels[..., :3])
+
+# FrameBuffer in a multiprocessing.shared_memory block. The parent creates
+# it, workers attach by name and write their tiles in place, so only tile
+# ids and timings have to travel back through the pool.
+class SharedFrameBuffer(FrameBuffer):
+    def __init__(self, width, height, name=None, channels=3):
+        self.width = width
+        self.height = height
+        self.memory = shared_memory.SharedMemory(name=name, create=name is None, size=width * height * channels * 4)
+        self.pixels = np.ndarray((height, width, channels), dtype=np.float32, buffer=self.memory.buf)
+        if name is None:
+            self.pixels[:] = 0
+
+    @property
+    def name(self):
+        return self.memory.name
+
+    def close(self):
+        self.pixels = None
+        self.memory.close()
+
+    # called once by the creator after every process has closed it
+    def unlink(self):
+        self.memory.unlink()
+
+def luminance(pixels):
+    return pixels[..., 0] * 0.2126 + pixels[..., 1] * 0.7152 + pixels[..., 2] * 0.0722
+
+# mean over the pixels within radius of each pixel, leaving the pixel out;
+# the image is mirrored at its edges without repeating the edge pixels
+def surrounding(values, radius=2):
+    padded = np.pad(values, radius, mode='reflect')
+    h, w = values.shape
+    size = 2 * radius + 1
+    return sum(padded[y:y + h, x:x + w] for y in range(size) for x in range(size) if (y, x) != (radius, radius)) / (size * size - 1)
+
+# Running sample sums (channels 0-2), the sum of the squared luminance of
+# the samples (channel 3, for the noise estimate) and sample counts
+# (channel 4) per pixel in a memory mapped .npy file, so a render can be
+# checkpointed pass by pass and resumed after the process is gone.
+class Accumulator:
+    def __init__(self, name, width, height, resume=False):
+        self.width = width
+        self.height = height
+        if resume:
+            self.data = np.lib.format.open_memmap(name, mode='r+')
+            if self.data.shape != (height, width, 5):
+                raise ValueError('{} does not hold a {}x{} checkpoint'.format(name, width, height))
+        else:
+            self.data = np.lib.format.open_memmap(name, mode='w+', dtype=np.float64, shape=(height, width, 5))
+
+    @property
+    def counts(self):
+        return self.data[..., 4]
+
+    # pixels hold the mean of the tile's new samples, samples per pixel,
+    # as rgb plus the mean squared luminance; only pixels where active is
+    # set are added
+    def add_tile(self, x0, y0, pixels, samples, active=None):
+        h, w = pixels.shape[:2]
+        block = self.data[y0:y0 + h, x0:x0 + w]
+        if active is None:
+            active = np.ones((h, w), dtype=bool)
+        block[active, :4] += pixels[active] * samples
+        block[active, 4] += samples
+
+    # standard deviation of one sample's luminance after gamma 2 at each
+    # pixel, estimated from the 24 pixels around it but not from the pixel's
+    # own samples: a pixel given samples by its own noise keeps the ones that
+    # happened to miss the light and comes out dark, while its neighbours'
+    # noise is independent of its samples and leaves its mean unbiased; inf
+    # while they have fewer than two samples
+    def deviation(self):
+        n = self.counts
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = luminance(self.data[..., :3]) / n
+            variance = np.maximum(self.data[..., 3] / n - mean * mean, 0) * n / (n - 1)
+            variance = np.where(n >= 2, variance, np.inf)
+            return np.sqrt(surrounding(variance) / (4 * surrounding(np.nan_to_num(mean)) + 1e-4))
+
+    # standard error of each pixel's mean luminance after gamma 2
+    def error(self):
+        with np.errstate(divide='ignore'):
+            return self.deviation() / np.sqrt(self.counts)
+
+    # variance of each pixel's mean luminance, linear, 0 below two samples
+    def variance(self):
+        n = self.counts
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = luminance(self.data[..., :3]) / n
+            variance = np.maximum(self.data[..., 3] / n - mean * mean, 0) / (n - 1)
+        return np.where(n >= 2, variance, 0)
+
+    def flush(self):
+        self.data.flush()
+
+    # normalized image, black where nothing was sampled yet
+    def frame(self):
+        frame = FrameBuffer(self.width, self.height)
+        counts = self.data[..., 4:]
+        np.divide(self.data[..., :3], counts, out=frame.pixels, where=counts > 0, casting='unsafe')
+        return frame
+
+# values as black - red - yellow - white, scaled to their maximum
+def write_heatmap(name, values):
+    t = values / (values.max() or 1)
+    colors = np.clip(np.stack((3 * t, 3 * t - 1, 3 * t - 2), axis=-1), 0, 1)
+    with HeatmapWriter(name, values.shape[1], values.shape[0]) as image:
+        image.write_tile(0, 0, colors)
+
+# 8 bit sRGB-ish output: gamma 2, clamped to [0, 255] like the old P3 path
+def to_bytes(tile):
+    return (np.clip(np.sqrt(np.maximum(tile, 0)) * 255, 0, 255)).astype(np.uint8)
+
+# Binary image file whose pixel data is laid out row by row after a text
+# header. The file is sized up front so tiles can arrive in any order and
+# each row of a tile is written straight to its offset.
+class TileWriter:
+    channel_bytes = 1
+    def __init__(self, name, width, height):
+        self.width = width
+        self.height = height
+        self.file = open(name, 'wb')
+        self.file.write(self.header())
+        self.data_start = self.file.tell()
+        self.row_bytes = width * 3 * self.channel_bytes
+        self.file.truncate(self.data_start + height * self.row_bytes)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.file.close()
+
+    # encoded a row at a time so a whole frame needs no full size temporaries
+    def write_tile(self, x0, y0, tile):
+        for i in range(tile.shape[0]):
+            self.file.seek(self.data_start + self.file_row(y0 + i) * self.row_bytes + x0 * 3 * self.channel_bytes)
+            self.file.write(self.encode(tile[i]).tobytes())
+
+class PPMWriter(TileWriter):
+    def header(self):
+        return 'P6\n{} {}\n255\n'.format(self.width, self.height).encode('ascii')
+
+    def file_row(self, y):
+        return y
+
+    def encode(self, tile):
+        return to_bytes(tile)
+
+# P6 of colors that are already display values
+class HeatmapWriter(PPMWriter):
+    def encode(self, tile):
+        return (np.clip(tile, 0, 1) * 255).astype(np.uint8)
+
+# Portable float map: little endian float32 (negative scale), unclamped
+# linear radiance, rows stored bottom to top.
+class PFMWriter(TileWriter):
+    channel_bytes = 4
+    def header(self):
+        return 'PF\n{} {}\n-1.0\n'.format(self.width, self.height).encode('ascii')
+
+    def file_row(self, y):
+        return self.height - 1 - y
+
+    def encode(self, tile):
+        return np.ascontiguousarray(tile, dtype='<f4')
+
+# whitespace separated header fields of a netpbm/PFM file, skipping
+# comments, and the offset of the pixel data after them
+def read_header(name, fields):
+    with open(name, 'rb') as image:
+        head = image.read(1024)
+    values = []
+    i = 0
+    while len(values) < fields:
+        while head[i:i + 1].isspace():
+            i += 1
+        if head[i:i + 1] == b'#':
+            i = head.index(b'\n', i)
+            continue
+        start = i
+        while not head[i:i + 1].isspace():
+            i += 1
+        values.append(head[start:i].decode('ascii'))
+    # a single whitespace character ends the header
+    return values, i + 1
+
+# rgb as float32 rows from the top; with mmap the file is mapped instead of
+# read, for images larger than they should be in memory
+def read_pfm(name, mmap=False):
+    (kind, width, height, scale), offset = read_header(name, 4)
+    width, height = int(width), int(height)
+    channels = 3 if kind == 'PF' else 1
+    dtype = '<f4' if float(scale) < 0 else '>f4'
+    if mmap:
+        data = np.memmap(name, dtype=dtype, mode='r', offset=offset, shape=(height, width, channels))
+    else:
+        data = np.fromfile(name, dtype=dtype, offset=offset).reshape(height, width, channels)
+    return data[::-1]
+
+# P6 as stored, uint8 (or big endian uint16 past a maxval of 255) rows from
+# the top, and the maxval
+def read_ppm(name, mmap=False):
+    (kind, width, height, maxval), offset = read_header(name, 4)
+    if kind != 'P6':
+        raise ValueError('{} is not a binary PPM'.format(name))
+    width, height, maxval = int(width), int(height), int(maxval)
+    dtype = np.uint8 if maxval < 256 else '>u2'
+    if mmap:
+        data = np.memmap(name, dtype=dtype, mode='r', offset=offset, shape=(height, width, 3))
+    else:
+        data = np.fromfile(name, dtype=dtype, count=height * width * 3, offset=offset).reshape(height, width, 3)
+    return data, maxval
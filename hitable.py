@@ -1,25 +1,69 @@
-import random
+import rng
 import sys
+import numpy as np
 from ray import Ray
+from raybatch import RayBatch
 from vec3 import Vec3
-from aabb import AABB
-from onb import ONB
-from pdf import random_to_sphere
-from collections import namedtuple
+from vec3batch import Vec3Batch, scaled
+from aabb import AABB, surrounding_box
+import onb
+import transform
+from onb import ONBBatch
+from pdf import random_to_sphere, random_to_sphere_batch, batch_random
 from math import sqrt, atan2, asin, pi, sin, cos, log, fabs
 from material import Isotropic
 
-# to compare performance class vs namedtuple
-##class HitRecord:
-##    def __init__(self, t=0, u=0, v=0, p=Vec3(0,0,0), normal=0):
-##        self.t = t
-##        self.u = u
-##        self.v = v
-##        self.p = p
-##        self.normal = normal
-##        self.material = material
+# Slotted and mutable: every hit() returns a new record that belongs to
+# the caller, so wrappers such as FlipNormals and Translate update their
+# child's record in place instead of building another one. footprint is
+# the width of the ray cone at the hit, filled in by the integrator when
+# it follows one.
+class HitRecord:
+    __slots__ = ('t', 'u', 'v', 'p', 'normal', 'material', 'footprint')
 
-HitRecord = namedtuple('HitRecord', ['t', 'u', 'v', 'p', 'normal', 'material'])
+    def __init__(self, t, u, v, p, normal, material, footprint=0.0):
+        self.t = t
+        self.u = u
+        self.v = v
+        self.p = p
+        self.normal = normal
+        self.material = material
+        self.footprint = footprint
+
+# Hit records for a RayBatch. t starts at t_max and only shrinks, a
+# primitive overwrites a row only when it is closer than what is there.
+class HitRecordBatch:
+    def __init__(self, t, u, v, p, normal, material):
+        self.t = t
+        self.u = u
+        self.v = v
+        self.p = p
+        self.normal = normal
+        self.material = material
+
+    @classmethod
+    def empty(cls, n, t_max=sys.float_info.max):
+        return cls(np.full(n, float(t_max)), np.zeros(n), np.zeros(n),
+                   Vec3Batch.zeros(n), Vec3Batch.zeros(n), np.empty(n, dtype=object))
+
+    def __len__(self):
+        return len(self.t)
+
+    def __getitem__(self, index):
+        return HitRecordBatch(self.t[index], self.u[index], self.v[index],
+                              self.p[index], self.normal[index], self.material[index])
+
+    def set(self, rows, t, u, v, p, normal, material):
+        self.t[rows] = t
+        self.u[rows] = u
+        self.v[rows] = v
+        self.p[rows] = p
+        self.normal[rows] = normal
+        self.material[rows] = material
+
+    # copy every row of other into rows
+    def assign(self, rows, other):
+        self.set(rows, other.t, other.u, other.v, other.p, other.normal, other.material)
 
 def get_sphere_uv(p):
     phi = atan2(p.z, p.x)
@@ -28,21 +72,100 @@ def get_sphere_uv(p):
     v = (theta + pi / 2) / pi
     return u, v
 
+def get_sphere_uv_batch(p):
+    phi = np.arctan2(p.z, p.x)
+    theta = np.arcsin(np.clip(p.y, -1, 1))
+    u = 1 - (phi + pi) / (2 * pi)
+    v = (theta + pi / 2) / pi
+    return u, v
+
+# upper bound on rays x members evaluated at once by the set kernels
+batch_elements = 1 << 16
+
+# t_min may be a float or one value per ray
+def take(t_min, rows):
+    if np.ndim(t_min):
+        return t_min[rows]
+    return t_min
+
 class Hitable:
+    # lets slotted subclasses such as Instance go without a __dict__
+    __slots__ = ()
+
     def hit(self, ray, t_min, t_max):
         raise NotImplementedError()
     def bounding_box(self, t0, t1):
         raise NotImplementedError()
+
+    # Brings the boxes of an acceleration structure and of what is under it
+    # up to date after things in it moved, keeping its shape, and returns
+    # the new box. A primitive has nothing to refit.
+    def refit(self, t0, t1):
+        return self.bounding_box(t0, t1)
+
     def pdf_value(self, o, v):
         return 0
     def random(self, o):
         return Vec3(1, 0, 0)
 
+    # Batched hit, rec is a HitRecordBatch holding the closest hit so far.
+    # Closer hits are written into rec and their rows returned as a mask.
+    # This fallback traces the rays one by one through hit().
+    def hit_batch(self, rays, t_min, rec):
+        hit = np.zeros(len(rays), dtype=bool)
+        t_mins = np.broadcast_to(t_min, (len(rays),))
+        for i in range(len(rays)):
+            ray = Ray(rays.origin[i], rays.direction[i], float(rays.time[i]))
+            hit_info = self.hit(ray, float(t_mins[i]), float(rec.t[i]))
+            if hit_info:
+                hit[i] = True
+                rec.set(i, hit_info.t, hit_info.u, hit_info.v, hit_info.p, hit_info.normal, hit_info.material)
+        return hit
+
+    def pdf_value_batch(self, o, v):
+        return np.zeros(len(v))
+
+    def random_batch(self, o):
+        n = len(o)
+        return Vec3Batch(np.ones(n), np.zeros(n), np.zeros(n))
+
+    # Where a ray enters and leaves a closed shape, as the ray parameters
+    # (t0, t1), the entry possibly behind the origin, or None for a miss.
+    # Media use it for the stretch of the ray inside their boundary. This
+    # fallback finds the two with two hits; shapes that get both from one
+    # test override it.
+    def interval(self, ray):
+        rec1 = self.hit(ray, -sys.float_info.max, sys.float_info.max)
+        if not rec1:
+            return None
+        rec2 = self.hit(ray, rec1.t + 0.0001, sys.float_info.max)
+        if not rec2:
+            return None
+        return rec1.t, rec2.t
+
+    # t0 and t1 arrays, t0 > t1 in the rows that miss
+    def interval_batch(self, rays):
+        n = len(rays)
+        rec1 = HitRecordBatch.empty(n)
+        hit1 = self.hit_batch(rays, -sys.float_info.max, rec1)
+        rec2 = HitRecordBatch.empty(n)
+        hit = hit1 & self.hit_batch(rays, np.where(hit1, rec1.t + 0.0001, sys.float_info.max), rec2)
+        return np.where(hit, rec1.t, np.inf), np.where(hit, rec2.t, -np.inf)
+
 class HitableList(Hitable):
-    def __init__(self, hit_list):
+    def __init__(self, hit_list=None):
+        if hit_list is None:
+            hit_list = []
         self.hit_list = hit_list
         self.list_size = len(self.hit_list)
 
+    def append(self, hitable):
+        self.hit_list.append(hitable)
+        self.list_size = len(self.hit_list)
+
+    def __len__(self):
+        return self.list_size
+
     def hit(self, ray, t_min, t_max):
         hit_anything = False
         closest_so_far = t_max
@@ -56,8 +179,31 @@ class HitableList(Hitable):
             return result_info
         return False
 
+    def hit_batch(self, rays, t_min, rec):
+        hit = np.zeros(len(rays), dtype=bool)
+        for obj in self.hit_list:
+            hit |= obj.hit_batch(rays, t_min, rec)
+        return hit
+
     def bounding_box(self, t0, t1):
-        raise NotImplementedError()
+        if not self.hit_list:
+            return None
+        box = None
+        for obj in self.hit_list:
+            temp_box = obj.bounding_box(t0, t1)
+            if temp_box is None:
+                return None
+            box = temp_box if box is None else surrounding_box(box, temp_box)
+        return box
+
+    def refit(self, t0, t1):
+        boxes = [obj.refit(t0, t1) for obj in self.hit_list]
+        if not boxes or any(box is None for box in boxes):
+            return None
+        box = boxes[0]
+        for temp_box in boxes[1:]:
+            box = surrounding_box(box, temp_box)
+        return box
     
     def pdf_value(self, o, v):
         weight = 1 / self.list_size
@@ -67,21 +213,120 @@ class HitableList(Hitable):
         return sum
     
     def random(self, o):
-        index = int(random.random() * self.list_size)
+        index = int(rng.random() * self.list_size)
         return self.hit_list[index].random(o)
 
-##    def bounding_box(self, t0, t1, box):
-##        temp_box = AABB()
-##        if not bounding_box(t0, t1, temp_box):
-##            return False
-##        else:
-##            box = temp_box
-##        for i in range(1, 1ist_size):
-##            if bounding_box(t0, t1, temp_box):
-##                box = surrounding_box(box, temp_box)
-##            else:
-##                return False
-##        return True
+    def pdf_value_batch(self, o, v):
+        weight = 1 / self.list_size
+        sum = np.zeros(len(v))
+        for obj in self.hit_list:
+            sum += weight * obj.pdf_value_batch(o, v)
+        return sum
+
+    def random_batch(self, o):
+        index = (batch_random.random(len(o)) * self.list_size).astype(int)
+        directions = Vec3Batch.zeros(len(o))
+        for i, obj in enumerate(self.hit_list):
+            rows = np.flatnonzero(index == i)
+            if len(rows):
+                directions[rows] = obj.random_batch(o[rows])
+        return directions
+
+# split (box, hitable) pairs in two halves at the median centroid of the
+# longest axis
+def split_median(boxed):
+    centroids = [box.centroid() for box, obj in boxed]
+    extent = [max(c.x for c in centroids) - min(c.x for c in centroids),
+              max(c.y for c in centroids) - min(c.y for c in centroids),
+              max(c.z for c in centroids) - min(c.z for c in centroids)]
+    axis = 'xyz'[extent.index(max(extent))]
+    boxed = sorted(boxed, key=lambda item: getattr(item[0].centroid(), axis))
+    half = len(boxed) // 2
+    return boxed[:half], boxed[half:]
+
+# Bounding volume hierarchy - binary tree of AABBs, split at the median
+# of the longest centroid axis so traversal cost grows with log(n)
+class BVHNode(Hitable):
+    def __init__(self, hit_list, time0=0, time1=1):
+        if isinstance(hit_list, HitableList):
+            hit_list = hit_list.hit_list
+        boxed = []
+        for obj in hit_list:
+            box = obj.bounding_box(time0, time1)
+            if box is None:
+                raise ValueError('no bounding box in BVHNode constructor: {}'.format(obj))
+            boxed.append((box, obj))
+        if not boxed:
+            raise ValueError('BVHNode needs at least one hitable')
+        self._build(boxed, time0, time1)
+
+    def _build(self, boxed, time0, time1):
+        n = len(boxed)
+        if n == 1:
+            self.box, self.left = boxed[0]
+            self.right = None
+            return
+        if n == 2:
+            (left_box, self.left), (right_box, self.right) = boxed
+            self.box = surrounding_box(left_box, right_box)
+            return
+        left, right = split_median(boxed)
+        self.left = BVHNode.__new__(BVHNode)
+        self.left._build(left, time0, time1)
+        self.right = BVHNode.__new__(BVHNode)
+        self.right._build(right, time0, time1)
+        self.box = surrounding_box(self.left.box, self.right.box)
+
+    def __getstate__(self):
+        return self.box, self.left, self.right
+
+    def __setstate__(self, state):
+        self.box, self.left, self.right = state
+
+    def hit(self, ray, t_min, t_max):
+        if not self.box.hit(ray, t_min, t_max):
+            return False
+        left_rec = self.left.hit(ray, t_min, t_max)
+        if self.right is None:
+            return left_rec
+        if left_rec:
+            t_max = left_rec.t
+        right_rec = self.right.hit(ray, t_min, t_max)
+        if right_rec:
+            return right_rec
+        return left_rec
+
+    # only the rays that enter this node's box go on to the children
+    def hit_batch(self, rays, t_min, rec):
+        inside = self.box.hit_batch(rays, t_min, rec.t)
+        if inside.all():
+            return self._hit_children(rays, t_min, rec)
+        rows = np.flatnonzero(inside)
+        hit = np.zeros(len(rays), dtype=bool)
+        if len(rows):
+            sub_rec = rec[rows]
+            sub_hit = self._hit_children(rays[rows], take(t_min, rows), sub_rec)
+            rec.assign(rows[sub_hit], sub_rec[sub_hit])
+            hit[rows[sub_hit]] = True
+        return hit
+
+    def _hit_children(self, rays, t_min, rec):
+        hit = self.left.hit_batch(rays, t_min, rec)
+        if self.right is not None:
+            hit |= self.right.hit_batch(rays, t_min, rec)
+        return hit
+
+    def bounding_box(self, t0, t1):
+        return self.box
+
+    # the boxes again from the leaves up, the split stays as it was built
+    def refit(self, t0, t1):
+        box = self.left.refit(t0, t1)
+        if self.right is not None:
+            box = surrounding_box(box, self.right.refit(t0, t1))
+        self.box = box
+        return box
+
 
 # Transformation
 class FlipNormals(Hitable):
@@ -91,11 +336,38 @@ class FlipNormals(Hitable):
     def hit(self, ray, t_min, t_max):
         ptr = self.hitable.hit(ray, t_min, t_max)
         if ptr:
-            return HitRecord(ptr.t, ptr.u, ptr.v, ptr.p, -ptr.normal, ptr.material)
-        return False
+            ptr.normal = -ptr.normal
+        return ptr
 
-    def bounding_box(self, t0, t1, box):
-        return box(t0, t1)
+    def hit_batch(self, rays, t_min, rec):
+        hit = self.hitable.hit_batch(rays, t_min, rec)
+        rec.normal[hit] = -rec.normal[hit]
+        return hit
+
+    def bounding_box(self, t0, t1):
+        return self.hitable.bounding_box(t0, t1)
+
+    def refit(self, t0, t1):
+        return self.hitable.refit(t0, t1)
+
+    def interval(self, ray):
+        return self.hitable.interval(ray)
+
+    def interval_batch(self, rays):
+        return self.hitable.interval_batch(rays)
+
+    # the pdf of a shape does not depend on the side its normal is on
+    def pdf_value(self, o, v):
+        return self.hitable.pdf_value(o, v)
+
+    def random(self, o):
+        return self.hitable.random(o)
+
+    def pdf_value_batch(self, o, v):
+        return self.hitable.pdf_value_batch(o, v)
+
+    def random_batch(self, o):
+        return self.hitable.random_batch(o)
 
 class Translate(Hitable):
     def __init__(self, hitable, offset):
@@ -106,13 +378,24 @@ class Translate(Hitable):
         moved_ray = Ray(ray.origin - self.offset, ray.direction, ray.time)
         ptr = self.hitable.hit(moved_ray, t_min, t_max)
         if ptr:
-            return HitRecord(ptr.t, ptr.u, ptr.v, ptr.p+self.offset, ptr.normal, ptr.material)
-        return False
+            ptr.p = ptr.p + self.offset
+        return ptr
 
-    def bounding_box(self, t0, t1, box):
-        if box:
-            box = box(box.min + self.offset, box.max + self.offset)
-        return False
+    def hit_batch(self, rays, t_min, rec):
+        moved_rays = RayBatch(rays.origin - self.offset, rays.direction, rays.time)
+        hit = self.hitable.hit_batch(moved_rays, t_min, rec)
+        rec.p[hit] = rec.p[hit] + self.offset
+        return hit
+
+    def bounding_box(self, t0, t1):
+        box = self.hitable.bounding_box(t0, t1)
+        if box is None:
+            return None
+        return AABB(box.min_hit + self.offset, box.max_hit + self.offset)
+
+    def refit(self, t0, t1):
+        self.hitable.refit(t0, t1)
+        return self.bounding_box(t0, t1)
 
 class RotateY(Hitable):
     def __init__(self, hitable, angle):
@@ -120,28 +403,27 @@ class RotateY(Hitable):
         self.radians = (pi / 180) * angle
         self.sin_theta = sin(self.radians)
         self.cos_theta = cos(self.radians)
-##        bbox = self.hitable.bounding_box(0, 1)
-##        sys_f = sys.float_info.max
-##        min_b = Vec3(sys_f, sys_f,sys_f)
-##        max_b = -minb
-##        if bbox:
-##            for i in range(2):
-##                for j in range(2):
-##                    for k in range(2):
-##                        x = i*bbox.max.x + (1-i)*bbox.min.x
-##                        y = j*bbox.max.y + (1-j)*bbox.min.y
-##                        z = k*bbox.max.z + (1-k)*bbox.min.z
-##                        newx = self.cos_theta * x + self.sin_theta * z
-##                        newz = -self.sin_theta * x + self.cos_theta * z
-##                        tester = Vec3(newx, y, newz)
-##                        for c in range(3):
-##                            if tester[c] > max[c]:
-##                                max[c] = tester[c]
-##                            if tester[c] < min[c]:
-##                                min[c] = tester[c]
-##            self.box = AABB(min_b, max_B)
-##        else:
-##            self.box = None
+        self.box = self.rotated_box(self.hitable.bounding_box(0, 1))
+
+    # the box around the turned corners of the hitable's box bbox
+    def rotated_box(self, bbox):
+        if bbox is None:
+            return None
+        big = sys.float_info.max
+        small = [big, big, big]
+        large = [-big, -big, -big]
+        for i in range(2):
+            for j in range(2):
+                for k in range(2):
+                    x = i*bbox.max_hit.x + (1-i)*bbox.min_hit.x
+                    y = j*bbox.max_hit.y + (1-j)*bbox.min_hit.y
+                    z = k*bbox.max_hit.z + (1-k)*bbox.min_hit.z
+                    newx = self.cos_theta * x + self.sin_theta * z
+                    newz = -self.sin_theta * x + self.cos_theta * z
+                    for c, value in enumerate((newx, y, newz)):
+                        small[c] = min(small[c], value)
+                        large[c] = max(large[c], value)
+        return AABB(Vec3(*small), Vec3(*large))
 
     def hit(self, ray, t_min, t_max):
         ox = self.cos_theta * ray.origin.x - self.sin_theta * ray.origin.z
@@ -157,17 +439,165 @@ class RotateY(Hitable):
             pz = -self.sin_theta * ptr.p.x + self.cos_theta * ptr.p.z
             nx = self.cos_theta * ptr.normal.x + self.sin_theta * ptr.normal.z
             nz = -self.sin_theta * ptr.normal.x + self.cos_theta * ptr.normal.z
-            p = Vec3(px, ptr.p.y, pz)
-            normal = Vec3(nx, ptr.normal.y, nz)
-            return HitRecord(ptr.t, ptr.u, ptr.v, p, normal, ptr.material)
-        return False
+            ptr.p = Vec3(px, ptr.p.y, pz)
+            ptr.normal = Vec3(nx, ptr.normal.y, nz)
+        return ptr
+
+    def hit_batch(self, rays, t_min, rec):
+        c, s = self.cos_theta, self.sin_theta
+        o = rays.origin
+        d = rays.direction
+        origin = Vec3Batch(c * o.x - s * o.z, o.y, s * o.x + c * o.z)
+        direction = Vec3Batch(c * d.x - s * d.z, d.y, s * d.x + c * d.z)
+        hit = self.hitable.hit_batch(RayBatch(origin, direction, rays.time), t_min, rec)
+        p = rec.p[hit]
+        normal = rec.normal[hit]
+        rec.p[hit] = Vec3Batch(c * p.x + s * p.z, p.y, -s * p.x + c * p.z)
+        rec.normal[hit] = Vec3Batch(c * normal.x + s * normal.z, normal.y, -s * normal.x + c * normal.z)
+        return hit
+
+    def bounding_box(self, t0, t1):
+        return self.box
+
+    def refit(self, t0, t1):
+        self.box = self.rotated_box(self.hitable.refit(t0, t1))
+        return self.box
 
-    def bounding_box(self, t0, t1, box):
-        box = box
-        return True
 
+# Hitable under an affine matrix (see transform.py). The ray is taken into
+# the hitable's space once, through a scratch Ray shared by all instances,
+# and the record's point and normal come back out, the normal through the
+# inverse transpose; flip turns it around like FlipNormals. Any number of
+# instances can share one hitable, each only keeps the matrix and its
+# inverse.
+class Instance(Hitable):
+    __slots__ = ('hitable', 'forward', 'inverse', 'flip')
+
+    # scratch rays, one per level of instances inside instances, so that
+    # an instance of a list of instances hands each of them its own ray;
+    # the scalar path traces one ray at a time per process
+    rays = []
+    depth = 0
+
+    def __init__(self, hitable, matrix, flip=False):
+        self.hitable = hitable
+        self.set_matrix(matrix)
+        self.flip = flip
+
+    @property
+    def matrix(self):
+        return np.vstack((np.reshape(self.forward, (3, 4)), (0, 0, 0, 1)))
+
+    # moves the instance; the boxes above it are stale until refit
+    def set_matrix(self, matrix):
+        self.forward = transform.rows(matrix)
+        self.inverse = transform.rows(np.linalg.inv(matrix))
+
+    def hit(self, ray, t_min, t_max):
+        a, b, c, d, e, f, g, h, i, j, k, l = self.inverse
+        o = ray.origin
+        x, y, z = o.x, o.y, o.z
+        depth = Instance.depth
+        if depth == len(Instance.rays):
+            Instance.rays.append(Ray(Vec3(), Vec3()))
+        local = Instance.rays[depth]
+        origin = local.origin
+        origin.x = a*x + b*y + c*z + d
+        origin.y = e*x + f*y + g*z + h
+        origin.z = i*x + j*y + k*z + l
+        o = ray.direction
+        x, y, z = o.x, o.y, o.z
+        direction = local.direction
+        direction.x = a*x + b*y + c*z
+        direction.y = e*x + f*y + g*z
+        direction.z = i*x + j*y + k*z
+        local.time = ray.time
+        Instance.depth = depth + 1
+        try:
+            ptr = self.hitable.hit(local, t_min, t_max)
+        finally:
+            Instance.depth = depth
+        if ptr:
+            ptr.p = ray.point_at_parameter(ptr.t)
+            n = ptr.normal
+            x = a*n.x + e*n.y + i*n.z
+            y = b*n.x + f*n.y + j*n.z
+            z = c*n.x + g*n.y + k*n.z
+            length = sqrt(x*x + y*y + z*z)
+            if self.flip:
+                length = -length
+            ptr.normal = Vec3(x / length, y / length, z / length)
+        return ptr
+
+    def hit_batch(self, rays, t_min, rec):
+        m = np.array(self.inverse).reshape(3, 4)
+        hit = self.hitable.hit_batch(self.local_batch(rays), t_min, rec)
+        rows = np.flatnonzero(hit)
+        if len(rows):
+            rec.p[rows] = rays[rows].point_at_parameter(rec.t[rows])
+            n = rec.normal[rows]
+            normal = Vec3Batch(*(m[0, i]*n.x + m[1, i]*n.y + m[2, i]*n.z for i in range(3))).unit()
+            rec.normal[rows] = -normal if self.flip else normal
+        return hit
+
+    # an affine map keeps the ray parameter, so the interval is the local one
+    def interval(self, ray):
+        a, b, c, d, e, f, g, h, i, j, k, l = self.inverse
+        o = ray.origin
+        x, y, z = o.x, o.y, o.z
+        origin = Vec3(a*x + b*y + c*z + d, e*x + f*y + g*z + h, i*x + j*y + k*z + l)
+        o = ray.direction
+        x, y, z = o.x, o.y, o.z
+        direction = Vec3(a*x + b*y + c*z, e*x + f*y + g*z, i*x + j*y + k*z)
+        return self.hitable.interval(Ray(origin, direction, ray.time))
+
+    def interval_batch(self, rays):
+        return self.hitable.interval_batch(self.local_batch(rays))
+
+    def local_batch(self, rays):
+        m = np.array(self.inverse).reshape(3, 4)
+        o = rays.origin
+        d = rays.direction
+        origin = Vec3Batch(*(m[i, 0]*o.x + m[i, 1]*o.y + m[i, 2]*o.z + m[i, 3] for i in range(3)))
+        direction = Vec3Batch(*(m[i, 0]*d.x + m[i, 1]*d.y + m[i, 2]*d.z for i in range(3)))
+        return RayBatch(origin, direction, rays.time)
+
+    # the box around the eight corners of the hitable's box
+    def bounding_box(self, t0, t1):
+        box = self.hitable.bounding_box(t0, t1)
+        if box is None:
+            return None
+        corners = [transform.point(self.forward, Vec3(x, y, z))
+                   for x in (box.min_hit.x, box.max_hit.x)
+                   for y in (box.min_hit.y, box.max_hit.y)
+                   for z in (box.min_hit.z, box.max_hit.z)]
+        return AABB(Vec3(min(c.x for c in corners), min(c.y for c in corners), min(c.z for c in corners)),
+                    Vec3(max(c.x for c in corners), max(c.y for c in corners), max(c.z for c in corners)))
+
+    def refit(self, t0, t1):
+        self.hitable.refit(t0, t1)
+        return self.bounding_box(t0, t1)
+
+# Shared batched test for the axis aligned rects: the plane is axis = k and
+# the rect spans [a0, a1] x [b0, b1] on the two remaining axes a and b.
+def rect_hit_batch(rays, t_min, rec, axis, a, b, k, a0, a1, b0, b1, normal, material):
+    o = rays.origin
+    d = rays.direction
+    t = (k - getattr(o, axis)) / getattr(d, axis)
+    pa = getattr(o, a) + t * getattr(d, a)
+    pb = getattr(o, b) + t * getattr(d, b)
+    hit = (t >= t_min) & (t <= rec.t) & (pa >= a0) & (pa <= a1) & (pb >= b0) & (pb <= b1)
+    rows = np.flatnonzero(hit)
+    if len(rows):
+        t = t[rows]
+        rec.set(rows, t, (pa[rows] - a0) / (a1 - a0), (pb[rows] - b0) / (b1 - b0),
+                rays[rows].point_at_parameter(t), Vec3Batch.full(len(rows), normal), material)
+    return hit
 
 class XYRect(Hitable):
+    # shared by all hits, records only ever replace their normal
+    normal = Vec3(0, 0, 1)
+
     def __init__(self, x0, x1, y0, y1, k, material=None):
         self.x0 = x0
         self.x1 = x1
@@ -187,14 +617,44 @@ class XYRect(Hitable):
         u = (x - self.x0) / (self.x1 - self.x0)
         v = (y - self.y0) / (self.y1 - self.y0)
         p = ray.point_at_parameter(t)
-        normal = Vec3(0,0,1)
-        return HitRecord(t, u, v, p, normal, self.material)
+        return HitRecord(t, u, v, p, self.normal, self.material)
+
+    def hit_batch(self, rays, t_min, rec):
+        return rect_hit_batch(rays, t_min, rec, 'z', 'x', 'y', self.k, self.x0, self.x1, self.y0, self.y1, self.normal, self.material)
+
+    def bounding_box(self, t0, t1):
+        return AABB(Vec3(self.x0, self.y0, self.k-0.0001), Vec3(self.x1, self.y1, self.k+0.0001))
+
+    def pdf_value(self, o, v):
+        rec = self.hit(Ray(o, v), 0.001, sys.float_info.max)
+        if rec:
+            area = (self.x1-self.x0)*(self.y1-self.y0)
+            distance_squared = rec.t * rec.t * v.squared_length()
+            cosine = fabs(v.dot(rec.normal) / v.length())
+            return distance_squared / (cosine * area)
+        return 0
+
+    def random(self, o):
+        random_point = Vec3(self.x0 + rng.random() * (self.x1-self.x0), self.y0 + rng.random() * (self.y1-self.y0), self.k)
+        return random_point - o
+
+    def pdf_value_batch(self, o, v):
+        rec = HitRecordBatch.empty(len(v))
+        hit = self.hit_batch(RayBatch(o, v), 0.001, rec)
+        area = (self.x1-self.x0)*(self.y1-self.y0)
+        distance_squared = rec.t * rec.t * v.squared_length()
+        cosine = np.abs(v.dot(rec.normal) / v.length())
+        return np.where(hit, distance_squared / (cosine * area), 0.0)
+
+    def random_batch(self, o):
+        n = len(o)
+        random_point = Vec3Batch(self.x0 + batch_random.random(n) * (self.x1-self.x0), self.y0 + batch_random.random(n) * (self.y1-self.y0), np.full(n, float(self.k)))
+        return random_point - o
 
-    def bounding_box(self, t0, t1, box):
-        box = AABB(Vec3(x0, y0, k-0.0001), Vec3(x1, y1, k+0.0001))
-        return True
-        
 class XZRect(Hitable):
+    # shared by all hits, records only ever replace their normal
+    normal = Vec3(0, 1, 0)
+
     def __init__(self, x0, x1, z0, z1, k, material=None):
         self.x0 = x0
         self.x1 = x1
@@ -214,12 +674,13 @@ class XZRect(Hitable):
         u = (x - self.x0) / (self.x1 - self.x0)
         v = (z - self.z0) / (self.z1 - self.z0)
         p = ray.point_at_parameter(t)
-        normal = Vec3(0,1,0)
-        return HitRecord(t, u, v, p, normal, self.material)
+        return HitRecord(t, u, v, p, self.normal, self.material)
+
+    def hit_batch(self, rays, t_min, rec):
+        return rect_hit_batch(rays, t_min, rec, 'y', 'x', 'z', self.k, self.x0, self.x1, self.z0, self.z1, self.normal, self.material)
 
-    def bounding_box(self, t0, t1, box):
-        box = AABB(Vec3(x0, k-0.0001, z0), Vec3(x1, k+0.0001, z1))
-        return True
+    def bounding_box(self, t0, t1):
+        return AABB(Vec3(self.x0, self.k-0.0001, self.z0), Vec3(self.x1, self.k+0.0001, self.z1))
 
     def pdf_value(self, o, v):
         rec = self.hit(Ray(o, v), 0.001, sys.float_info.max)
@@ -231,10 +692,26 @@ class XZRect(Hitable):
         return 0
 
     def random(self, o):
-        random_point = Vec3(self.x0 + random.random() * (self.x1-self.x0), self.k, self.z0 + random.random() * (self.z1-self.z0))
+        random_point = Vec3(self.x0 + rng.random() * (self.x1-self.x0), self.k, self.z0 + rng.random() * (self.z1-self.z0))
+        return random_point - o
+
+    def pdf_value_batch(self, o, v):
+        rec = HitRecordBatch.empty(len(v))
+        hit = self.hit_batch(RayBatch(o, v), 0.001, rec)
+        area = (self.x1-self.x0)*(self.z1-self.z0)
+        distance_squared = rec.t * rec.t * v.squared_length()
+        cosine = np.abs(v.dot(rec.normal) / v.length())
+        return np.where(hit, distance_squared / (cosine * area), 0.0)
+
+    def random_batch(self, o):
+        n = len(o)
+        random_point = Vec3Batch(self.x0 + batch_random.random(n) * (self.x1-self.x0), np.full(n, float(self.k)), self.z0 + batch_random.random(n) * (self.z1-self.z0))
         return random_point - o
 
 class YZRect(Hitable):
+    # shared by all hits, records only ever replace their normal
+    normal = Vec3(1, 0, 0)
+
     def __init__(self, y0, y1, z0, z1, k, material=None):
         self.y0 = y0
         self.y1 = y1
@@ -254,36 +731,174 @@ class YZRect(Hitable):
         u = (y - self.y0) / (self.y1 - self.y0)
         v = (z - self.z0) / (self.z1 - self.z0)
         p = ray.point_at_parameter(t)
-        normal = Vec3(1,0,0)
-        return HitRecord(t, u, v, p, normal, self.material)
+        return HitRecord(t, u, v, p, self.normal, self.material)
+
+    def hit_batch(self, rays, t_min, rec):
+        return rect_hit_batch(rays, t_min, rec, 'x', 'y', 'z', self.k, self.y0, self.y1, self.z0, self.z1, self.normal, self.material)
     
-    def bounding_box(self, t0, t1, box):
-        box = AABB(Vec3(k-0.0001, y0, z0), Vec3(k+0.0001, y1, z1))
-        return True
+    def bounding_box(self, t0, t1):
+        return AABB(Vec3(self.k-0.0001, self.y0, self.z0), Vec3(self.k+0.0001, self.y1, self.z1))
+
+    def pdf_value(self, o, v):
+        rec = self.hit(Ray(o, v), 0.001, sys.float_info.max)
+        if rec:
+            area = (self.y1-self.y0)*(self.z1-self.z0)
+            distance_squared = rec.t * rec.t * v.squared_length()
+            cosine = fabs(v.dot(rec.normal) / v.length())
+            return distance_squared / (cosine * area)
+        return 0
 
+    def random(self, o):
+        random_point = Vec3(self.k, self.y0 + rng.random() * (self.y1-self.y0), self.z0 + rng.random() * (self.z1-self.z0))
+        return random_point - o
+
+    def pdf_value_batch(self, o, v):
+        rec = HitRecordBatch.empty(len(v))
+        hit = self.hit_batch(RayBatch(o, v), 0.001, rec)
+        area = (self.y1-self.y0)*(self.z1-self.z0)
+        distance_squared = rec.t * rec.t * v.squared_length()
+        cosine = np.abs(v.dot(rec.normal) / v.length())
+        return np.where(hit, distance_squared / (cosine * area), 0.0)
+
+    def random_batch(self, o):
+        n = len(o)
+        random_point = Vec3Batch(np.full(n, float(self.k)), self.y0 + batch_random.random(n) * (self.y1-self.y0), self.z0 + batch_random.random(n) * (self.z1-self.z0))
+        return random_point - o
+
+# Axis aligned box, intersected directly with one slab test. The face that
+# is hit gives the outward normal and the u/v of the matching rect.
 class Box(Hitable):
+    # outward normals of the -x, +x, -y, +y, -z, +z faces
+    normals = (Vec3(-1, 0, 0), Vec3(1, 0, 0), Vec3(0, -1, 0), Vec3(0, 1, 0), Vec3(0, 0, -1), Vec3(0, 0, 1))
+
     def __init__(self, p0, p1, material=None):
         self.p0 = p0
         self.p1 = p1
         self.ptr = material
+        self.material = material
+        self.low = (p0.x, p0.y, p0.z)
+        self.high = (p1.x, p1.y, p1.z)
+
+    # entry and exit distance with the face index of each, None for a miss
+    def slabs(self, ray):
+        o = ray.origin
+        d = ray.direction
+        t_near = -float('inf')
+        t_far = float('inf')
+        near_face = far_face = 0
+        for axis, origin, direction in ((0, o.x, d.x), (1, o.y, d.y), (2, o.z, d.z)):
+            low = self.low[axis]
+            high = self.high[axis]
+            if direction == 0:
+                if origin < low or origin > high:
+                    return None
+                continue
+            t0 = (low - origin) / direction
+            t1 = (high - origin) / direction
+            face0 = 2 * axis
+            face1 = face0 + 1
+            if t0 > t1:
+                t0, t1 = t1, t0
+                face0, face1 = face1, face0
+            if t0 > t_near:
+                t_near = t0
+                near_face = face0
+            if t1 < t_far:
+                t_far = t1
+                far_face = face1
+            if t_far < t_near:
+                return None
+        return t_near, near_face, t_far, far_face
 
     def hit(self, ray, t_min, t_max):
-        return self.box().hit(ray, t_min, t_max)
-
-    def box(self):
-        hit_list = []
-        hit_list.append(XYRect(self.p0.x, self.p1.x, self.p0.y, self.p1.y, self.p1.z, self.ptr))
-        hit_list.append(FlipNormals(XYRect(self.p0.x, self.p1.x, self.p0.y, self.p1.y, self.p0.z, self.ptr)))
-        hit_list.append(XZRect(self.p0.x, self.p1.x, self.p0.z, self.p1.z, self.p1.y, self.ptr))
-        hit_list.append(FlipNormals(XZRect(self.p0.x, self.p1.x, self.p0.z, self.p1.z, self.p0.y, self.ptr)))
-        hit_list.append(YZRect(self.p0.y, self.p1.y, self.p0.z, self.p1.z, self.p1.x, self.ptr))
-        hit_list.append(FlipNormals(YZRect(self.p0.y, self.p1.y, self.p0.z, self.p1.z, self.p0.x, self.ptr)))
-        return HitableList(hit_list)
-        
-    def bounding_box(self, t0, t1, box):
-        box = AABB(self.pmin, self.pmax)
-        return True
-    
+        slabs = self.slabs(ray)
+        if slabs is None:
+            return False
+        t_near, near_face, t_far, far_face = slabs
+        if t_min <= t_near <= t_max:
+            t, face = t_near, near_face
+        elif t_min <= t_far <= t_max:
+            t, face = t_far, far_face
+        else:
+            return False
+        p = ray.point_at_parameter(t)
+        u, v = self.face_uv(face >> 1, p)
+        return HitRecord(t, u, v, p, self.normals[face], self.material)
+
+    # u, v as the rect on that face would give them
+    def face_uv(self, axis, p):
+        p0 = self.p0
+        p1 = self.p1
+        if axis == 0:
+            return (p.y - p0.y) / (p1.y - p0.y), (p.z - p0.z) / (p1.z - p0.z)
+        if axis == 1:
+            return (p.x - p0.x) / (p1.x - p0.x), (p.z - p0.z) / (p1.z - p0.z)
+        return (p.x - p0.x) / (p1.x - p0.x), (p.y - p0.y) / (p1.y - p0.y)
+
+    def interval(self, ray):
+        slabs = self.slabs(ray)
+        if slabs is None:
+            return None
+        return slabs[0], slabs[2]
+
+    def interval_batch(self, rays):
+        t_near, near_face, t_far, far_face = self.slabs_batch(rays)
+        return t_near, t_far
+
+    # slabs() for every ray, t_near > t_far where it misses
+    def slabs_batch(self, rays):
+        n = len(rays)
+        o = rays.origin
+        d = rays.direction
+        t_near = np.full(n, -np.inf)
+        t_far = np.full(n, np.inf)
+        near_face = np.zeros(n, dtype=np.intp)
+        far_face = np.zeros(n, dtype=np.intp)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for axis, origin, direction in ((0, o.x, d.x), (1, o.y, d.y), (2, o.z, d.z)):
+                t0 = (self.low[axis] - origin) / direction
+                t1 = (self.high[axis] - origin) / direction
+                swap = t0 > t1
+                t0, t1 = np.where(swap, t1, t0), np.where(swap, t0, t1)
+                # parallel rays only miss when they start outside the slab
+                parallel = direction == 0
+                outside = parallel & ((origin < self.low[axis]) | (origin > self.high[axis]))
+                t0 = np.where(parallel, np.where(outside, np.inf, -np.inf), t0)
+                t1 = np.where(parallel, np.where(outside, -np.inf, np.inf), t1)
+                closer = t0 > t_near
+                t_near = np.where(closer, t0, t_near)
+                near_face = np.where(closer, 2 * axis + swap, near_face)
+                farther = t1 < t_far
+                t_far = np.where(farther, t1, t_far)
+                far_face = np.where(farther, 2 * axis + 1 - swap, far_face)
+        return t_near, near_face, t_far, far_face
+
+    def hit_batch(self, rays, t_min, rec):
+        t_near, near_face, t_far, far_face = self.slabs_batch(rays)
+        overlap = t_near <= t_far
+        use_near = overlap & (t_min <= t_near) & (t_near <= rec.t)
+        use_far = overlap & ~use_near & (t_min <= t_far) & (t_far <= rec.t)
+        hit = use_near | use_far
+        rows = np.flatnonzero(hit)
+        if len(rows):
+            t = np.where(use_near, t_near, t_far)[rows]
+            face = np.where(use_near, near_face, far_face)[rows]
+            p = rays[rows].point_at_parameter(t)
+            axis = face >> 1
+            low = np.array(self.low)
+            size = np.array(self.high) - low
+            points = p.to_array()
+            u_axis = np.where(axis == 0, 1, 0)
+            v_axis = np.where(axis == 2, 1, 2)
+            picked = np.arange(len(rows))
+            u = (points[picked, u_axis] - low[u_axis]) / size[u_axis]
+            v = (points[picked, v_axis] - low[v_axis]) / size[v_axis]
+            normal = Vec3Batch.from_array(np.array([(n.x, n.y, n.z) for n in self.normals])[face])
+            rec.set(rows, t, u, v, p, normal, self.material)
+        return hit
+
+    def bounding_box(self, t0, t1):
+        return AABB(self.p0, self.p1)
 
 class Sphere(Hitable):
     def __init__(self, center, radius, material=None):
@@ -291,6 +906,9 @@ class Sphere(Hitable):
         self.radius = radius
         self.material = material
 
+    def __reduce__(self):
+        return Sphere, (self.center, self.radius, self.material)
+
     def hit(self, ray, t_min, t_max):
         oc = ray.origin - self.center
         a = ray.direction.dot(ray.direction)
@@ -303,21 +921,45 @@ class Sphere(Hitable):
             if t_min < temp < t_max:
                 t = temp
                 p = ray.point_at_parameter(t)
-                u, v = get_sphere_uv((p-self.center)/self.radius)
                 normal = (p - self.center) / self.radius
+                u, v = get_sphere_uv(normal)
                 return HitRecord(t, u, v, p, normal, self.material)
             temp = (-b + dis_sqrt) / a
             if t_min < temp < t_max:
                 t = temp
                 p = ray.point_at_parameter(t)
-                u, v = get_sphere_uv((p-self.center)/self.radius)
                 normal = (p - self.center) / self.radius
+                u, v = get_sphere_uv(normal)
                 return HitRecord(t, u, v, p, normal, self.material)
         return False
 
-    def bounding_box(self, t0, t1, box):
-        box = AABB(self.center - Vec3(self.radius, self.radius, self.radius), self.center + Vec3(self.radius, self.radius, self.radius))
-        return True
+    def hit_batch(self, rays, t_min, rec):
+        return sphere_hit_batch(rays, t_min, rec, self.center, self.radius, self.material)
+
+    def interval(self, ray):
+        oc = ray.origin - self.center
+        a = ray.direction.dot(ray.direction)
+        b = oc.dot(ray.direction)
+        c = oc.dot(oc) - self.radius*self.radius
+        discriminant = b*b - a*c
+        if discriminant <= 0:
+            return None
+        dis_sqrt = sqrt(discriminant)
+        return (-b - dis_sqrt) / a, (-b + dis_sqrt) / a
+
+    def interval_batch(self, rays):
+        oc = rays.origin - self.center
+        a = rays.direction.dot(rays.direction)
+        b = oc.dot(rays.direction)
+        c = oc.dot(oc) - self.radius*self.radius
+        discriminant = b*b - a*c
+        dis_sqrt = np.sqrt(np.maximum(discriminant, 0))
+        miss = discriminant <= 0
+        return np.where(miss, np.inf, (-b - dis_sqrt) / a), np.where(miss, -np.inf, (-b + dis_sqrt) / a)
+
+    def bounding_box(self, t0, t1):
+        r = Vec3(self.radius, self.radius, self.radius)
+        return AABB(self.center - r, self.center + r)
 
     def pdf_value(self, o, v):
         rec = self.hit(Ray(o, v), 0.001, sys.float_info.max)
@@ -330,9 +972,47 @@ class Sphere(Hitable):
     def random(self, o):
         direction = self.center - o
         distant_squared = direction.squared_length()
-        uvw = ONB()
+        uvw = onb.scratch
         uvw.build_from_w(direction)
         return uvw.local(random_to_sphere(self.radius, distant_squared))
+
+    def pdf_value_batch(self, o, v):
+        rec = HitRecordBatch.empty(len(v))
+        hit = self.hit_batch(RayBatch(o, v), 0.001, rec)
+        cos_theta_max = np.sqrt(1 - self.radius * self.radius / (self.center - o).squared_length())
+        solid_angle = 2 * pi * (1 - cos_theta_max)
+        return np.where(hit, 1 / solid_angle, 0.0)
+
+    def random_batch(self, o):
+        direction = self.center - o
+        distant_squared = direction.squared_length()
+        uvw = ONBBatch()
+        uvw.build_from_w(direction)
+        return uvw.local(random_to_sphere_batch(self.radius, distant_squared))
+
+# center may be a Vec3 or a Vec3Batch with one center per ray
+def sphere_hit_batch(rays, t_min, rec, center, radius, material):
+    oc = rays.origin - center
+    a = rays.direction.dot(rays.direction)
+    b = oc.dot(rays.direction)
+    c = oc.dot(oc) - radius*radius
+    discriminant = b*b - a*c
+    dis_sqrt = np.sqrt(np.maximum(discriminant, 0))
+    near = (-b - dis_sqrt) / a
+    far = (-b + dis_sqrt) / a
+    use_near = (discriminant > 0) & (t_min < near) & (near < rec.t)
+    use_far = (discriminant > 0) & ~use_near & (t_min < far) & (far < rec.t)
+    hit = use_near | use_far
+    rows = np.flatnonzero(hit)
+    if len(rows):
+        t = np.where(use_near, near, far)[rows]
+        p = rays[rows].point_at_parameter(t)
+        if isinstance(center, Vec3Batch):
+            center = center[rows]
+        normal = (p - center) / radius
+        u, v = get_sphere_uv_batch(normal)
+        rec.set(rows, t, u, v, p, normal, material)
+    return hit
         
 
 class MovingSphere(Hitable):
@@ -344,11 +1024,15 @@ class MovingSphere(Hitable):
         self.radius = radius
         self.material = material
 
+    def __reduce__(self):
+        return MovingSphere, (self.center0, self.center1, self.time0, self.time1, self.radius, self.material)
+
     def center(self, time):
         return self.center0 + ((time - self.time0) / (self.time1 - self.time0)) * (self.center1 - self.center0)
 
     def hit(self, ray, t_min, t_max):
-        oc = ray.origin - self.center(ray.time)
+        center = self.center(ray.time)
+        oc = ray.origin - center
         a = ray.direction.dot(ray.direction)
         b = 2 * oc.dot(ray.direction)
         c = oc.dot(oc) - self.radius*self.radius
@@ -359,22 +1043,296 @@ class MovingSphere(Hitable):
             if(t_min < temp < t_max):
                 t = temp
                 p = ray.point_at_parameter(t)
-                normal = (p - self.center(ray.time)) / self.radius
-                return HitRecord(t, p, normal, self.material)
+                normal = (p - center) / self.radius
+                u, v = get_sphere_uv(normal)
+                return HitRecord(t, u, v, p, normal, self.material)
             temp = (-b + dis_sqrt) / (2*a)
             if t_min < temp < t_max:
                 t = temp
                 p = ray.point_at_parameter(t)
-                normal = (p - self.center(ray.time)) / self.radius
-                return HitRecord(t, p, normal, self.material)
+                normal = (p - center) / self.radius
+                u, v = get_sphere_uv(normal)
+                return HitRecord(t, u, v, p, normal, self.material)
         return False
+
+    def hit_batch(self, rays, t_min, rec):
+        center = scaled(self.center1 - self.center0, (rays.time - self.time0) / (self.time1 - self.time0)) + self.center0
+        return sphere_hit_batch(rays, t_min, rec, center, self.radius, self.material)
     
-    def bounding_box(self, t0, t1, box):
-        box0 = AABB(self.center(t0) - Vec3(self.radius, self.radius, self.radius), self.center(t0) + Vec3(self.radius, self.radius, self.radius))
-        box1 = AABB(self.center(t1) - Vec3(self.radius, self.radius, self.radius), self.center(t1) + Vec3(self.radius, self.radius, self.radius))
-        box = surrounding_box(box0, box1)
-        return True
+    def bounding_box(self, t0, t1):
+        r = Vec3(self.radius, self.radius, self.radius)
+        box0 = AABB(self.center(t0) - r, self.center(t0) + r)
+        box1 = AABB(self.center(t1) - r, self.center(t1) + r)
+        return surrounding_box(box0, box1)
     
+# Many spheres in flat arrays. One call tests every member, for a single
+# ray or for a RayBatch (rays x members), and keeps the closest hit.
+class SphereSet(Hitable):
+    def __init__(self, spheres):
+        spheres = list(spheres)
+        center0, center1, time0, time1 = [], [], [], []
+        for s in spheres:
+            if isinstance(s, MovingSphere):
+                center0.append((s.center0.x, s.center0.y, s.center0.z))
+                center1.append((s.center1.x, s.center1.y, s.center1.z))
+                time0.append(s.time0)
+                time1.append(s.time1)
+            else:
+                center0.append((s.center.x, s.center.y, s.center.z))
+                center1.append((s.center.x, s.center.y, s.center.z))
+                time0.append(0)
+                time1.append(1)
+        self.center0 = np.array(center0, dtype=np.float64).reshape(-1, 3)
+        self.motion = np.array(center1, dtype=np.float64).reshape(-1, 3) - self.center0
+        self.time0 = np.array(time0, dtype=np.float64)
+        self.time_span = np.array(time1, dtype=np.float64) - self.time0
+        self.radius = np.array([s.radius for s in spheres], dtype=np.float64)
+        self.materials = np.empty(len(spheres), dtype=object)
+        self.materials[:] = [s.material for s in spheres]
+        self.moving = bool(self.motion.any())
+        # |c0|^2 - r^2, c0.m and |m|^2 per member, so that every ray-member
+        # product below reduces to a matrix product with the ray origins and
+        # directions: |o - c|^2 = |o|^2 - 2 o.c + |c|^2 with c = c0 + f m
+        self.cc_rr = (self.center0 * self.center0).sum(axis=1) - self.radius * self.radius
+        self.cm = (self.center0 * self.motion).sum(axis=1)
+        self.mm = (self.motion * self.motion).sum(axis=1)
+
+    def __len__(self):
+        return len(self.radius)
+
+    # member centers at the given time(s), shape (..., members, 3)
+    def centers(self, time):
+        if not self.moving:
+            return self.center0
+        time = np.asarray(time, dtype=np.float64)[..., None]
+        return self.center0 + ((time - self.time0) / self.time_span)[..., None] * self.motion
+
+    # origin and direction are (3,) for one ray or (n, 3) for a batch,
+    # gives the nearest t per ray and member, inf for a miss
+    def _intersect(self, origin, direction, time, t_min, t_max):
+        a = (direction * direction).sum(axis=-1)[..., None]
+        od = (origin * direction).sum(axis=-1)[..., None]
+        oo = (origin * origin).sum(axis=-1)[..., None]
+        oc = origin @ self.center0.T
+        dc = direction @ self.center0.T
+        cc_rr = self.cc_rr
+        if self.moving:
+            f = (np.asarray(time)[..., None] - self.time0) / self.time_span
+            oc = oc + f * (origin @ self.motion.T)
+            dc = dc + f * (direction @ self.motion.T)
+            cc_rr = cc_rr + f * (2 * self.cm + f * self.mm)
+        b = od - dc
+        c = oo - 2 * oc + cc_rr
+        return closest_root(a, b, c, t_min, t_max)
+
+    def hit(self, ray, t_min, t_max):
+        o = ray.origin
+        d = ray.direction
+        t = self._intersect(np.array((o.x, o.y, o.z)), np.array((d.x, d.y, d.z)), ray.time, t_min, t_max)
+        i = int(t.argmin())
+        t = float(t[i])
+        if t == np.inf:
+            return False
+        p = ray.point_at_parameter(t)
+        center = Vec3(*self.centers(ray.time)[i].tolist())
+        normal = (p - center) / float(self.radius[i])
+        u, v = get_sphere_uv(normal)
+        return HitRecord(t, u, v, p, normal, self.materials[i])
+
+    def hit_batch(self, rays, t_min, rec):
+        n = len(rays)
+        hit = np.zeros(n, dtype=bool)
+        step = max(1, batch_elements // len(self))
+        for start in range(0, n, step):
+            rows = np.arange(start, min(n, start + step))
+            hit[rows] = self._hit_rows(rays[rows], take(t_min, rows), rec, rows)
+        return hit
+
+    def _hit_rows(self, rays, t_min, rec, rows):
+        t = self._intersect(rays.origin.to_array(), rays.direction.to_array(), rays.time,
+                            np.reshape(t_min, (-1, 1)), rec.t[rows][:, None])
+        member = t.argmin(axis=1)
+        t = t[np.arange(len(rows)), member]
+        hit = t < np.inf
+        found = np.flatnonzero(hit)
+        if len(found):
+            member = member[found]
+            t = t[found]
+            p = rays[found].point_at_parameter(t)
+            center = Vec3Batch.from_array(self.center0[member])
+            if self.moving:
+                f = (rays.time[found] - self.time0[member]) / self.time_span[member]
+                center = center + Vec3Batch.from_array(self.motion[member]) * f
+            normal = (p - center) / self.radius[member]
+            u, v = get_sphere_uv_batch(normal)
+            rec.set(rows[found], t, u, v, p, normal, self.materials[member])
+        return hit
+
+    def bounding_box(self, t0, t1):
+        low = np.minimum(self.centers(t0), self.centers(t1)) - self.radius[:, None]
+        high = np.maximum(self.centers(t0), self.centers(t1)) + self.radius[:, None]
+        return AABB(Vec3(*low.min(axis=0).tolist()), Vec3(*high.max(axis=0).tolist()))
+
+# nearest root of a*t^2 + 2*b*t + c inside (t_min, t_max), inf where there
+# is none. Most ray/sphere pairs miss, so the roots are only solved for the
+# pairs with a positive discriminant.
+def closest_root(a, b, c, t_min, t_max):
+    discriminant = b*b - a*c
+    candidates = np.nonzero(discriminant > 0)
+    shape = discriminant.shape
+    a = np.broadcast_to(a, shape)[candidates]
+    b = b[candidates]
+    t_min = np.broadcast_to(t_min, shape)[candidates]
+    t_max = np.broadcast_to(t_max, shape)[candidates]
+    dis_sqrt = np.sqrt(discriminant[candidates])
+    near = (-b - dis_sqrt) / a
+    far = (-b + dis_sqrt) / a
+    root = np.where((t_min < near) & (near < t_max), near,
+                    np.where((t_min < far) & (far < t_max), far, np.inf))
+    t = np.full(shape, np.inf)
+    t[candidates] = root
+    return t
+
+# plane axis, the two in-plane axes (x=0, y=1, z=2) and the names of the
+# in-plane bounds for each rect class
+rect_axes = {XYRect: (2, 0, 1, ('x0', 'x1', 'y0', 'y1')),
+             XZRect: (1, 0, 2, ('x0', 'x1', 'z0', 'z1')),
+             YZRect: (0, 1, 2, ('y0', 'y1', 'z0', 'z1'))}
+
+# Axis aligned rects in flat arrays, including FlipNormals wrapped ones.
+class RectSet(Hitable):
+    def __init__(self, rects):
+        rects = list(rects)
+        axis, a_axis, b_axis, k, a0, a1, b0, b1, flip, materials = ([] for i in range(10))
+        for r in rects:
+            sign = 1.0
+            if isinstance(r, FlipNormals):
+                r = r.hitable
+                sign = -1.0
+            plane, a, b, names = rect_axes[type(r)]
+            bounds = [getattr(r, name) for name in names]
+            axis.append(plane)
+            a_axis.append(a)
+            b_axis.append(b)
+            k.append(r.k)
+            a0.append(bounds[0])
+            a1.append(bounds[1])
+            b0.append(bounds[2])
+            b1.append(bounds[3])
+            flip.append(sign)
+            materials.append(r.material)
+        self.axis = np.array(axis, dtype=np.intp)
+        self.a_axis = np.array(a_axis, dtype=np.intp)
+        self.b_axis = np.array(b_axis, dtype=np.intp)
+        self.k = np.array(k, dtype=np.float64)
+        self.a0 = np.array(a0, dtype=np.float64)
+        self.a1 = np.array(a1, dtype=np.float64)
+        self.b0 = np.array(b0, dtype=np.float64)
+        self.b1 = np.array(b1, dtype=np.float64)
+        self.normals = np.zeros((len(rects), 3))
+        self.normals[np.arange(len(rects)), self.axis] = flip
+        self.materials = np.empty(len(rects), dtype=object)
+        self.materials[:] = materials
+
+    def __len__(self):
+        return len(self.k)
+
+    def hit(self, ray, t_min, t_max):
+        o = ray.origin
+        d = ray.direction
+        origin = np.array((o.x, o.y, o.z))
+        direction = np.array((d.x, d.y, d.z))
+        t, u, v = self._intersect(origin, direction, t_min, t_max)
+        i = int(t.argmin())
+        t = float(t[i])
+        if t == np.inf:
+            return False
+        normal = Vec3(*self.normals[i].tolist())
+        return HitRecord(t, float(u[i]), float(v[i]), ray.point_at_parameter(t), normal, self.materials[i])
+
+    # origin and direction are (3,) for one ray or (n, 3) for a batch
+    def _intersect(self, origin, direction, t_min, t_max):
+        t = (self.k - origin[..., self.axis]) / direction[..., self.axis]
+        pa = origin[..., self.a_axis] + t * direction[..., self.a_axis]
+        pb = origin[..., self.b_axis] + t * direction[..., self.b_axis]
+        inside = (t >= t_min) & (t <= t_max) & (pa >= self.a0) & (pa <= self.a1) & (pb >= self.b0) & (pb <= self.b1)
+        t = np.where(inside, t, np.inf)
+        return t, (pa - self.a0) / (self.a1 - self.a0), (pb - self.b0) / (self.b1 - self.b0)
+
+    def hit_batch(self, rays, t_min, rec):
+        n = len(rays)
+        hit = np.zeros(n, dtype=bool)
+        step = max(1, batch_elements // len(self))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for start in range(0, n, step):
+                rows = np.arange(start, min(n, start + step))
+                hit[rows] = self._hit_rows(rays[rows], take(t_min, rows), rec, rows)
+        return hit
+
+    def _hit_rows(self, rays, t_min, rec, rows):
+        origin = rays.origin.to_array()
+        direction = rays.direction.to_array()
+        t, u, v = self._intersect(origin, direction, np.reshape(t_min, (-1, 1)), rec.t[rows][:, None])
+        member = t.argmin(axis=1)
+        pick = np.arange(len(rows)), member
+        t = t[pick]
+        hit = t < np.inf
+        found = np.flatnonzero(hit)
+        if len(found):
+            member = member[found]
+            t = t[found]
+            rec.set(rows[found], t, u[pick][found], v[pick][found], rays[found].point_at_parameter(t),
+                    Vec3Batch.from_array(self.normals[member]), self.materials[member])
+        return hit
+
+    def bounding_box(self, t0, t1):
+        low = np.zeros((len(self), 3))
+        high = np.zeros((len(self), 3))
+        members = np.arange(len(self))
+        for axis, lo, hi in ((self.axis, self.k - 0.0001, self.k + 0.0001), (self.a_axis, self.a0, self.a1), (self.b_axis, self.b0, self.b1)):
+            low[members, axis] = lo
+            high[members, axis] = hi
+        return AABB(Vec3(*low.min(axis=0).tolist()), Vec3(*high.max(axis=0).tolist()))
+
+# spatially coherent clusters of at most size hitables
+def clusters(hitables, size, time0=0, time1=1):
+    pending = [[(obj.bounding_box(time0, time1), obj) for obj in hitables]]
+    while pending:
+        boxed = pending.pop()
+        if len(boxed) <= size:
+            yield [obj for box, obj in boxed]
+        else:
+            pending.extend(split_median(boxed))
+
+# Pull the spheres and axis aligned rects out of a hit list into
+# SphereSets and a RectSet, everything else is passed through as is.
+# With set_size the spheres are split into spatial clusters of at most
+# that many, so a BVHNode built on top can skip whole sets.
+def group_primitives(hit_list, set_size=None):
+    if isinstance(hit_list, HitableList):
+        hit_list = hit_list.hit_list
+    spheres, rects, others = [], [], []
+    for obj in hit_list:
+        if type(obj) in (Sphere, MovingSphere):
+            spheres.append(obj)
+        elif type(obj) in rect_axes or (type(obj) is FlipNormals and type(obj.hitable) in rect_axes):
+            rects.append(obj)
+        else:
+            others.append(obj)
+    sphere_groups = [spheres]
+    if set_size and len(spheres) > set_size:
+        sphere_groups = list(clusters(spheres, set_size))
+    for group, group_class in [(group, SphereSet) for group in sphere_groups] + [(rects, RectSet)]:
+        if len(group) > 1:
+            others.append(group_class(group))
+        else:
+            others.extend(group)
+    return HitableList(others)
+
+# A homogeneous medium filling a closed boundary. The stretch of the ray
+# inside comes from one interval() of the boundary, and the distance to the
+# next scattering is drawn from the exponential of the density, as
+# GridMedium (medium.py) draws it block by block.
 class ConstantMedium(Hitable):
     def __init__(self, boundary, density, texture):
         self.boundary = boundary
@@ -382,24 +1340,42 @@ class ConstantMedium(Hitable):
         self.material = Isotropic(texture)
 
     def hit(self, ray, t_min, t_max):
-        rec1 = self.boundary.hit(ray, -sys.float_info.max, sys.float_info.max)
-        if rec1:
-            rec2 = self.boundary.hit(ray, rec1.t + 0.0001, sys.float_info.max)
-            if rec2:
-                rec1_t = max(rec1.t, t_min)
-                rec2_t = min(rec2.t, t_max)
-                if rec1_t < 0:
-                    return False
-                distInsideBoundary = (rec2_t - rec1_t) * ray.direction.length()
-                hitDistance = -(1.0 / self.density) * log(random.random())
-                if hitDistance < distInsideBoundary:
-                    t = rec2_t + hitDistance / ray.direction.length()
-                    p = ray.point_at_parameter(t)
-                    normal = Vec3(1,0,0)
-                    return HitRecord(t, 0, 0, p, normal, self.material)
+        interval = self.boundary.interval(ray)
+        if interval is None:
+            return False
+        rec1_t = max(interval[0], t_min)
+        rec2_t = min(interval[1], t_max)
+        if rec1_t >= rec2_t:
+            return False
+        length = ray.direction.length()
+        distInsideBoundary = (rec2_t - rec1_t) * length
+        hitDistance = -(1.0 / self.density) * log(rng.random())
+        if hitDistance < distInsideBoundary:
+            t = rec1_t + hitDistance / length
+            p = ray.point_at_parameter(t)
+            normal = Vec3(1,0,0)
+            return HitRecord(t, 0, 0, p, normal, self.material)
         return False
 
+    def hit_batch(self, rays, t_min, rec):
+        n = len(rays)
+        t0, t1 = self.boundary.interval_batch(rays)
+        rec1_t = np.maximum(t0, t_min)
+        rec2_t = np.minimum(t1, rec.t)
+        length = rays.direction.length()
+        distInsideBoundary = (rec2_t - rec1_t) * length
+        hitDistance = -(1.0 / self.density) * np.log(batch_random.random(n))
+        hit = (rec1_t < rec2_t) & (hitDistance < distInsideBoundary)
+        rows = np.flatnonzero(hit)
+        if len(rows):
+            t = rec1_t[rows] + hitDistance[rows] / length[rows]
+            rec.set(rows, t, 0, 0, rays[rows].point_at_parameter(t), Vec3Batch.full(len(rows), Vec3(1,0,0)), self.material)
+        return hit
+
     def bounding_box(self, sceneTime0, sceneTime1):
         return self.boundary.bounding_box(sceneTime0, sceneTime1)
 
+    def refit(self, t0, t1):
+        return self.boundary.refit(t0, t1)
+
 
@@ -0,0 +1,330 @@
+import numpy as np
+from vec3 import Vec3
+from aabb import AABB
+from hitable import Hitable, take
+
+# Linear BVH in flat arrays. The primitives are sorted by the Morton code of
+# their box centers and each node splits its range at the highest bit in
+# which the codes of its first and last primitive differ. Nodes are stored
+# depth first in one structured array: an inner node's left child follows
+# it and next is its right child, axis the axis of the split, a leaf has
+# count > 0 and next is its first primitive in the sorted order. Nothing
+# in it is a Python object, so it can be saved with np.save and mapped
+# back with np.load.
+
+node_dtype = np.dtype([('low', '<f8', 3), ('high', '<f8', 3), ('next', '<i4'), ('count', '<i4'), ('axis', '<i1')])
+
+# 10 bits per axis spread out to every third bit
+def spread_bits(v):
+    v = v.astype(np.uint64)
+    v = (v | (v << np.uint64(16))) & np.uint64(0x030000FF)
+    v = (v | (v << np.uint64(8))) & np.uint64(0x0300F00F)
+    v = (v | (v << np.uint64(4))) & np.uint64(0x030C30C3)
+    v = (v | (v << np.uint64(2))) & np.uint64(0x09249249)
+    return v
+
+def morton_codes(centers):
+    low = centers.min(axis=0)
+    extent = np.maximum(centers.max(axis=0) - low, 1e-12)
+    cells = np.clip((centers - low) / extent * 1023, 0, 1023)
+    return (spread_bits(cells[:, 0]) << np.uint64(2)) | (spread_bits(cells[:, 1]) << np.uint64(1)) | spread_bits(cells[:, 2])
+
+# lows and highs are (n, 3) boxes; returns the nodes and the order of the
+# primitives. The tree is split a level at a time over arrays of ranges,
+# then numbered depth first from the sizes of the subtrees, and its boxes
+# are filled in from the leaves up.
+def build(lows, highs, leaf_size=1):
+    lows = np.asarray(lows, dtype=np.float64).reshape(-1, 3)
+    highs = np.asarray(highs, dtype=np.float64).reshape(-1, 3)
+    codes = morton_codes((lows + highs) / 2)
+    order = np.argsort(codes, kind='stable')
+    codes = codes[order]
+    lows = lows[order]
+    highs = highs[order]
+    levels = []
+    start = np.zeros(1, dtype=np.int64)
+    end = np.full(1, len(order), dtype=np.int64)
+    while len(start):
+        inner = np.flatnonzero(end - start > leaf_size)
+        s = start[inner]
+        e = end[inner]
+        first = codes[s]
+        last = codes[e - 1]
+        differ = first != last
+        bit = (np.frexp((first ^ last).astype(np.float64))[1] - 1).astype(np.uint64)
+        prefix = (last >> bit) << bit
+        middle = np.where(differ, np.searchsorted(codes, prefix), (s + e) // 2)
+        axis = np.where(differ, 2 - bit.astype(np.int64) % 3, 0)
+        levels.append((start, end, inner, middle, axis))
+        start = np.stack((s, middle), axis=1).ravel()
+        end = np.stack((middle, e), axis=1).ravel()
+    # nodes in each subtree, children before parents
+    sizes = [None] * len(levels)
+    below = None
+    for depth in range(len(levels) - 1, -1, -1):
+        start, end, inner = levels[depth][:3]
+        size = np.ones(len(start), dtype=np.int64)
+        if len(inner):
+            size[inner] += below[0::2] + below[1::2]
+        sizes[depth] = size
+        below = size
+    # depth first numbering: the left child follows its parent, the right
+    # one follows the left subtree
+    numbers = [np.zeros(1, dtype=np.int64)]
+    for depth in range(len(levels) - 1):
+        inner = levels[depth][2]
+        parent = numbers[depth][inner]
+        left = parent + 1
+        right = left + sizes[depth + 1][0::2]
+        numbers.append(np.stack((left, right), axis=1).ravel())
+    nodes = np.zeros(int(sizes[0][0]), dtype=node_dtype)
+    # the leaves cover the primitives in order, one reduceat bounds them all
+    leaf_start = np.concatenate([np.delete(level[0], level[2]) for level in levels])
+    leaf_end = np.concatenate([np.delete(level[1], level[2]) for level in levels])
+    leaf_number = np.concatenate([np.delete(numbers[depth], levels[depth][2]) for depth in range(len(levels))])
+    by_start = np.argsort(leaf_start)
+    leaf_start = leaf_start[by_start]
+    leaf_number = leaf_number[by_start]
+    nodes['low'][leaf_number] = np.minimum.reduceat(lows, leaf_start)
+    nodes['high'][leaf_number] = np.maximum.reduceat(highs, leaf_start)
+    nodes['next'][leaf_number] = leaf_start
+    nodes['count'][leaf_number] = leaf_end[by_start] - leaf_start
+    for depth in range(len(levels) - 2, -1, -1):
+        start, end, inner, middle, axis = levels[depth]
+        parent = numbers[depth][inner]
+        left = numbers[depth + 1][0::2]
+        right = numbers[depth + 1][1::2]
+        nodes['low'][parent] = np.minimum(nodes['low'][left], nodes['low'][right])
+        nodes['high'][parent] = np.maximum(nodes['high'][left], nodes['high'][right])
+        nodes['next'][parent] = right
+        nodes['axis'][parent] = axis
+    return nodes, order
+
+# The nodes as a Hitable over primitives given in their sorted order. The
+# scalar walk keeps the nodes as Python lists and an explicit stack and
+# visits the child on the ray's side of the split first; the batched one
+# carries the rows of rays still inside each node down.
+class FlatBVH(Hitable):
+    def __init__(self, nodes, primitives):
+        self.nodes = nodes
+        self.primitives = primitives
+        self.low = nodes['low'].tolist()
+        self.high = nodes['high'].tolist()
+        self.next = nodes['next'].tolist()
+        self.count = nodes['count'].tolist()
+        self.axis = nodes['axis'].tolist()
+
+    def hit(self, ray, t_min, t_max):
+        o = ray.origin
+        d = ray.direction
+        ox, oy, oz = o.x, o.y, o.z
+        # a huge inverse stands in for the infinite one of a zero component
+        ix = 1 / d.x if d.x else 1e300
+        iy = 1 / d.y if d.y else 1e300
+        iz = 1 / d.z if d.z else 1e300
+        low = self.low
+        high = self.high
+        count = self.count
+        following = self.next
+        primitives = self.primitives
+        axes = self.axis
+        backwards = (d.x < 0, d.y < 0, d.z < 0)
+        result = False
+        stack = [0]
+        while stack:
+            i = stack.pop()
+            lx, ly, lz = low[i]
+            hx, hy, hz = high[i]
+            t0 = (lx - ox) * ix
+            t1 = (hx - ox) * ix
+            if t0 > t1:
+                t0, t1 = t1, t0
+            near = t0 if t0 > t_min else t_min
+            far = t1 if t1 < t_max else t_max
+            t0 = (ly - oy) * iy
+            t1 = (hy - oy) * iy
+            if t0 > t1:
+                t0, t1 = t1, t0
+            if t0 > near:
+                near = t0
+            if t1 < far:
+                far = t1
+            t0 = (lz - oz) * iz
+            t1 = (hz - oz) * iz
+            if t0 > t1:
+                t0, t1 = t1, t0
+            if t0 > near:
+                near = t0
+            if t1 < far:
+                far = t1
+            if near > far:
+                continue
+            n = count[i]
+            if n:
+                first = following[i]
+                for primitive in primitives[first:first + n]:
+                    rec = primitive.hit(ray, t_min, t_max)
+                    if rec:
+                        t_max = rec.t
+                        result = rec
+            elif backwards[axes[i]]:
+                stack.append(i + 1)
+                stack.append(following[i])
+            else:
+                stack.append(following[i])
+                stack.append(i + 1)
+        return result
+
+    def hit_batch(self, rays, t_min, rec):
+        hit = np.zeros(len(rays), dtype=bool)
+        origin = (rays.origin.x, rays.origin.y, rays.origin.z)
+        with np.errstate(divide='ignore'):
+            inverse = [np.where(d != 0, 1 / d, 1e300) for d in (rays.direction.x, rays.direction.y, rays.direction.z)]
+        t_mins = np.broadcast_to(t_min, (len(rays),))
+        stack = [(0, np.arange(len(rays)))]
+        with np.errstate(over='ignore', invalid='ignore'):
+            while stack:
+                i, rows = stack.pop()
+                near = t_mins[rows]
+                far = rec.t[rows]
+                for axis in range(3):
+                    o = origin[axis][rows]
+                    inv = inverse[axis][rows]
+                    t0 = (self.low[i][axis] - o) * inv
+                    t1 = (self.high[i][axis] - o) * inv
+                    near = np.maximum(near, np.minimum(t0, t1))
+                    far = np.minimum(far, np.maximum(t0, t1))
+                rows = rows[near <= far]
+                if not len(rows):
+                    continue
+                n = self.count[i]
+                if not n:
+                    stack.append((self.next[i], rows))
+                    stack.append((i + 1, rows))
+                    continue
+                sub_rays = rays[rows]
+                sub_t_min = take(t_min, rows)
+                sub_rec = rec[rows]
+                sub_hit = np.zeros(len(rows), dtype=bool)
+                first = self.next[i]
+                for primitive in self.primitives[first:first + n]:
+                    sub_hit |= primitive.hit_batch(sub_rays, sub_t_min, sub_rec)
+                rec.assign(rows[sub_hit], sub_rec[sub_hit])
+                hit[rows[sub_hit]] = True
+        return hit
+
+    # indices of the primitives whose leaf boxes the ray o + t d crosses
+    # for some t past t_min, which is where shapes such as lights can have
+    # a nonzero pdf_value
+    def crossed(self, o, d, t_min=0.001):
+        ox, oy, oz = o.x, o.y, o.z
+        ix = 1 / d.x if d.x else 1e300
+        iy = 1 / d.y if d.y else 1e300
+        iz = 1 / d.z if d.z else 1e300
+        low = self.low
+        high = self.high
+        count = self.count
+        following = self.next
+        found = []
+        stack = [0]
+        while stack:
+            i = stack.pop()
+            lx, ly, lz = low[i]
+            hx, hy, hz = high[i]
+            t0 = (lx - ox) * ix
+            t1 = (hx - ox) * ix
+            if t0 > t1:
+                t0, t1 = t1, t0
+            near = t0 if t0 > t_min else t_min
+            far = t1
+            t0 = (ly - oy) * iy
+            t1 = (hy - oy) * iy
+            if t0 > t1:
+                t0, t1 = t1, t0
+            if t0 > near:
+                near = t0
+            if t1 < far:
+                far = t1
+            t0 = (lz - oz) * iz
+            t1 = (hz - oz) * iz
+            if t0 > t1:
+                t0, t1 = t1, t0
+            if t0 > near:
+                near = t0
+            if t1 < far:
+                far = t1
+            if near > far:
+                continue
+            n = count[i]
+            if n:
+                first = following[i]
+                found.extend(range(first, first + n))
+            else:
+                stack.append(following[i])
+                stack.append(i + 1)
+        return found
+
+    # the same for Vec3Batch origins and directions: (index, rows) per
+    # primitive crossed by any of the rays
+    def crossed_batch(self, origin, direction, t_min=0.001):
+        found = []
+        origin = (origin.x, origin.y, origin.z)
+        with np.errstate(divide='ignore'):
+            inverse = [np.where(d != 0, 1 / d, 1e300) for d in (direction.x, direction.y, direction.z)]
+        stack = [(0, np.arange(len(origin[0])))]
+        with np.errstate(over='ignore', invalid='ignore'):
+            while stack:
+                i, rows = stack.pop()
+                near = np.full(len(rows), t_min)
+                far = np.full(len(rows), np.inf)
+                for axis in range(3):
+                    o = origin[axis][rows]
+                    inv = inverse[axis][rows]
+                    t0 = (self.low[i][axis] - o) * inv
+                    t1 = (self.high[i][axis] - o) * inv
+                    near = np.maximum(near, np.minimum(t0, t1))
+                    far = np.minimum(far, np.maximum(t0, t1))
+                rows = rows[near <= far]
+                if not len(rows):
+                    continue
+                n = self.count[i]
+                if n:
+                    first = self.next[i]
+                    found.extend((index, rows) for index in range(first, first + n))
+                else:
+                    stack.append((self.next[i], rows))
+                    stack.append((i + 1, rows))
+        return found
+
+    def box(self, i):
+        return AABB(Vec3(*self.low[i]), Vec3(*self.high[i]))
+
+    def bounding_box(self, t0, t1):
+        return self.box(0)
+
+    # Children are numbered after their parents, so one pass from the last
+    # node back to the root sees both children of a node before the node.
+    # The nodes array may be mapped read only from a scene cache, the new
+    # boxes go into a copy.
+    def refit(self, t0, t1):
+        low = self.low
+        high = self.high
+        count = self.count
+        following = self.next
+        for i in range(len(low) - 1, -1, -1):
+            n = count[i]
+            if n:
+                first = following[i]
+                boxes = [primitive.refit(t0, t1) for primitive in self.primitives[first:first + n]]
+                low[i] = [min(b.min_hit.x for b in boxes), min(b.min_hit.y for b in boxes), min(b.min_hit.z for b in boxes)]
+                high[i] = [max(b.max_hit.x for b in boxes), max(b.max_hit.y for b in boxes), max(b.max_hit.z for b in boxes)]
+            else:
+                left = i + 1
+                right = following[i]
+                low[i] = [min(a, b) for a, b in zip(low[left], low[right])]
+                high[i] = [max(a, b) for a, b in zip(high[left], high[right])]
+        nodes = np.array(self.nodes)
+        nodes['low'] = low
+        nodes['high'] = high
+        self.nodes = nodes
+        return self.box(0)
@@ -0,0 +1,168 @@
+from math import pi
+import numpy as np
+from vec3 import Vec3
+from vec3batch import Vec3Batch
+from hitable import Hitable, HitableList, BVHNode, FlipNormals, Sphere, XYRect, XZRect, YZRect, SphereSet, RectSet
+from material import DiffuseLight
+from pdf import batch_random
+import lbvh
+import rng
+
+# Sampling many lights. find_lights() collects the emitters of a world and
+# LightSet picks one of them in proportion to its power with an alias
+# table, one uniform and O(1) per pick. Its pdf_value only asks the lights
+# whose boxes the direction crosses, found through a linear BVH over the
+# lights, instead of every light as HitableList does.
+
+# the spheres and rects with a DiffuseLight in a world, the members of
+# SphereSets and RectSets made into shapes of their own again. Emitters
+# under transforms and media cannot be sampled and are left to the paths
+# that hit them.
+def find_lights(world):
+    found = []
+    stack = [world]
+    while stack:
+        obj = stack.pop()
+        if isinstance(obj, HitableList):
+            stack.extend(reversed(obj.hit_list))
+        elif isinstance(obj, BVHNode):
+            if obj.right is not None:
+                stack.append(obj.right)
+            stack.append(obj.left)
+        elif isinstance(obj, lbvh.FlatBVH):
+            stack.extend(reversed(obj.primitives))
+        elif isinstance(obj, FlipNormals):
+            stack.append(obj.hitable)
+        elif isinstance(obj, SphereSet):
+            found.extend(set_spheres(obj))
+        elif isinstance(obj, RectSet):
+            found.extend(set_rects(obj))
+        elif type(obj) in (Sphere, XYRect, XZRect, YZRect) and isinstance(obj.material, DiffuseLight):
+            found.append(obj)
+    return found
+
+def set_spheres(spheres):
+    for i, material in enumerate(spheres.materials):
+        if isinstance(material, DiffuseLight) and not spheres.motion[i].any():
+            yield Sphere(Vec3(*spheres.center0[i].tolist()), float(spheres.radius[i]), material)
+
+def set_rects(rects):
+    classes = {2: XYRect, 1: XZRect, 0: YZRect}
+    for i, material in enumerate(rects.materials):
+        if isinstance(material, DiffuseLight):
+            bounds = (float(rects.a0[i]), float(rects.a1[i]), float(rects.b0[i]), float(rects.b1[i]), float(rects.k[i]))
+            yield classes[int(rects.axis[i])](*bounds, material)
+
+# emitted luminance times area
+def power(light):
+    if isinstance(light, Sphere):
+        area = 4 * pi * light.radius * light.radius
+    elif isinstance(light, XYRect):
+        area = (light.x1 - light.x0) * (light.y1 - light.y0)
+    elif isinstance(light, XZRect):
+        area = (light.x1 - light.x0) * (light.z1 - light.z0)
+    else:
+        area = (light.y1 - light.y0) * (light.z1 - light.z0)
+    box = light.bounding_box(0, 1)
+    color = light.material.emit.value(0.5, 0.5, 0.5 * (box.min_hit + box.max_hit))
+    return area * (color.x * 0.2126 + color.y * 0.7152 + color.z * 0.0722)
+
+# Vose's alias method: entry i is taken with probability prob[i] and
+# alias[i] otherwise
+def alias_table(weights):
+    n = len(weights)
+    total = sum(weights)
+    if not total > 0:
+        raise ValueError('alias_table needs weights with a positive sum, got {}'.format(total))
+    scaled = [w * n / total for w in weights]
+    prob = [1.0] * n
+    alias = list(range(n))
+    small = [i for i in range(n) if scaled[i] < 1]
+    large = [i for i in range(n) if scaled[i] >= 1]
+    while small and large:
+        s = small.pop()
+        l = large.pop()
+        prob[s] = scaled[s]
+        alias[s] = l
+        scaled[l] -= 1 - scaled[s]
+        (small if scaled[l] < 1 else large).append(l)
+    return prob, alias
+
+class LightSet(Hitable):
+    def __init__(self, lights, weights=None):
+        if not lights:
+            raise ValueError('LightSet needs at least one light')
+        if weights is None:
+            weights = [power(light) for light in lights]
+        boxes = [light.bounding_box(0, 1) for light in lights]
+        nodes, order = lbvh.build([(b.min_hit.x, b.min_hit.y, b.min_hit.z) for b in boxes],
+                                  [(b.max_hit.x, b.max_hit.y, b.max_hit.z) for b in boxes])
+        self.lights = [lights[i] for i in order]
+        weights = [float(weights[i]) for i in order]
+        if any(not w >= 0 for w in weights):
+            raise ValueError('LightSet weights must be zero or more, got {}'.format(weights))
+        total = sum(weights)
+        # black lights only, picked evenly
+        if total == 0:
+            weights = [1.0] * len(weights)
+            total = float(len(weights))
+        self.probability = [w / total for w in weights]
+        self.prob, self.alias = alias_table(weights)
+        self.prob_array = np.array(self.prob)
+        self.alias_array = np.array(self.alias, dtype=np.intp)
+        self.bvh = lbvh.FlatBVH(nodes, self.lights)
+
+    def __len__(self):
+        return len(self.lights)
+
+    def hit(self, ray, t_min, t_max):
+        return self.bvh.hit(ray, t_min, t_max)
+
+    def hit_batch(self, rays, t_min, rec):
+        return self.bvh.hit_batch(rays, t_min, rec)
+
+    def bounding_box(self, t0, t1):
+        return self.bvh.bounding_box(t0, t1)
+
+    # a single light draws nothing, so it samples exactly like the light
+    def pdf_value(self, o, v):
+        lights = self.lights
+        if len(lights) == 1:
+            return lights[0].pdf_value(o, v)
+        probability = self.probability
+        total = 0
+        for i in self.bvh.crossed(o, v):
+            total += probability[i] * lights[i].pdf_value(o, v)
+        return total
+
+    def random(self, o):
+        n = len(self.lights)
+        if n == 1:
+            return self.lights[0].random(o)
+        u = rng.random() * n
+        i = min(int(u), n - 1)
+        if u - i >= self.prob[i]:
+            i = self.alias[i]
+        return self.lights[i].random(o)
+
+    def pdf_value_batch(self, o, v):
+        if len(self.lights) == 1:
+            return self.lights[0].pdf_value_batch(o, v)
+        total = np.zeros(len(v))
+        for i, rows in self.bvh.crossed_batch(o, v):
+            total[rows] += self.probability[i] * self.lights[i].pdf_value_batch(o[rows], v[rows])
+        return total
+
+    def random_batch(self, o):
+        n = len(self.lights)
+        if n == 1:
+            return self.lights[0].random_batch(o)
+        u = batch_random.random(len(o)) * n
+        index = np.minimum(u.astype(np.intp), n - 1)
+        index = np.where(u - index < self.prob_array[index], index, self.alias_array[index])
+        directions = Vec3Batch.zeros(len(o))
+        order = np.argsort(index, kind='stable')
+        chosen, starts = np.unique(index[order], return_index=True)
+        for i, rows in zip(chosen.tolist(), np.split(order, starts[1:])):
+            directions[rows] = self.lights[i].random_batch(o[rows])
+        return directions
@@ -1,16 +1,31 @@
 import sys
 import math
+import argparse
 import random
-from time import time
-from multiprocessing import Pool
+from time import time, perf_counter
+from collections import Counter
+from multiprocessing import Pool, cpu_count
+import numpy as np
 import cProfile
 from ray import Ray
 from vec3 import Vec3
-from hitable import Hitable, HitableList, Sphere, MovingSphere, XYRect, XZRect, YZRect, FlipNormals, Box, Translate, RotateY, ConstantMedium
+from hitable import Hitable, HitableList, BVHNode, group_primitives, Sphere, MovingSphere, XYRect, XZRect, YZRect, FlipNormals, Box, Instance, ConstantMedium
 from camera import Camera, FOVCamera, PosCamera, DofCamera, MoBlurCamera
 from material import Lambertian, Metal, Dielectric, DiffuseLight, ScatterRecord
-from texture import ConstantTexture, CheckerTexture, NoiseTexture
-from pdf import PDF, CosinePDF, HitablePDF, MixturePDF
+from texture import ConstantTexture, CheckerTexture, NoiseTexture, MarbleTexture
+from pdf import PDF, sample_mixture
+from transform import translation, rotation_y
+import wavefront
+import pdf
+import rng
+from framebuffer import FrameBuffer, SharedFrameBuffer, Accumulator, write_heatmap
+import scheduler
+import stats
+import scenefile
+import sharedscene
+import denoise
+from lights import LightSet, find_lights
+from animation import Track, Animation
 
 #local_random = random.Random()
 #local_random.seed(14)
@@ -25,21 +40,6 @@ def de_nan(c):
         temp.z = 0
     return temp
 
-def float_to_int8(value):
-    return min(max(int(value * 255), 0), 255)
-
-def color_to_string(color):
-    red = float_to_int8(color.x)
-    green = float_to_int8(color.y)
-    blue = float_to_int8(color.z)
-    return '{} {} {}'.format(red, green, blue)
-
-def write_image(name, width, height, colors):
-    ppm_header = 'P3\n{} {}\n255\n'.format(width, height)
-    ppm_colors = '\n'.join(color_to_string(color) for color in colors)
-    with open(name, 'w') as image:
-        image.write(ppm_header + ppm_colors + '\n')
-
 def random_scene():
     hit_list = HitableList()
     checker = CheckerTexture(ConstantTexture(Vec3(0.2, 0.3, 0.1)), ConstantTexture(Vec3(0.9, 0.9, 0.9)))
@@ -76,6 +76,13 @@ def two_perlin_sphere():
     hit_list.append(Sphere(Vec3(0, 2, 0), 2, Lambertian(pertext)))
     return hit_list
 
+def two_marble_sphere():
+    marble = MarbleTexture(4)
+    hit_list = HitableList()
+    hit_list.append(Sphere(Vec3(0, -1000, 0), 1000, Lambertian(marble)))
+    hit_list.append(Sphere(Vec3(0, 2, 0), 2, Lambertian(marble)))
+    return hit_list
+
 def simple_light():
     checker = CheckerTexture(ConstantTexture(Vec3(0.2, 0.3, 0.1)), ConstantTexture(Vec3(0.9, 0.9, 0.9)))
     constant_texture = ConstantTexture(Vec3(4, 4, 4))
@@ -106,7 +113,7 @@ def cornell_box():
     #aluminum = Metal(Vec3(0.8, 0.55, 0.88), 0.0)
     aluminum = Metal(Vec3(0.7, 0.7, 0.7), 0.0)
     #hit_list.append(Sphere(Vec3(360, 90, 320), 90, white))
-    hit_list.append(Translate(RotateY((Box(Vec3(0, 0, 0), Vec3(165, 330, 165), white)), 15), Vec3(265, 0, 295)))
+    hit_list.append(Instance(Box(Vec3(0, 0, 0), Vec3(165, 330, 165), white), translation(Vec3(265, 0, 295)) @ rotation_y(15)))
     hit_list.append(Sphere(Vec3(190, 90, 190), 90, Dielectric(1.5)))
     #hit_list.append(Sphere(Vec3(180, 130, 180), 130, Dielectric(1.5)))
     return HitableList(hit_list)
@@ -124,8 +131,8 @@ def cornell_smoke():
     hit_list.append(FlipNormals(XZRect(0, 555, 0, 555, 555, white)))
     hit_list.append(XZRect(0, 555, 0, 555, 0, white))
     hit_list.append(FlipNormals(XYRect(0, 555, 0, 555, 555, white)))
-    b1 = Translate(RotateY((Box(Vec3(0, 0, 0), Vec3(165, 165, 165), white)), -18), Vec3(130, 0, 65))
-    b2 = Translate(RotateY((Box(Vec3(0, 0, 0), Vec3(165, 330, 165), white)), 15), Vec3(265, 0, 295))
+    b1 = Instance(Box(Vec3(0, 0, 0), Vec3(165, 165, 165), white), translation(Vec3(130, 0, 65)) @ rotation_y(-18))
+    b2 = Instance(Box(Vec3(0, 0, 0), Vec3(165, 330, 165), white), translation(Vec3(265, 0, 295)) @ rotation_y(15))
     hit_list.append(ConstantMedium(b1, 0.01, ConstantTexture(Vec3(1, 1, 1))))
     hit_list.append(ConstantMedium(b2, 0.01, ConstantTexture(Vec3(0, 0, 0))))
     return hit_list
@@ -176,18 +183,19 @@ def cornell_smoke():
 ##            return emitted
 ##    return Vec3(0, 0, 0)
 
-def color(ray, world, light_shape, depth):
+def color(ray, world, light_shape, depth, spread=0, width=0):
     hrec = world.hit(ray, 0.001, sys.float_info.max)
     if hrec:
+        if spread:
+            width += spread * hrec.t * ray.direction.length()
+            hrec.footprint = width
         emitted = hrec.material.emitted(ray, hrec, hrec.u, hrec.v, hrec.p)
         srec = hrec.material.scatter(ray, hrec)
         if depth < 8 and srec:
             if srec.is_specular:
-                return srec.attenuation * color(srec.specular_ray, world, light_shape, depth+1)
-            plight = HitablePDF(light_shape, hrec.p)
-            p = MixturePDF(plight, srec.pdf_ptr)
-            scattered = Ray(hrec.p, p.generate(), ray.time)
-            pdf_val = p.value(scattered.direction)
+                return srec.attenuation * color(srec.specular_ray, world, light_shape, depth+1, spread, width)
+            direction, pdf_val = sample_mixture(light_shape, hrec.p, srec.pdf_ptr)
+            scattered = Ray(hrec.p, direction, ray.time)
             if pdf_val == 0:
                 pdf_val += 0.0001
             return emitted + hrec.material.scattering_pdf(ray, hrec, scattered) * srec.attenuation * color(scattered, world, light_shape, depth+1) / pdf_val
@@ -195,26 +203,130 @@ def color(ray, world, light_shape, depth):
             return emitted
     return Vec3(0, 0, 0)
 
+# color() as a loop: the throughput of the path is carried along instead of
+# multiplied in on the way back. From segment rr_depth on a path survives
+# with a probability of its brightest throughput channel (at most 0.95) and
+# is scaled up by the inverse when it does, so the estimate stays unbiased.
+# A ray cone of angle spread follows the path until its first diffuse
+# bounce and gives the hits their footprint for texture filtering.
+# Returns the radiance and the number of segments traced.
+def trace(ray, world, light_shape, max_depth=8, rr_depth=3, spread=0):
+    radiance = Vec3(0, 0, 0)
+    throughput = Vec3(1, 1, 1)
+    depth = 0
+    width = 0
+    while True:
+        hrec = world.hit(ray, 0.001, sys.float_info.max)
+        segments = depth + 1
+        if not hrec:
+            break
+        if spread:
+            width += spread * hrec.t * ray.direction.length()
+            hrec.footprint = width
+        srec = hrec.material.scatter(ray, hrec)
+        if depth >= max_depth or not srec:
+            radiance = throughput.mul_add(hrec.material.emitted(ray, hrec, hrec.u, hrec.v, hrec.p), radiance)
+            break
+        if srec.is_specular:
+            throughput = throughput * srec.attenuation
+            ray = srec.specular_ray
+        else:
+            radiance = throughput.mul_add(hrec.material.emitted(ray, hrec, hrec.u, hrec.v, hrec.p), radiance)
+            direction, pdf_val = sample_mixture(light_shape, hrec.p, srec.pdf_ptr)
+            scattered = Ray(hrec.p, direction, ray.time)
+            if pdf_val == 0:
+                pdf_val += 0.0001
+            throughput = (hrec.material.scattering_pdf(ray, hrec, scattered) / pdf_val) * (throughput * srec.attenuation)
+            ray = scattered
+            spread = 0
+        depth += 1
+        if rr_depth is not None and depth >= rr_depth:
+            survive = min(max(throughput.x, throughput.y, throughput.z), 0.95)
+            if rng.random() >= survive:
+                break
+            throughput /= survive
+    return radiance, segments
+
 # width
 nx = 200
 # height
 ny = 200
 # samples
 ns = 20
-# cpu threads
-threads = 15
-# filename
+# samples per progressive pass, a preview and checkpoint follow each pass
+pass_samples = 4
+# adaptive sampling: every pixel first gets min_samples, or a quarter of
+# the samples per pixel when that is more, then the rest of the ns samples
+# per pixel go to the pixels in proportion to their noise, up to
+# max_samples_factor times the samples per pixel; pixels whose noise
+# estimate is under noise_threshold (display units, 0-1) stop early;
+# 0 samples evenly
+noise_threshold = 0
+min_samples = 16
+max_samples_factor = 4
+# key of the per pixel and sample random streams, see rng.py
+seed = 14
+# cpu threads, all but one
+threads = max(cpu_count() - 1, 1)
+# 'iterative' traces one path at a time with trace(), 'recursive' with
+# color(), 'wavefront' a whole tile per bounce with wavefront.trace_batch()
+integrator = 'iterative'
+# bounces before a path ends, and the segment Russian roulette starts at
+# (None for never; 'recursive' always goes the full depth)
+max_depth = 8
+rr_depth = 3
+# filename, the linear HDR image goes next to it as .pfm
 name = 'pdf4.ppm'
+hdr_name = name.rsplit('.', 1)[0] + '.pfm'
+# sample sums and counts, reopened by --resume
+checkpoint_name = name.rsplit('.', 1)[0] + '.accum.npy'
+# samples per pixel of an adaptive render
+heatmap_name = name.rsplit('.', 1)[0] + '.samples.ppm'
+# seconds spent per pixel, written with --stats
+cost_name = name.rsplit('.', 1)[0] + '.cost.ppm'
+# first hit albedo, normal and distance, written with --aovs and --denoise
+albedo_name = name.rsplit('.', 1)[0] + '.albedo.ppm'
+normal_name = name.rsplit('.', 1)[0] + '.normal.ppm'
+depth_name = name.rsplit('.', 1)[0] + '.depth.pfm'
+# the image filtered with them by --denoise, and its linear .pfm
+denoised_name = name.rsplit('.', 1)[0] + '.denoised.ppm'
+denoised_hdr_name = name.rsplit('.', 1)[0] + '.denoised.pfm'
+# camera rays per pixel of the first hit buffers
+aov_samples = 4
+
+# the output files of a render, the names above; those of frame i of an
+# animation carry its number before the extensions, pdf4.0012.ppm,
+# pdf4.0012.accum.npy and so on
+class Outputs:
+    def __init__(self, frame_index=None):
+        stem = name.rsplit('.', 1)[0]
+        def numbered(file_name):
+            if frame_index is None:
+                return file_name
+            return '{}.{:04d}{}'.format(stem, frame_index, file_name[len(stem):])
+        self.name = numbered(name)
+        self.hdr_name = numbered(hdr_name)
+        self.checkpoint_name = numbered(checkpoint_name)
+        self.heatmap_name = numbered(heatmap_name)
+        self.cost_name = numbered(cost_name)
+        self.albedo_name = numbered(albedo_name)
+        self.normal_name = numbered(normal_name)
+        self.depth_name = numbered(depth_name)
+        self.denoised_name = numbered(denoised_name)
+        self.denoised_hdr_name = numbered(denoised_hdr_name)
+
+# animation frames per second and the fraction of a frame the shutter is
+# open for
+fps = 24
+shutter = 0.5
 # total pixels
 pixels=nx*ny
-#tile size y
-tile_y = 2
-left_y = ny%tile_y
-tiles_y = int((ny-left_y)/tile_y)
-
-y_tile_list = []
-for i in range(tiles_y):
-    y_tile_list.append(ny-i*tile_y)
+# square tile size, edge tiles are clipped to the image
+tile_size = 16
+# 'cost' renders the tiles estimated most expensive first,
+# 'spiral' works outwards from the center, 'scanline' goes top to bottom
+tile_order = 'cost'
+tile_list = scheduler.make_tiles(nx, ny, tile_size)
 
 #rowsPerThread = int(ny/threads)
 #print("{} rows per thread".format(rowsPerThread))
@@ -244,52 +356,360 @@ for i in range(tiles_y):
 ##aperture = 0.0
 
 # cornell box
-world = cornell_box()
 lookfrom = Vec3(278,278,-800)
 lookat = Vec3(278,278,0)
 dist_to_focus = 10
 aperture = 0.0
 vfov = 40
 
-cam = MoBlurCamera(lookfrom, lookat, Vec3(0,1,0), vfov, nx/ny, aperture, dist_to_focus, 0, 1)
-
-h_list = []
-h_list.append(XZRect(213, 343, 227, 332, 554, 0))
-h_list.append(Sphere(Vec3(190, 90, 190), 90, 0))
-#h_list.append(Sphere(Vec3(180, 130, 180), 130, 0))
-hlist = HitableList(h_list)
-
-col = []
-    
-def render_loop(start):
-    local_col = []
-    for y in range(start, start-tile_y, -1):
-        for x in range(nx):
-            c = Vec3()
-            for s in range(ns):
-                u = (x + random.random()) / nx
-                v = (y + random.random()) / ny
-                r= cam.get_ray(u, v)
-                c += de_nan(color(r, world, hlist, 0))
-            c /= ns
-            c = Vec3(math.sqrt(c.x), math.sqrt(c.y), math.sqrt(c.z))
-            local_col.append(c)
-    return local_col
-
-#print("Hitable Objects: {}".format(len(world)))
-print("Total Tiles: {}".format(tiles_y))
+def cornell_scene(animated=False):
+    scene = cornell_box()
+    tracks = []
+    if animated:
+        # the tall box turns away from the glass sphere and slides to the
+        # back right, and is back where it started after two seconds
+        box = next(obj for obj in scene.hit_list if isinstance(obj, Instance))
+        tracks.append(Track(box, [(0, Vec3(265, 0, 295), (0, 15, 0), 1.0),
+                                  (1, Vec3(300, 0, 250), (0, -30, 0), 1.0),
+                                  (2, Vec3(265, 0, 295), (0, 15, 0), 1.0)]))
+    if integrator == 'wavefront':
+        # the array backed SphereSet/RectSet only pay off for batches of rays
+        scene = group_primitives(scene, 32)
+    world = BVHNode(scene, 0, 1)
+    cam = MoBlurCamera(lookfrom, lookat, Vec3(0,1,0), vfov, nx/ny, aperture, dist_to_focus, 0, 1)
+    # the emitters, and the glass sphere for the light it focuses
+    h_list = []
+    h_list.append(LightSet(find_lights(world)))
+    h_list.append(Sphere(Vec3(190, 90, 190), 90, 0))
+    #h_list.append(Sphere(Vec3(180, 130, 180), 130, 0))
+    if tracks:
+        world = Animation(world, tracks)
+    return world, cam, HitableList(h_list)
+
+# spawned pool workers import this file as __mp_main__ and are handed the
+# parent's scene by attach_frame instead of building it again
+world = cam = hlist = None
+if __name__ != '__mp_main__':
+    world, cam, hlist = cornell_scene()
+
+# the frame of the animation the scene is at, None for the still image
+shown_frame = None
+
+# Puts the scene at frame index: the camera's shutter opens at index / fps
+# for shutter of a frame, keyframed objects go where their tracks have them
+# then and the BVH is refit around them. Jobs carry their frame and each
+# worker moves its copy of the scene when the frame changes, the tree is
+# never built again. The sample streams do not depend on the frame, the
+# noise stays put from one frame to the next instead of crawling.
+def show_frame(index):
+    global shown_frame
+    if index == shown_frame:
+        return
+    time0 = index / fps
+    time1 = (index + shutter) / fps
+    if isinstance(cam, MoBlurCamera):
+        cam.time0, cam.time1 = time0, time1
+    if isinstance(world, Animation):
+        world.set_time(time0, time1)
+    shown_frame = index
+
+# one sample of pixel x, y where row 0 is the top of the image, and the
+# number of segments of its path (None from color()); draws from the
+# current rng stream, the jitter first. The camera ray's cone spreads by
+# the angle of a pixel.
+def sample(x, y):
+    u = (x + rng.random()) / nx
+    v = (ny - 1 - y + rng.random()) / ny
+    r= cam.get_ray(u, v)
+    spread = getattr(cam, 'theta', 0) / ny
+    if integrator == 'recursive':
+        return de_nan(color(r, world, hlist, 0, spread)), None
+    c, segments = trace(r, world, hlist, max_depth, rr_depth, spread)
+    return de_nan(c), segments
+
+# the shared framebuffer of this process, see attach_frame; rgb, the mean
+# squared luminance of the job's samples and the seconds spent per pixel
+frame = None
+frame_channels = 5
+
+# pool initializer: map the parent's framebuffer into the worker, turn on
+# the stats counters when the parent has them on and take the scene from
+# a sharedscene.publish() handle when there is one
+def attach_frame(name, width, height, collect_stats=False, scene=None):
+    global frame, world, cam, hlist
+    frame = SharedFrameBuffer(width, height, name, frame_channels)
+    if collect_stats:
+        stats.enable(sys.modules[__name__])
+    if scene is not None:
+        world, cam, hlist = sharedscene.attach(scene, width / height)
+
+# render samples samples of a scheduler.Tile as their linear mean straight
+# into frame, for the pixels set in active (all when None), with the mean
+# squared luminance and the seconds spent as fourth and fifth channels;
+# first holds the samples each pixel of the tile already has. Only the job,
+# the seconds it took, a histogram of path lengths in segments (None from
+# color()) and the stats counts (None when off) go back to the parent.
+# Sample s of pixel (x, y) draws its random numbers from the rng stream of
+# (seed, y * nx + x, s), so the image does not depend on the number of
+# workers, the tile size or order, or on a render having been resumed.
+# The wavefront integrator keys only the camera jitter that way; the
+# bounces of a tile's batches draw from one stream keyed by the tile, so
+# its images stay the same for a fixed tile size only.
+# Jobs of an animation have the frame's index as a fifth item.
+def render_loop(job):
+    tile, first, active, samples = job[:4]
+    if len(job) > 4:
+        show_frame(job[4])
+    start = perf_counter()
+    lengths = np.zeros(max_depth + 2, dtype=np.int64)
+    if integrator == 'wavefront':
+        # the bounces of a batch still share one stream, keyed by the tile
+        pdf.seed_batch_random(rng.key(seed, tile.y0 * nx + tile.x0, int(first.max())))
+        segments = np.zeros(first.shape)
+        pixels = wavefront.render_tile(cam, world, hlist, nx, ny, samples, tile.x0, tile.y0, tile.x1, tile.y1,
+                                       max_depth, mask=active, moments=True, rr_depth=rr_depth, lengths=lengths, first=first, seed=seed,
+                                       segments=segments)
+        seconds = perf_counter() - start
+        # a batch has no per pixel clock, the tile's time is charged to its
+        # pixels by the path segments (rays intersected) their samples traced
+        frame.set_tile(tile.x0, tile.y0, np.dstack((pixels, seconds * segments / max(segments.sum(), 1))))
+        return job, seconds, lengths, stats.take() if stats.enabled else None
+    pixels = frame.pixels
+    rows, cols = np.nonzero(active if active is not None else np.ones(first.shape, dtype=bool))
+    firsts = first[rows, cols]
+    ys = rows + tile.y0
+    xs = cols + tile.x0
+    index = ys * nx + xs
+    values = rng.uniforms(seed, index[:, None], firsts[:, None] + np.arange(samples))
+    for i, (y, x, pixel, f) in enumerate(zip(ys.tolist(), xs.tolist(), index.tolist(), firsts.tolist())):
+        pixel_start = perf_counter()
+        c = Vec3()
+        c2 = 0
+        for s in range(samples):
+            rng.begin(seed, pixel, f + s, values[i, s])
+            radiance, segments = sample(x, y)
+            if segments:
+                lengths[segments] += 1
+            c += radiance
+            c2 += (radiance.x * 0.2126 + radiance.y * 0.7152 + radiance.z * 0.0722) ** 2
+        c /= samples
+        pixels[y, x] = (c.x, c.y, c.z, c2 / samples, perf_counter() - pixel_start)
+    return job, perf_counter() - start, lengths if integrator != 'recursive' else None, stats.take() if stats.enabled else None
+
+# albedo, normal turned towards the ray and distance along it of the first
+# hit of a ray, zeros when it misses
+def first_hit(ray):
+    hrec = world.hit(ray, 0.001, sys.float_info.max)
+    if not hrec:
+        return (0,) * denoise.aov_channels
+    albedo = hrec.material.reflectance(hrec)
+    normal = hrec.normal.unit()
+    if normal.dot(ray.direction) > 0:
+        normal = -normal
+    return (albedo.x, albedo.y, albedo.z, normal.x, normal.y, normal.z, hrec.t * ray.direction.length())
+
+# the first hit buffers of a scheduler.Tile, averaged over the camera rays
+# of the first aov_samples samples of each pixel; job is the tile and the
+# frame of an animation, None for the still image
+def aov_loop(job):
+    tile, frame_index = job
+    if frame_index is not None:
+        show_frame(frame_index)
+    values = np.zeros((tile.y1 - tile.y0, tile.x1 - tile.x0, denoise.aov_channels))
+    ys, xs = np.mgrid[tile.y0:tile.y1, tile.x0:tile.x1]
+    index = (ys * nx + xs).ravel()
+    draws = rng.uniforms(seed, index[:, None], np.arange(aov_samples))
+    for i, (y, x, pixel) in enumerate(zip(ys.ravel().tolist(), xs.ravel().tolist(), index.tolist())):
+        total = np.zeros(denoise.aov_channels)
+        for s in range(aov_samples):
+            rng.begin(seed, pixel, s, draws[i, s])
+            u = (x + rng.random()) / nx
+            v = (ny - 1 - y + rng.random()) / ny
+            total += first_hit(cam.get_ray(u, v))
+        values[y - tile.y0, x - tile.x0] = total / aov_samples
+    return tile, values
+
+# the first hit buffers of the whole image, run as in render_passes
+def render_aovs(run, tiles, frame_index=None):
+    aovs = np.zeros((ny, nx, denoise.aov_channels))
+    for tile, values in run(aov_loop, [(tile, frame_index) for tile in tiles]):
+        aovs[tile.y0:tile.y1, tile.x0:tile.x1] = values
+    return aovs
+
+def write_aovs(aovs, outputs):
+    image = FrameBuffer(nx, ny)
+    image.pixels[:] = aovs[..., 0:3]
+    image.write_ppm(outputs.albedo_name)
+    # as the normal maps show them, gamma undone so the writer's gamma 2
+    # gives back 0.5 + 0.5 n
+    image.pixels[:] = np.square(0.5 + 0.5 * aovs[..., 3:6])
+    image.write_ppm(outputs.normal_name)
+    image.pixels[:] = aovs[..., 6:7]
+    image.write_pfm(outputs.depth_name)
+
+def write_denoised(accumulator, aovs, outputs):
+    image = FrameBuffer(nx, ny)
+    image.pixels[:] = denoise.denoise(accumulator.frame().pixels, accumulator.variance(), aovs)
+    image.write_ppm(outputs.denoised_name)
+    image.write_pfm(outputs.denoised_hdr_name)
+
+# samples per pixel proportional to deviation, clipped to [low, high],
+# that add up to budget: the split of a budget that minimizes the summed
+# variance of the pixel means
+def sample_targets(deviation, budget, low, high):
+    scale = 1.0
+    while np.clip(scale * deviation, low, high).sum() < budget and scale < 1e12:
+        scale *= 2
+    below = 0.0
+    for i in range(50):
+        middle = (below + scale) / 2
+        if np.clip(middle * deviation, low, high).sum() < budget:
+            below = middle
+        else:
+            scale = middle
+    return np.clip(scale * deviation, low, high)
+
+# pixels that still want samples, as a bool array over the image
+def active_pixels(accumulator, samples):
+    counts = accumulator.counts
+    if not noise_threshold:
+        return counts < samples
+    high = max_samples_factor * samples
+    low = min(max(min_samples, samples // 4), high)
+    if counts.min() < low:
+        return counts < low
+    deviation = accumulator.deviation()
+    targets = sample_targets(deviation, samples * counts.size, low, high)
+    return (counts < targets) & (deviation / np.sqrt(counts) >= noise_threshold)
+
+# Render passes until every pixel has its samples, or for adaptive renders
+# until the noise is low enough everywhere or the budget is spent.
+# run(render_loop, jobs) renders jobs in any order and yields the results;
+# on_pass(pass_index) is called after each pass is in the accumulator, the
+# seconds spent per pixel are added to cost when given and the jobs carry
+# frame_index when given. Returns the seconds per (pass, tile), the summed
+# path length histogram and the summed stats counts.
+def render_passes(run, accumulator, tiles, samples, on_pass=None, cost=None, frame_index=None):
+    timings = {}
+    path_lengths = np.zeros(max_depth + 2, dtype=np.int64)
+    counts = Counter()
+    budget = samples * nx * ny
+    while accumulator.counts.sum() < budget:
+        active = active_pixels(accumulator, samples)
+        # passes already in the checkpoint, tiles can differ by one
+        # when the last run stopped in the middle of a pass
+        todo = []
+        for tile in tiles:
+            mask = active[tile.y0:tile.y1, tile.x0:tile.x1]
+            count = int(mask.sum())
+            if count:
+                first = accumulator.counts[tile.y0:tile.y1, tile.x0:tile.x1].astype(np.int64)
+                done = int(first.max()) // pass_samples
+                # keep the wavefront batches of a mostly converged tile full
+                # by giving its remaining pixels more samples at once
+                scale = min(mask.size // count, 8) if integrator == 'wavefront' else 1
+                todo.append((done, tile, first, None if count == mask.size else mask, pass_samples * scale))
+        if not todo:
+            break
+        pass_index = min(job[0] for job in todo)
+        jobs = [job[1:] for job in todo if job[0] == pass_index]
+        if frame_index is not None:
+            jobs = [job + (frame_index,) for job in jobs]
+        for job, seconds, lengths, job_counts in run(render_loop, jobs):
+            tile, first, mask, n = job[:4]
+            pixels = frame.tile(tile.x0, tile.y0, tile.x1, tile.y1)
+            accumulator.add_tile(tile.x0, tile.y0, pixels[..., :4], n, mask)
+            if cost is not None:
+                cost[tile.y0:tile.y1, tile.x0:tile.x1] += pixels[..., 4] if mask is None else np.where(mask, pixels[..., 4], 0)
+            timings[(pass_index, tile.index)] = seconds
+            if lengths is not None:
+                path_lengths += lengths
+            if job_counts:
+                counts.update(job_counts)
+        accumulator.flush()
+        if on_pass:
+            on_pass(pass_index)
+    return timings, path_lengths, counts
+
+def report_path_lengths(lengths):
+    total = lengths.sum()
+    if not total:
+        return
+    print("Path segments per sample: mean {:.2f}".format((lengths * np.arange(len(lengths))).sum() / total))
+    for segments in range(1, len(lengths)):
+        share = lengths[segments] / total
+        print("{:>4} {:6.1%} {}".format(segments, share, '#' * int(round(share * 50))))
+
+def write_preview(accumulator, outputs):
+    preview = accumulator.frame()
+    preview.write_ppm(outputs.name)
+    preview.write_pfm(outputs.hdr_name)
+    if noise_threshold:
+        write_heatmap(outputs.heatmap_name, accumulator.counts)
 
 if __name__ == '__main__':
-    random.seed(14)
-    start = time()
-    with Pool(threads) as p:
-        col.extend(p.map(render_loop, y_tile_list))
-##    col.extend(map(render_loop, y_tile_list))
-    print("Time taken = {0:.5f}".format(time() - start))
-    all_col = []
-    for i in col:
-        all_col.extend(i)
-    write_image(name, nx, ny, all_col)
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--resume', action='store_true', help='continue from ' + checkpoint_name)
+    parser.add_argument('--samples', type=int, default=ns, help='total samples per pixel')
+    parser.add_argument('--adaptive', type=float, default=noise_threshold, metavar='THRESHOLD',
+                        help='stop sampling pixels once their noise is under THRESHOLD')
+    parser.add_argument('--stats', action='store_true', help='count rays, hits, scatters and pdf evaluations and write ' + cost_name)
+    parser.add_argument('--scene', help='render a JSON scene file instead of the cornell box')
+    parser.add_argument('--aovs', action='store_true', help='write the first hit albedo, normal and distance')
+    parser.add_argument('--denoise', action='store_true', help='write the image filtered with them to ' + denoised_name)
+    parser.add_argument('--frames', type=int, metavar='N', help='render N frames of the animated cornell box as numbered images')
+    parser.add_argument('--start', type=int, default=0, help='the first frame of --frames')
+    parser.add_argument('--fps', type=float, default=fps, help='frames per second of --frames')
+    args = parser.parse_args()
+    # the workers are forked after this and inherit the scene
+    if args.scene:
+        world, cam, hlist = scenefile.load(args.scene, nx/ny)
+    elif args.frames:
+        world, cam, hlist = cornell_scene(animated=True)
+    noise_threshold = args.adaptive
+    fps = args.fps
+    #print("Hitable Objects: {}".format(len(world)))
+    print("Total Tiles: {}".format(len(tile_list)))
+    frame = SharedFrameBuffer(nx, ny, channels=frame_channels)
+    shared = sharedscene.publish((world, cam, hlist), args.scene)
+    try:
+        with Pool(threads, attach_frame, (frame.name, nx, ny, args.stats, shared)) as p:
+            run = lambda render, jobs: scheduler.run(p, render, jobs)
+            # one pool for all the frames, the workers keep their scene
+            for frame_index in range(args.start, args.start + args.frames) if args.frames else [None]:
+                if frame_index is not None:
+                    show_frame(frame_index)
+                    print("Frame {}".format(frame_index))
+                outputs = Outputs(frame_index)
+                start = time()
+                cost = np.zeros((ny, nx))
+                accumulator = Accumulator(outputs.checkpoint_name, nx, ny, args.resume)
+                tiles = scheduler.order_tiles(tile_list, tile_order, nx, ny, sample)
+                def on_pass(pass_index):
+                    write_preview(accumulator, outputs)
+                    print("Pass {} done, {:.1f} samples per pixel, {:.2f}s".format(
+                        pass_index + 1, accumulator.counts.mean(), time() - start))
+                timings, path_lengths, counts = render_passes(run, accumulator, tiles, args.samples, on_pass, cost, frame_index)
+                if args.aovs or args.denoise:
+                    aovs = render_aovs(run, tiles, frame_index)
+                wall = time() - start
+                print("Time taken = {0:.5f}".format(wall))
+                if timings:
+                    scheduler.report(timings, wall, threads)
+                report_path_lengths(path_lengths)
+                if args.stats:
+                    stats.report(counts)
+                    write_heatmap(outputs.cost_name, cost)
+                write_preview(accumulator, outputs)
+                if args.aovs:
+                    write_aovs(aovs, outputs)
+                if args.denoise:
+                    write_denoised(accumulator, aovs, outputs)
+                del accumulator
+    finally:
+        sharedscene.release()
+        frame.close()
+        frame.unlink()
 
 # cProfile.run('main_loop()')
 
@@ -1,11 +1,13 @@
 from collections import namedtuple
-import random
+import rng
 import math
+import numpy as np
 from vec3 import Vec3
+from vec3batch import Vec3Batch, where
 from ray import Ray
-from texture import Texture
-from onb import ONB
-from pdf import PDF, CosinePDF, HitablePDF, MixturePDF, random_in_unit_sphere, random_cosine_direction
+from raybatch import RayBatch
+from texture import Texture, ConstantTexture
+from pdf import PDF, CosinePDF, CosinePDFBatch, random_in_unit_sphere, random_in_unit_sphere_batch, batch_random
 
 ##def random_in_unit_sphere():
 ##    while True:
@@ -24,7 +26,17 @@ from pdf import PDF, CosinePDF, HitablePDF, MixturePDF, random_in_unit_sphere, r
 ##    return Vec3(x, y, z)
 
 #ScatterRecord = namedtuple('ScatterRecord', ['attenuation', 'scattered', 'pdf'])
-ScatterRecord = namedtuple('ScatterRecord', ['specular_ray', 'is_specular', 'attenuation', 'pdf_ptr'])
+class ScatterRecord:
+    __slots__ = ('specular_ray', 'is_specular', 'attenuation', 'pdf_ptr')
+
+    def __init__(self, specular_ray, is_specular, attenuation, pdf_ptr):
+        self.specular_ray = specular_ray
+        self.is_specular = is_specular
+        self.attenuation = attenuation
+        self.pdf_ptr = pdf_ptr
+
+# batched scatter, is_specular is the same for every row of one material
+ScatterRecordBatch = namedtuple('ScatterRecordBatch', ['specular_ray', 'is_specular', 'attenuation', 'pdf_ptr'])
 
 class Material:
     def scatter(self, ray, hrec):
@@ -37,16 +49,49 @@ class Material:
     def emitted(self, ray, rec, u, v, p):
         return Vec3(0, 0, 0)
 
+    # batched versions take a RayBatch and a HitRecordBatch
+    def scatter_batch(self, ray, hrec):
+        raise NotImplementedError()
+
+    def scattering_pdf_batch(self, ray, rec, scattered):
+        raise NotImplementedError()
+
+    def emitted_batch(self, ray, rec):
+        return None
+
+    # materials with the same batch_key() are shaded in one batch by
+    # batched(), given the material of each row, which returns a material
+    # of their class with the parameters of each row; None keeps a
+    # material to itself
+    def batch_key(self):
+        return None
+
+    # the color the surface tints the light it scatters with, for the
+    # albedo buffer of the denoiser; white for glass and lights
+    def reflectance(self, rec):
+        return Vec3(1, 1, 1)
+
 class Lambertian(Material):
+    # rebuilt by every scatter(), the integrators are done with the pdf
+    # of one scatter before they scatter again, so one serves them all
+    pdf = CosinePDF(Vec3(0, 0, 1))
+
     def __init__(self, albedo):
         self.albedo = albedo
 
+    def __reduce__(self):
+        return Lambertian, (self.albedo,)
+
     def scattering_pdf(self, ray, rec, scattered):
         cosine = rec.normal.dot(scattered.direction.unit())
         if cosine < 0:
             return 0.01
         return cosine / math.pi
 
+    def scattering_pdf_batch(self, ray, rec, scattered):
+        cosine = rec.normal.dot(scattered.direction.unit())
+        return np.where(cosine < 0, 0.01, cosine / math.pi)
+
 ##    def scatter(self, ray, rec, alb, scattered, pdf):
 ##        target = rec.p + rec.normal + random_in_unit_sphere()
 ##        scattered = Ray(rec.p, (target - rec.p).unit(), ray.time)
@@ -66,10 +111,25 @@ class Lambertian(Material):
     
     def scatter(self, ray, hrec):
         is_specular = False
-        attenuation = self.albedo.value(hrec.u, hrec.v, hrec.p)
-        pdf_ptr = CosinePDF(hrec.normal)
+        attenuation = self.albedo.value(hrec.u, hrec.v, hrec.p, hrec.footprint)
+        pdf_ptr = self.pdf
+        pdf_ptr.uvw.build_from_w(hrec.normal)
         return ScatterRecord(False, is_specular, attenuation, pdf_ptr)
 
+    def scatter_batch(self, ray, hrec):
+        attenuation = self.albedo.value_batch(hrec.u, hrec.v, hrec.p)
+        return ScatterRecordBatch(None, False, attenuation, CosinePDFBatch(hrec.normal))
+
+    def batch_key(self):
+        return Lambertian if type(self.albedo) is ConstantTexture else None
+
+    @staticmethod
+    def batched(materials):
+        return Lambertian(ConstantTexture(Vec3Batch.from_vec3_list([m.albedo.color for m in materials])))
+
+    def reflectance(self, rec):
+        return self.albedo.value(rec.u, rec.v, rec.p, rec.footprint)
+
 def reflect(v, n):
     return v - 2*v.dot(n)*n
 
@@ -77,7 +137,10 @@ class Metal(Material):
     def __init__(self, albedo, fuzz=0):
         self.albedo = albedo
         self.fuzz = min(1, max(0, fuzz))
-        
+
+    def __reduce__(self):
+        return Metal, (self.albedo, self.fuzz)
+
     def scatter(self, ray, hrec):
         reflected = reflect(ray.direction.unit(), hrec.normal + self.fuzz*random_in_unit_sphere())
         specular_ray = Ray(hrec.p, reflected + self.fuzz*random_in_unit_sphere())
@@ -86,6 +149,24 @@ class Metal(Material):
         pdf_ptr = 0
         return ScatterRecord(specular_ray, is_specular, attenuation, pdf_ptr)
 
+    def scatter_batch(self, ray, hrec):
+        n = len(ray)
+        reflected = reflect(ray.direction.unit(), hrec.normal + self.fuzz*random_in_unit_sphere_batch(n))
+        specular_ray = RayBatch(hrec.p, reflected + self.fuzz*random_in_unit_sphere_batch(n))
+        return ScatterRecordBatch(specular_ray, True, Vec3Batch.full(n, self.albedo), 0)
+
+    def batch_key(self):
+        return Metal
+
+    @staticmethod
+    def batched(materials):
+        metal = Metal(Vec3Batch.from_vec3_list([m.albedo for m in materials]))
+        metal.fuzz = np.array([m.fuzz for m in materials])
+        return metal
+
+    def reflectance(self, rec):
+        return self.albedo
+
 def refract(v, n, ni_over_nt):
     uv = v.unit()
     dt = uv.dot(n)
@@ -101,9 +182,15 @@ def schlick(cosine, ref_idx):
     return r0 + (1 - r0) * pow(1 - cosine, 5)
 
 class Dielectric(Material):
+    # no absorption, shared by every scatter
+    attenuation = Vec3(1, 1, 1)
+
     def __init__(self, ref_idx):
         self.ref_idx = ref_idx
-        
+
+    def __reduce__(self):
+        return Dielectric, (self.ref_idx,)
+
 ##    def scatter(self, ray, rec):
 ##        reflected = reflect(ray.direction.unit(), rec.normal)
 ##        attenuation = Vec3(1, 1, 1)
@@ -122,7 +209,7 @@ class Dielectric(Material):
 ##        else:
 ##            reflect_prob = 1
 ##
-##        if random.random() < reflect_prob:
+##        if rng.random() < reflect_prob:
 ##            scattered = Ray(rec.p, reflected, ray.time)
 ##        else:
 ##            scattered = Ray(rec.p, refracted, ray.time)
@@ -131,7 +218,7 @@ class Dielectric(Material):
     def scatter(self, ray, rec):
         is_specular = True
         pdf_ptr = 0
-        attenuation = Vec3(1, 1, 1)
+        attenuation = self.attenuation
         reflected = reflect(ray.direction, rec.normal)
         ray_rec_dot = ray.direction.dot(rec.normal)
         if ray_rec_dot > 0:
@@ -149,31 +236,88 @@ class Dielectric(Material):
         else:
             reflect_prob = 1
 
-        if random.random() < reflect_prob:
+        if rng.random() < reflect_prob:
             specular_ray = Ray(rec.p, reflected, ray.time)
         else:
             specular_ray = Ray(rec.p, refracted, ray.time)
         return ScatterRecord(specular_ray, is_specular, attenuation, pdf_ptr)
 
+    def scatter_batch(self, ray, rec):
+        n = len(ray)
+        reflected = reflect(ray.direction, rec.normal)
+        ray_rec_dot = ray.direction.dot(rec.normal)
+        outside = ray_rec_dot <= 0
+        outward_normal = where(outside, rec.normal, -rec.normal)
+        ni_over_nt = np.where(outside, 1 / self.ref_idx, self.ref_idx)
+        cosine = np.where(outside, -ray_rec_dot, self.ref_idx * ray_rec_dot) / ray.direction.length()
+
+        uv = ray.direction.unit()
+        dt = uv.dot(outward_normal)
+        discriminant = 1 - ni_over_nt*ni_over_nt * (1-dt*dt)
+        can_refract = discriminant > 0
+        refracted = ni_over_nt*(uv - dt*outward_normal) - np.sqrt(np.where(can_refract, discriminant, 0))*outward_normal
+        r0 = (1 - self.ref_idx) / (1 + self.ref_idx)
+        r0 *= r0
+        reflect_prob = np.where(can_refract, r0 + (1 - r0) * (1 - cosine)**5, 1.0)
+
+        use_reflected = batch_random.random(n) < reflect_prob
+        specular_ray = RayBatch(rec.p, where(use_reflected, reflected, refracted), ray.time)
+        return ScatterRecordBatch(specular_ray, True, Vec3Batch(np.ones(n), np.ones(n), np.ones(n)), 0)
+
+    def batch_key(self):
+        return Dielectric, self.ref_idx
+
+    @staticmethod
+    def batched(materials):
+        return materials[0]
+
 class DiffuseLight(Material):
     def __init__(self, emit):
         self.emit = emit
 
+    def __reduce__(self):
+        return DiffuseLight, (self.emit,)
+
     def scatter(self, ray, hrec):
         return None
 
     def emitted(self, ray, rec, u, v, p):
         if rec.normal.dot(ray.direction) < 0:
-            return self.emit.value(u, v, p)
+            return self.emit.value(u, v, p, rec.footprint)
         else:
             return Vec3(0,0,0)
 
+    def scatter_batch(self, ray, hrec):
+        return None
+
+    def emitted_batch(self, ray, rec):
+        front = rec.normal.dot(ray.direction) < 0
+        return self.emit.value_batch(rec.u, rec.v, rec.p) * front
+
+    def batch_key(self):
+        return DiffuseLight if type(self.emit) is ConstantTexture else None
+
+    @staticmethod
+    def batched(materials):
+        return DiffuseLight(ConstantTexture(Vec3Batch.from_vec3_list([m.emit.color for m in materials])))
+
 class Isotropic(Material):
     def __init__(self, albedo):
         self.albedo = albedo
 
+    def __reduce__(self):
+        return Isotropic, (self.albedo,)
+
+    # uniform phase function, sampled exactly so it is treated like a specular bounce
     def scatter(self, ray, rec):
-        target = rec.p + rec.normal + random_in_unit_sphere()
         scattered = Ray(rec.p, random_in_unit_sphere(), ray.time)
-        attenuation = self.albedo.value(rec.u, rec.v, rec.p)
-        return ScatterRecord(attenuation, scattered)
+        attenuation = self.albedo.value(rec.u, rec.v, rec.p, rec.footprint)
+        return ScatterRecord(scattered, True, attenuation, 0)
+
+    def scatter_batch(self, ray, rec):
+        scattered = RayBatch(rec.p, random_in_unit_sphere_batch(len(ray)), ray.time)
+        attenuation = self.albedo.value_batch(rec.u, rec.v, rec.p)
+        return ScatterRecordBatch(scattered, True, attenuation, 0)
+
+    def reflectance(self, rec):
+        return self.albedo.value(rec.u, rec.v, rec.p, rec.footprint)
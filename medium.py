@@ -0,0 +1,226 @@
+from math import log
+import numpy as np
+import rng
+from vec3 import Vec3
+from vec3batch import Vec3Batch
+from aabb import AABB
+from hitable import Hitable, HitRecord, Box
+from material import Isotropic
+from pdf import batch_random
+
+# Heterogeneous media: a grid of densities, indexed [z, y, x], filling the
+# box from low to high, read from a .npy file or a raw float32 file of the
+# given shape and mapped rather than read. Densities are those of the
+# nearest voxel, times scale.
+#
+# A coarse grid holds the largest density of each block of block^3 voxels,
+# its majorant. Free flights are sampled by delta tracking: a 3D DDA steps
+# the ray through the blocks it crosses, and in each a tentative collision
+# is drawn against the block's majorant and kept with probability
+# density / majorant. Empty blocks are crossed in one step, thin ones in
+# few, where a single majorant for the whole grid would stop every mean
+# free path of the densest voxel. A ConstantMedium is the one block case,
+# where every tentative collision is kept.
+
+# the grid of a .npy file, or of a raw float32 file of shape (z, y, x)
+def open_grid(name, shape=None):
+    if name.endswith('.npy'):
+        grid = np.load(name, mmap_mode='r')
+    else:
+        grid = np.memmap(name, dtype=np.float32, mode='r', shape=shape)
+    if grid.ndim != 3 or grid.dtype not in (np.float32, np.float64):
+        raise ValueError('{}: need a 3D float32 or float64 grid, got {} {}'.format(name, grid.shape, grid.dtype))
+    return grid
+
+# the largest value of each block of the grid, read one slab of blocks at
+# a time
+def majorants(grid, block):
+    nz, ny, nx = grid.shape
+    ys = np.arange(0, ny, block)
+    xs = np.arange(0, nx, block)
+    slabs = []
+    for z in range(0, nz, block):
+        slab = np.asarray(grid[z:z + block]).max(axis=0)
+        slabs.append(np.maximum.reduceat(np.maximum.reduceat(slab, ys, axis=0), xs, axis=1))
+    return np.array(slabs, dtype=np.float64)
+
+class GridMedium(Hitable):
+    def __init__(self, name, low, high, texture, scale=1.0, shape=None, block=8):
+        self.name = name
+        self.box = Box(low, high)
+        self.scale = scale
+        self.block = block
+        self.material = Isotropic(texture)
+        self.grid = open_grid(name, shape)
+        self.shape = self.grid.shape
+        self.majorant = scale * majorants(self.grid, block)
+        # voxels per unit along x, y and z
+        self.voxels = tuple(n / (b - a) for n, a, b in zip(self.shape[::-1], self.box.low, self.box.high))
+        self.views = None
+
+    # the mapping and the memoryviews are made again in each process
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['grid'] = None
+        state['views'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.grid = open_grid(self.name, self.shape)
+
+    def make_views(self):
+        self.views = (memoryview(self.grid.reshape(-1)), memoryview(self.majorant.reshape(-1)))
+        return self.views
+
+    def hit(self, ray, t_min, t_max):
+        interval = self.box.interval(ray)
+        if interval is None:
+            return False
+        t = max(interval[0], t_min)
+        t_end = min(interval[1], t_max)
+        if t >= t_end:
+            return False
+        density, majorant = self.views or self.make_views()
+        scale = self.scale
+        block = self.block
+        nz, ny, nx = self.shape
+        mz, my, mx = self.majorant.shape
+        lx, ly, lz = self.box.low
+        sx, sy, sz = self.voxels
+        o = ray.origin
+        d = ray.direction
+        length = d.length()
+        # the ray in voxel units
+        ox = (o.x - lx) * sx
+        oy = (o.y - ly) * sy
+        oz = (o.z - lz) * sz
+        dx = d.x * sx
+        dy = d.y * sy
+        dz = d.z * sz
+        # the block it starts in, the t of the next block boundary on each
+        # axis and the t between boundaries
+        cx = min(max(int((ox + dx * t) // block), 0), mx - 1)
+        cy = min(max(int((oy + dy * t) // block), 0), my - 1)
+        cz = min(max(int((oz + dz * t) // block), 0), mz - 1)
+        if dx:
+            step_x = 1 if dx > 0 else -1
+            next_x = ((cx + (dx > 0)) * block - ox) / dx
+            delta_x = block / abs(dx)
+        else:
+            step_x, next_x, delta_x = 0, float('inf'), 0
+        if dy:
+            step_y = 1 if dy > 0 else -1
+            next_y = ((cy + (dy > 0)) * block - oy) / dy
+            delta_y = block / abs(dy)
+        else:
+            step_y, next_y, delta_y = 0, float('inf'), 0
+        if dz:
+            step_z = 1 if dz > 0 else -1
+            next_z = ((cz + (dz > 0)) * block - oz) / dz
+            delta_z = block / abs(dz)
+        else:
+            step_z, next_z, delta_z = 0, float('inf'), 0
+        while True:
+            exit = min(next_x, next_y, next_z, t_end)
+            mu = majorant[(cz * my + cy) * mx + cx]
+            if mu > 0:
+                while True:
+                    t -= log(1 - rng.random()) / (mu * length)
+                    if t >= exit:
+                        break
+                    x = min(max(int(ox + dx * t), 0), nx - 1)
+                    y = min(max(int(oy + dy * t), 0), ny - 1)
+                    z = min(max(int(oz + dz * t), 0), nz - 1)
+                    if rng.random() * mu < scale * density[(z * ny + y) * nx + x]:
+                        return HitRecord(t, 0, 0, ray.point_at_parameter(t), Vec3(1, 0, 0), self.material)
+            if exit >= t_end:
+                return False
+            t = exit
+            if next_x <= next_y and next_x <= next_z:
+                cx += step_x
+                next_x += delta_x
+                if not 0 <= cx < mx:
+                    return False
+            elif next_y <= next_z:
+                cy += step_y
+                next_y += delta_y
+                if not 0 <= cy < my:
+                    return False
+            else:
+                cz += step_z
+                next_z += delta_z
+                if not 0 <= cz < mz:
+                    return False
+
+    # every ray takes one step a round: a tentative collision in its block
+    # or the move to the next block, until it scatters or leaves
+    def hit_batch(self, rays, t_min, rec):
+        hit = np.zeros(len(rays), dtype=bool)
+        t0, t1 = self.box.interval_batch(rays)
+        t = np.maximum(t0, t_min)
+        t_end = np.minimum(t1, rec.t)
+        rows = np.flatnonzero(t < t_end)
+        if not len(rows):
+            return hit
+        t = t[rows]
+        t_end = t_end[rows]
+        low = np.array(self.box.low)
+        voxels = np.array(self.voxels)
+        o = (rays.origin[rows].to_array() - low) * voxels
+        d = rays.direction[rows].to_array() * voxels
+        length = rays.direction[rows].length()
+        block = self.block
+        # x, y, z order, as the rays
+        blocks = np.array(self.majorant.shape[::-1])
+        cells = np.array(self.shape[::-1])
+        cell = np.clip(np.floor((o + d * t[:, None]) / block).astype(np.intp), 0, blocks - 1)
+        step = np.sign(d).astype(np.intp)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            next_t = np.where(d != 0, ((cell + (d > 0)) * block - o) / d, np.inf)
+            delta = np.where(d != 0, block / np.abs(d), 0)
+        hit_rows = []
+        hit_t = []
+        while len(rows):
+            exit = np.minimum(next_t.min(axis=1), t_end)
+            mu = self.majorant[cell[:, 2], cell[:, 1], cell[:, 0]]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                tentative = t - np.log(1 - batch_random.random(len(rows))) / (mu * length)
+            collide = tentative < exit
+            kept = np.zeros(len(rows), dtype=bool)
+            tried = np.flatnonzero(collide)
+            if len(tried):
+                x, y, z = np.clip((o[tried] + d[tried] * tentative[tried, None]).astype(np.intp), 0, cells - 1).T
+                density = self.scale * self.grid[z, y, x]
+                kept[tried] = batch_random.random(len(tried)) * mu[tried] < density
+                hit_rows.append(rows[kept])
+                hit_t.append(tentative[kept])
+            t = np.where(collide, tentative, exit)
+            moving = np.flatnonzero(~collide & (exit < t_end))
+            axis = next_t[moving].argmin(axis=1)
+            cell[moving, axis] += step[moving, axis]
+            next_t[moving, axis] += delta[moving, axis]
+            inside = ((cell >= 0) & (cell < blocks)).all(axis=1)
+            moved = np.zeros(len(rows), dtype=bool)
+            moved[moving] = True
+            keep = (collide & ~kept) | (moved & inside)
+            rows = rows[keep]
+            t = t[keep]
+            t_end = t_end[keep]
+            o = o[keep]
+            d = d[keep]
+            length = length[keep]
+            cell = cell[keep]
+            step = step[keep]
+            next_t = next_t[keep]
+            delta = delta[keep]
+        if hit_rows:
+            rows = np.concatenate(hit_rows)
+            t = np.concatenate(hit_t)
+            hit[rows] = True
+            if len(rows):
+                rec.set(rows, t, 0, 0, rays[rows].point_at_parameter(t), Vec3Batch.full(len(rows), Vec3(1, 0, 0)), self.material)
+        return hit
+
+    def bounding_box(self, t0, t1):
+        return AABB(self.box.p0, self.box.p1)
@@ -0,0 +1,320 @@
+import numpy as np
+from vec3 import Vec3
+from vec3batch import Vec3Batch
+from aabb import AABB
+from hitable import Hitable, HitRecord
+import lbvh
+
+# Triangle meshes in flat arrays: float32 vertices, int32 triangles of
+# vertex indices, and optionally normals and uvs, either per vertex or,
+# as OBJ files have them, through triangles of their own indices. The
+# triangles are sorted into the leaf order of the mesh's own linear BVH
+# (lbvh.py), so a leaf is a range of rows. The scalar code reads all of it
+# through memoryviews, which give Python floats instead of NumPy scalars,
+# and tests rays with Moller-Trumbore.
+
+class TriangleMesh(Hitable):
+    def __init__(self, vertices, triangles, material=None, normals=None, normal_triangles=None,
+                 uvs=None, uv_triangles=None, leaf_size=4):
+        self.vertices = np.ascontiguousarray(vertices, dtype=np.float32).reshape(-1, 3)
+        triangles = np.asarray(triangles, dtype=np.int32).reshape(-1, 3)
+        corners = self.vertices[triangles]
+        nodes, order = lbvh.build(corners.min(axis=1), corners.max(axis=1), leaf_size)
+        self.triangles = np.ascontiguousarray(triangles[order])
+        self.material = material
+        self.normals = None
+        self.normal_triangles = None
+        if normals is not None:
+            self.normals = np.ascontiguousarray(normals, dtype=np.float32).reshape(-1, 3)
+            normal_triangles = triangles if normal_triangles is None else np.asarray(normal_triangles, dtype=np.int32)
+            self.normal_triangles = np.ascontiguousarray(normal_triangles.reshape(-1, 3)[order])
+        self.uvs = None
+        self.uv_triangles = None
+        if uvs is not None:
+            self.uvs = np.ascontiguousarray(uvs, dtype=np.float32).reshape(-1, 2)
+            uv_triangles = triangles if uv_triangles is None else np.asarray(uv_triangles, dtype=np.int32)
+            self.uv_triangles = np.ascontiguousarray(uv_triangles.reshape(-1, 3)[order])
+        self.bounds = np.ascontiguousarray(np.concatenate((nodes['low'], nodes['high']), axis=1))
+        self.next = np.ascontiguousarray(nodes['next'])
+        self.count = np.ascontiguousarray(nodes['count'])
+        self.axis = np.ascontiguousarray(nodes['axis'])
+        self.views = None
+
+    def __len__(self):
+        return len(self.triangles)
+
+    # memoryviews are made on first use in each process and not pickled
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['views'] = None
+        return state
+
+    def make_views(self):
+        arrays = (self.bounds, self.next, self.count, self.axis, self.vertices, self.triangles,
+                  self.normals, self.normal_triangles, self.uvs, self.uv_triangles)
+        self.views = tuple(None if a is None else memoryview(a.reshape(-1)) for a in arrays)
+        return self.views
+
+    def hit(self, ray, t_min, t_max):
+        views = self.views or self.make_views()
+        bounds, following, count, axes, vertices, triangles = views[:6]
+        o = ray.origin
+        d = ray.direction
+        ox, oy, oz = o.x, o.y, o.z
+        dx, dy, dz = d.x, d.y, d.z
+        # a huge inverse stands in for the infinite one of a zero component
+        ix = 1 / dx if dx else 1e300
+        iy = 1 / dy if dy else 1e300
+        iz = 1 / dz if dz else 1e300
+        backwards = (dx < 0, dy < 0, dz < 0)
+        best = -1
+        stack = [0]
+        while stack:
+            i = stack.pop()
+            b = 6 * i
+            t0 = (bounds[b] - ox) * ix
+            t1 = (bounds[b + 3] - ox) * ix
+            if t0 > t1:
+                t0, t1 = t1, t0
+            near = t0 if t0 > t_min else t_min
+            far = t1 if t1 < t_max else t_max
+            t0 = (bounds[b + 1] - oy) * iy
+            t1 = (bounds[b + 4] - oy) * iy
+            if t0 > t1:
+                t0, t1 = t1, t0
+            if t0 > near:
+                near = t0
+            if t1 < far:
+                far = t1
+            t0 = (bounds[b + 2] - oz) * iz
+            t1 = (bounds[b + 5] - oz) * iz
+            if t0 > t1:
+                t0, t1 = t1, t0
+            if t0 > near:
+                near = t0
+            if t1 < far:
+                far = t1
+            if near > far:
+                continue
+            n = count[i]
+            if not n:
+                if backwards[axes[i]]:
+                    stack.append(i + 1)
+                    stack.append(following[i])
+                else:
+                    stack.append(following[i])
+                    stack.append(i + 1)
+                continue
+            first = following[i]
+            for triangle in range(first, first + n):
+                a = 3 * triangles[3 * triangle]
+                b = 3 * triangles[3 * triangle + 1]
+                c = 3 * triangles[3 * triangle + 2]
+                ax, ay, az = vertices[a], vertices[a + 1], vertices[a + 2]
+                e1x, e1y, e1z = vertices[b] - ax, vertices[b + 1] - ay, vertices[b + 2] - az
+                e2x, e2y, e2z = vertices[c] - ax, vertices[c + 1] - ay, vertices[c + 2] - az
+                px = dy * e2z - dz * e2y
+                py = dz * e2x - dx * e2z
+                pz = dx * e2y - dy * e2x
+                det = e1x * px + e1y * py + e1z * pz
+                if -1e-12 < det < 1e-12:
+                    continue
+                inverse = 1 / det
+                sx, sy, sz = ox - ax, oy - ay, oz - az
+                u = (sx * px + sy * py + sz * pz) * inverse
+                if u < 0 or u > 1:
+                    continue
+                qx = sy * e1z - sz * e1y
+                qy = sz * e1x - sx * e1z
+                qz = sx * e1y - sy * e1x
+                v = (dx * qx + dy * qy + dz * qz) * inverse
+                if v < 0 or u + v > 1:
+                    continue
+                t = (e2x * qx + e2y * qy + e2z * qz) * inverse
+                if t_min < t < t_max:
+                    t_max = t
+                    best = triangle
+                    best_u = u
+                    best_v = v
+        if best < 0:
+            return False
+        u = best_u
+        v = best_v
+        w = 1 - u - v
+        normals, normal_triangles, uvs, uv_triangles = views[6:]
+        if normals is None:
+            a = 3 * triangles[3 * best]
+            b = 3 * triangles[3 * best + 1]
+            c = 3 * triangles[3 * best + 2]
+            normal = Vec3(vertices[b] - vertices[a], vertices[b + 1] - vertices[a + 1], vertices[b + 2] - vertices[a + 2]).cross(
+                     Vec3(vertices[c] - vertices[a], vertices[c + 1] - vertices[a + 1], vertices[c + 2] - vertices[a + 2]))
+        else:
+            a = 3 * normal_triangles[3 * best]
+            b = 3 * normal_triangles[3 * best + 1]
+            c = 3 * normal_triangles[3 * best + 2]
+            normal = Vec3(w * normals[a] + u * normals[b] + v * normals[c],
+                          w * normals[a + 1] + u * normals[b + 1] + v * normals[c + 1],
+                          w * normals[a + 2] + u * normals[b + 2] + v * normals[c + 2])
+        if uvs is not None:
+            a = 2 * uv_triangles[3 * best]
+            b = 2 * uv_triangles[3 * best + 1]
+            c = 2 * uv_triangles[3 * best + 2]
+            u, v = w * uvs[a] + u * uvs[b] + v * uvs[c], w * uvs[a + 1] + u * uvs[b + 1] + v * uvs[c + 1]
+        return HitRecord(t_max, u, v, ray.point_at_parameter(t_max), normal.unit(), self.material)
+
+    # unit normals at barycentric u, v of triangles, (n, 3): interpolated
+    # when the mesh has normals, the face normal otherwise
+    def shading_normals(self, triangles, u, v):
+        if self.normals is not None:
+            corners = self.normals[self.normal_triangles[triangles]].astype(np.float64)
+            normal = (1 - u - v)[:, None] * corners[:, 0] + u[:, None] * corners[:, 1] + v[:, None] * corners[:, 2]
+        else:
+            corners = self.vertices[self.triangles[triangles]].astype(np.float64)
+            normal = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+        return normal / np.linalg.norm(normal, axis=1)[:, None]
+
+    def texture_uvs(self, triangles, u, v):
+        if self.uvs is None:
+            return u, v
+        corners = self.uvs[self.uv_triangles[triangles]].astype(np.float64)
+        uv = (1 - u - v)[:, None] * corners[:, 0] + u[:, None] * corners[:, 1] + v[:, None] * corners[:, 2]
+        return uv[:, 0], uv[:, 1]
+
+    # all rays go down the tree together as (ray, node) pairs, one level a
+    # step: pairs whose box the ray misses are dropped, inner nodes become
+    # pairs with both children and leaves pairs with their triangles, which
+    # are tested at once
+    def hit_batch(self, rays, t_min, rec):
+        hit = np.zeros(len(rays), dtype=bool)
+        o = rays.origin.to_array()
+        d = rays.direction.to_array()
+        with np.errstate(divide='ignore'):
+            inverse = np.where(d != 0, 1 / d, 1e300)
+        t_mins = np.broadcast_to(np.asarray(t_min, dtype=np.float64), (len(rays),))
+        best = np.full(len(rays), -1)
+        best_u = np.zeros(len(rays))
+        best_v = np.zeros(len(rays))
+        t_max = rec.t.copy()
+        rows = np.arange(len(rays))
+        nodes = np.zeros(len(rays), dtype=np.intp)
+        with np.errstate(over='ignore', invalid='ignore', divide='ignore'):
+            while len(rows):
+                bounds = self.bounds[nodes]
+                t0 = (bounds[:, :3] - o[rows]) * inverse[rows]
+                t1 = (bounds[:, 3:] - o[rows]) * inverse[rows]
+                near = np.maximum(np.minimum(t0, t1).max(axis=1), t_mins[rows])
+                far = np.minimum(np.maximum(t0, t1).min(axis=1), t_max[rows])
+                inside = near <= far
+                rows = rows[inside]
+                nodes = nodes[inside]
+                counts = self.count[nodes]
+                leaf = counts > 0
+                if leaf.any():
+                    # one pair per triangle of each leaf
+                    leaf_rows = np.repeat(rows[leaf], counts[leaf])
+                    starts = np.repeat(self.next[nodes[leaf]], counts[leaf])
+                    offsets = np.arange(len(starts)) - np.repeat(np.cumsum(counts[leaf]) - counts[leaf], counts[leaf])
+                    triangles = starts + offsets
+                    corners = self.vertices[self.triangles[triangles]].astype(np.float64)
+                    e1 = corners[:, 1] - corners[:, 0]
+                    e2 = corners[:, 2] - corners[:, 0]
+                    direction = d[leaf_rows]
+                    p = np.cross(direction, e2)
+                    det = (p * e1).sum(axis=1)
+                    inv_det = 1 / det
+                    s = o[leaf_rows] - corners[:, 0]
+                    u = (s * p).sum(axis=1) * inv_det
+                    q = np.cross(s, e1)
+                    v = (direction * q).sum(axis=1) * inv_det
+                    t = (q * e2).sum(axis=1) * inv_det
+                    closer = ((np.abs(det) > 1e-12) & (u >= 0) & (v >= 0) & (u + v <= 1)
+                              & (t > t_mins[leaf_rows]) & (t < t_max[leaf_rows]))
+                    leaf_rows = leaf_rows[closer]
+                    t = t[closer]
+                    np.minimum.at(t_max, leaf_rows, t)
+                    nearest = t == t_max[leaf_rows]
+                    chosen = leaf_rows[nearest]
+                    best[chosen] = triangles[closer][nearest]
+                    best_u[chosen] = u[closer][nearest]
+                    best_v[chosen] = v[closer][nearest]
+                inner = ~leaf
+                rows = np.repeat(rows[inner], 2)
+                nodes = np.stack((nodes[inner] + 1, self.next[nodes[inner]]), axis=1).reshape(-1)
+        rows = np.flatnonzero(best >= 0)
+        if len(rows):
+            triangles = best[rows]
+            normal = Vec3Batch.from_array(self.shading_normals(triangles, best_u[rows], best_v[rows]))
+            u, v = self.texture_uvs(triangles, best_u[rows], best_v[rows])
+            t = t_max[rows]
+            rec.set(rows, t, u, v, rays[rows].point_at_parameter(t), normal, self.material)
+            hit[rows] = True
+        return hit
+
+    def bounding_box(self, t0, t1):
+        return AABB(Vec3(*self.bounds[0, :3].tolist()), Vec3(*self.bounds[0, 3:].tolist()))
+
+# The vertices, normals, uvs and faces of an OBJ file, read chunk_bytes of
+# lines at a time so that only one chunk is ever held as text. Faces with
+# more than three corners become fans of triangles. Returns a TriangleMesh.
+def load_obj(name, material=None, chunk_bytes=1 << 22, leaf_size=4):
+    parts = {'v': [], 'vn': [], 'vt': [], 'f': []}
+    counts = {'v': 0, 'vn': 0, 'vt': 0}
+    with open(name) as f:
+        while True:
+            lines = f.readlines(chunk_bytes)
+            if not lines:
+                break
+            chunk = {'v': [], 'vn': [], 'vt': [], 'f': []}
+            for line in lines:
+                kind, _, rest = line.partition(' ')
+                if kind in chunk:
+                    chunk[kind].append(rest)
+            for kind, width in (('v', 3), ('vn', 3), ('vt', 2)):
+                if chunk[kind]:
+                    values = read_values(chunk[kind], width)
+                    parts[kind].append(values)
+                    counts[kind] += len(values)
+            if chunk['f']:
+                parts['f'].append(read_faces(chunk['f'], counts))
+    vertices = np.concatenate(parts['v']) if parts['v'] else np.zeros((0, 3), dtype=np.float32)
+    faces = np.concatenate(parts['f']) if parts['f'] else np.zeros((0, 3, 3), dtype=np.int32)
+    normals = uvs = normal_triangles = uv_triangles = None
+    if parts['vn'] and (faces[:, :, 2] >= 0).all():
+        normals = np.concatenate(parts['vn'])
+        normal_triangles = faces[:, :, 2]
+    if parts['vt'] and (faces[:, :, 1] >= 0).all():
+        uvs = np.concatenate(parts['vt'])
+        uv_triangles = faces[:, :, 1]
+    return TriangleMesh(vertices, faces[:, :, 0], material, normals, normal_triangles, uvs, uv_triangles, leaf_size)
+
+# the first width numbers of each line as float32, (n, width)
+def read_values(lines, width):
+    text = ' '.join(lines)
+    tokens = text.split()
+    if len(tokens) == width * len(lines):
+        return np.array(tokens, dtype=np.float32).reshape(-1, width)
+    return np.array([line.split()[:width] for line in lines], dtype=np.float32)
+
+# triangles of (vertex, uv, normal) indices, counted from 0 with -1 where
+# a corner has none; counts are the vertices, uvs and normals read so far,
+# which negative indices are relative to
+def read_faces(lines, counts):
+    corners = [line.split() for line in lines]
+    sizes = np.array([len(c) for c in corners])
+    tokens = [token for c in corners for token in c]
+    text = ' '.join(tokens)
+    slashes = tokens[0].count('/')
+    if text.count('/') == slashes * len(tokens) and text.count('//') == tokens[0].count('//') * len(tokens):
+        fields = np.array(text.replace('//', '/0/').replace('/', ' ').split(), dtype=np.int64).reshape(len(tokens), -1)
+    else:
+        fields = np.array([[int(x) if x else 0 for x in (token.split('/') + ['', ''])[:3]] for token in tokens], dtype=np.int64)
+    indices = np.full((len(tokens), 3), -1, dtype=np.int64)
+    for column, kind in enumerate(('v', 'vt', 'vn')[:fields.shape[1]]):
+        values = fields[:, column]
+        indices[:, column] = np.where(values > 0, values - 1, np.where(values < 0, counts[kind] + values, -1))
+    # fans: corner 0 with corners j and j + 1 of each face
+    starts = np.cumsum(sizes) - sizes
+    per_face = sizes - 2
+    face_start = np.repeat(starts, per_face)
+    j = np.arange(per_face.sum()) - np.repeat(np.cumsum(per_face) - per_face, per_face) + 1
+    return np.stack((indices[face_start], indices[face_start + j], indices[face_start + j + 1]), axis=1).astype(np.int32)
@@ -0,0 +1,202 @@
+import os
+import mmap
+import math
+import numpy as np
+from collections import OrderedDict
+from framebuffer import read_ppm, read_pfm
+
+# Mipmapped images in tiles, cached on disk next to the source image as
+# <name>.mip.npy: every level, each halved from the one before by a box
+# filter, cut into tile_size squares with one more row and column taken
+# from the next tile (wrapping at the edges), so a bilinear lookup never
+# needs a second tile. Levels follow each other, tiles row by row, as
+# float16 rgb.
+#
+# The cache is mapped, not read, and tiles are copied out of the mapping
+# into one LRU cache per process shared by every MipMap, so memory stays
+# at cache_tiles tiles however many and however large the images are.
+# The pages of a copied tile are unmapped again right away.
+
+tile_size = 64
+cache_tiles = 512
+# bytes the kernel may map around a page fault
+window = 1 << 16
+
+# (cache name, tile) -> float16 (tile_size + 1, tile_size + 1, 3)
+tiles = OrderedDict()
+tile_loads = 0
+
+# width and height of each level down to 1 x 1
+def level_sizes(width, height):
+    sizes = [(width, height)]
+    while width > 1 or height > 1:
+        width = max(1, (width + 1) // 2)
+        height = max(1, (height + 1) // 2)
+        sizes.append((width, height))
+    return sizes
+
+# per level: width, height, tiles across and the index of its first tile
+def layout(width, height):
+    levels = []
+    first = 0
+    for w, h in level_sizes(width, height):
+        across = -(-w // tile_size)
+        levels.append((w, h, across, first))
+        first += across * -(-h // tile_size)
+    return levels, first
+
+# linear float32 rgb of a PPM (display values, gamma 2 like the writer) or
+# PFM, mapped rather than read
+def open_image(name):
+    if name.lower().endswith('.pfm'):
+        data = read_pfm(name, mmap=True)
+        return data, lambda rows: np.broadcast_to(rows, rows.shape[:2] + (3,)).astype(np.float32)
+    data, maxval = read_ppm(name, mmap=True)
+    return data, lambda rows: np.square(rows / np.float32(maxval), dtype=np.float32)
+
+# one band of tile_size + 1 rows of a level into its row of tiles
+def write_band(cache, level, row, band):
+    w, h, across, first = level
+    columns = (np.arange(across)[:, None] * tile_size + np.arange(tile_size + 1)) % w
+    start = first + row * across
+    cache[start:start + across] = band[:, columns].transpose(1, 0, 2, 3)
+
+# rows ys of a level that is already in the cache, (len(ys), width, 3)
+def level_rows(cache, level, ys):
+    w, h, across, first = level
+    index = first + (ys // tile_size)[:, None] * across + np.arange(across)
+    rows = cache[index, (ys % tile_size)[:, None], :tile_size]
+    return rows.reshape(len(ys), across * tile_size, 3)[:, :w].astype(np.float32)
+
+def build(source, name):
+    image, linear = open_image(source)
+    height, width = image.shape[:2]
+    levels, count = layout(width, height)
+    cache = np.lib.format.open_memmap(name + '.part', mode='w+', dtype=np.float16,
+                                      shape=(count, tile_size + 1, tile_size + 1, 3))
+    band_rows = np.arange(tile_size + 1)
+    for level_index, level in enumerate(levels):
+        w, h, across, first = level
+        for row in range(-(-h // tile_size)):
+            ys = (row * tile_size + band_rows) % h
+            if level_index == 0:
+                band = linear(image[ys])
+            else:
+                previous = levels[level_index - 1]
+                pw, ph = previous[:2]
+                above = level_rows(cache, previous, (2 * ys) % ph)
+                below = level_rows(cache, previous, (2 * ys + 1) % ph)
+                pairs = above + below
+                xs = np.arange(w)
+                band = (pairs[:, (2 * xs) % pw] + pairs[:, (2 * xs + 1) % pw]) / 4
+            write_band(cache, level, row, band)
+    cache.flush()
+    del cache
+    os.replace(name + '.part', name)
+
+def cache_name(source):
+    return os.path.splitext(source)[0] + '.mip.npy'
+
+class MipMap:
+    def __init__(self, source):
+        self.source = source
+        self.name = cache_name(source)
+        self.height, self.width = open_image(source)[0].shape[:2]
+        self.levels, self.count = layout(self.width, self.height)
+        if not os.path.exists(self.name) or os.path.getmtime(self.name) < os.path.getmtime(source):
+            build(source, self.name)
+        self.tile_bytes = (tile_size + 1) ** 2 * 3 * 2
+        self.map = None
+
+    # the mapping is made on first use in each process and not pickled
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['map'] = None
+        return state
+
+    def open(self):
+        with open(self.name, 'rb') as f:
+            np.lib.format.read_magic(f)
+            shape, fortran, dtype = np.lib.format.read_array_header_1_0(f)
+            self.data_start = f.tell()
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.map.madvise(mmap.MADV_RANDOM)
+        if shape != (self.count, tile_size + 1, tile_size + 1, 3):
+            raise ValueError('{} does not match {}'.format(self.name, self.source))
+
+    def tile(self, index):
+        global tile_loads
+        key = (self.name, index)
+        tile = tiles.get(key)
+        if tile is not None:
+            tiles.move_to_end(key)
+            return tile
+        if self.map is None:
+            self.open()
+        start = self.data_start + index * self.tile_bytes
+        tile = np.frombuffer(self.map, dtype=np.float16, count=(tile_size + 1) ** 2 * 3, offset=start)
+        tile = tile.reshape(tile_size + 1, tile_size + 1, 3).copy()
+        # the kernel maps pages around a fault too, drop the whole window
+        first = start - start % window
+        self.map.madvise(mmap.MADV_DONTNEED, first, min(start + self.tile_bytes + window, len(self.map)) - first)
+        tile_loads += 1
+        tiles[key] = tile
+        if len(tiles) > cache_tiles:
+            tiles.popitem(last=False)
+        return tile
+
+    # bilinear rgb at texel coordinates x, y of a level (texel centers at
+    # .5), wrapping around the edges
+    def bilinear(self, level, x, y):
+        w, h, across, first = self.levels[level]
+        x -= 0.5
+        y -= 0.5
+        x0 = int(x // 1)
+        y0 = int(y // 1)
+        fx = x - x0
+        fy = y - y0
+        x0 %= w
+        y0 %= h
+        tile = self.tile(first + y0 // tile_size * across + x0 // tile_size)
+        tx = x0 % tile_size
+        ty = y0 % tile_size
+        (a, b), (c, d) = tile[ty:ty + 2, tx:tx + 2].tolist()
+        gx = 1 - fx
+        gy = 1 - fy
+        return [gy * (gx * a[i] + fx * b[i]) + fy * (gx * c[i] + fx * d[i]) for i in range(3)]
+
+    # rgb at u, v (v = 0 at the bottom of the image) for a footprint of
+    # width texels of level 0, blended between the two nearest levels
+    def lookup(self, u, v, width=0):
+        if width <= 1:
+            return self.bilinear(0, u * self.width, (1 - v) * self.height)
+        level = min(math.log2(width), len(self.levels) - 1)
+        lower = int(level)
+        t = level - lower
+        w, h = self.levels[lower][:2]
+        a = self.bilinear(lower, u * w, (1 - v) * h)
+        if t == 0:
+            return a
+        w, h = self.levels[lower + 1][:2]
+        b = self.bilinear(lower + 1, u * w, (1 - v) * h)
+        return [(1 - t) * a[i] + t * b[i] for i in range(3)]
+
+    # finest level lookup of arrays u, v: the tiles they need are fetched
+    # once each and gathered from a stack, (n, 3)
+    def lookup_batch(self, u, v):
+        w, h, across, first = self.levels[0]
+        x = u * w - 0.5
+        y = (1 - v) * h - 0.5
+        x0 = np.floor(x)
+        y0 = np.floor(y)
+        fx = (x - x0)[:, None]
+        fy = (y - y0)[:, None]
+        x0 = x0.astype(np.int64) % w
+        y0 = y0.astype(np.int64) % h
+        needed, which = np.unique(first + y0 // tile_size * across + x0 // tile_size, return_inverse=True)
+        stack = np.stack([self.tile(int(i)) for i in needed]).astype(np.float32)
+        tx = x0 % tile_size
+        ty = y0 % tile_size
+        top = (1 - fx) * stack[which, ty, tx] + fx * stack[which, ty, tx + 1]
+        bottom = (1 - fx) * stack[which, ty + 1, tx] + fx * stack[which, ty + 1, tx + 1]
+        return (1 - fy) * top + fy * bottom
@@ -1,7 +1,11 @@
+import numpy as np
 from vec3 import Vec3
-from math import fabs
+from vec3batch import Vec3Batch
+from math import fabs, sqrt
 
-# Ortho-normal Bases - three mutually orthogonal unit vectors
+# Ortho-normal Bases - three mutually orthogonal unit vectors. The sums and
+# cross products are written out per component, so local() and
+# build_from_w() make only the vectors they keep.
 class ONB:
     def __init__(self):
         self.u = Vec3()
@@ -9,18 +13,38 @@ class ONB:
         self.w = Vec3()
         
     def local(self, a, b=0, c=0):
-        if isinstance(a, float):
-            return a * self.u + b * self.v + c * self.w
-        elif isinstance(a, Vec3):
-            return a.x * self.u + a.y * self.v + a.z * self.w
-        else:
+        if isinstance(a, Vec3):
+            a, b, c = a.x, a.y, a.z
+        elif not isinstance(a, float):
             raise ValueError('parameter is not a float or Vec3')
+        u = self.u
+        v = self.v
+        w = self.w
+        return Vec3(a * u.x + b * v.x + c * w.x, a * u.y + b * v.y + c * w.y, a * u.z + b * v.z + c * w.z)
 
     def build_from_w(self, n):
-        self.w = n.unit()
-        if fabs(self.w.x) > 0.9:
-            a = Vec3(0, 1, 0)
+        w = self.w = n.unit()
+        # w x (0, 1, 0) or w x (1, 0, 0), normalized
+        if fabs(w.x) > 0.9:
+            x, y, z = -w.z, 0.0, w.x
         else:
-            a = Vec3(1, 0, 0)
+            x, y, z = 0.0, w.z, -w.y
+        l = sqrt(x * x + y * y + z * z)
+        v = self.v = Vec3(x / l, y / l, z / l)
+        self.u = Vec3(w.y * v.z - w.z * v.y, w.z * v.x - w.x * v.z, w.x * v.y - w.y * v.x)
+
+# reused by callers that only need a basis for one local() call
+scratch = ONB()
+
+# Same construction as ONB for a Vec3Batch of normals, the branch on w.x
+# becomes a per-row select
+class ONBBatch(ONB):
+    def local(self, a):
+        return a.x * self.u + a.y * self.v + a.z * self.w
+
+    def build_from_w(self, n):
+        self.w = n.unit()
+        big_x = np.abs(self.w.x) > 0.9
+        a = Vec3Batch(np.where(big_x, 0.0, 1.0), np.where(big_x, 1.0, 0.0), np.zeros(len(n)))
         self.v = self.w.cross(a).unit()
         self.u = self.w.cross(self.v)
@@ -1,12 +1,19 @@
-from onb import ONB
+from onb import ONB, ONBBatch
 from vec3 import Vec3
-import math, random
+from vec3batch import Vec3Batch, where
+import math
+import rng
+import numpy as np
 
-local_random = random.Random(14)
+batch_random = np.random.default_rng(14)
+
+# reseed in place, other modules hold a reference to batch_random
+def seed_batch_random(seed):
+    batch_random.bit_generator.state = np.random.default_rng(seed).bit_generator.state
 
 def random_cosine_direction():
-    r1 = local_random.random()
-    r2 = local_random.random()
+    r1 = rng.random()
+    r2 = rng.random()
     z = math.sqrt(1 - r2)
     phi = 2 * math.pi * r1
     x = math.cos(phi) * 2 * math.sqrt(r2)
@@ -14,8 +21,8 @@ def random_cosine_direction():
     return Vec3(x, y, z)
 
 def random_to_sphere(radius, distance_squared):
-    r1 = local_random.random()
-    r2 = local_random.random()
+    r1 = rng.random()
+    r2 = rng.random()
     radius_dist = 1 - radius * radius / distance_squared
     z = 1 + r2 * (math.sqrt(radius_dist) - 1)
     phi = 2 * math.pi * r1
@@ -26,10 +33,42 @@ def random_to_sphere(radius, distance_squared):
 
 def random_in_unit_sphere():
     while True:
-        p = 2 * Vec3(local_random.random(), local_random.random(), local_random.random()) - Vec3(1, 1, 1)
+        p = 2 * Vec3(rng.random(), rng.random(), rng.random()) - Vec3(1, 1, 1)
         if p.dot(p) < 1:
             return p.unit()
 
+def random_cosine_direction_batch(n):
+    r1 = batch_random.random(n)
+    r2 = batch_random.random(n)
+    z = np.sqrt(1 - r2)
+    phi = 2 * math.pi * r1
+    x = np.cos(phi) * 2 * np.sqrt(r2)
+    y = np.sin(phi) * 2 * np.sqrt(r2)
+    return Vec3Batch(x, y, z)
+
+def random_to_sphere_batch(radius, distance_squared):
+    n = len(distance_squared)
+    r1 = batch_random.random(n)
+    r2 = batch_random.random(n)
+    radius_dist = 1 - radius * radius / distance_squared
+    z = 1 + r2 * (np.sqrt(radius_dist) - 1)
+    phi = 2 * math.pi * r1
+    z_sqrt = np.sqrt(1-z*z)
+    x = np.cos(phi) * z_sqrt
+    y = np.sin(phi) * z_sqrt
+    return Vec3Batch(x, y, z)
+
+# rejection sampling on the whole batch, redrawing only the misses
+def random_in_unit_sphere_batch(n):
+    p = Vec3Batch.zeros(n)
+    todo = np.arange(n)
+    while len(todo):
+        q = 2 * Vec3Batch(batch_random.random(len(todo)), batch_random.random(len(todo)), batch_random.random(len(todo))) - Vec3(1, 1, 1)
+        inside = q.dot(q) < 1
+        p[todo[inside]] = q[inside]
+        todo = todo[~inside]
+    return p.unit()
+
 class PDF:
     def value(self, direction):
         raise NotImplementedError()
@@ -72,6 +111,58 @@ class MixturePDF(PDF):
         return 0.5 * self.p0.value(direction) + 0.5 * self.p1.value(direction)
 
     def generate(self):
-        if local_random.random() < 0.5:
+        if rng.random() < 0.5:
             return self.p0.generate()
         return self.p1.generate()
+
+# a direction from MixturePDF(HitablePDF(light_shape, origin), pdf) and its
+# value, with the same draws and arithmetic but without building the two
+# pdfs; pdf alone when light_shape is None
+def sample_mixture(light_shape, origin, pdf):
+    if light_shape is None:
+        direction = pdf.generate()
+        return direction, pdf.value(direction)
+    if rng.random() < 0.5:
+        direction = light_shape.random(origin)
+    else:
+        direction = pdf.generate()
+    return direction, 0.5 * light_shape.pdf_value(origin, direction) + 0.5 * pdf.value(direction)
+
+# Batched PDFs, value() and generate() work on a Vec3Batch per call
+class CosinePDFBatch(PDF):
+    def __init__(self, w):
+        self.uvw = ONBBatch()
+        self.uvw.build_from_w(w)
+
+    def value(self, direction):
+        cosine = direction.unit().dot(self.uvw.w)
+        return np.where(cosine > 0, cosine / math.pi, 0.0)
+
+    def generate(self):
+        return self.uvw.local(random_cosine_direction_batch(len(self.uvw.w)))
+
+class HitablePDFBatch(PDF):
+    def __init__(self, p, o):
+        self.ptr = p
+        self.origin = o
+
+    def value(self, direction):
+        return self.ptr.pdf_value_batch(self.origin, direction)
+
+    def generate(self):
+        return self.ptr.random_batch(self.origin)
+
+class MixturePDFBatch(PDF):
+    def __init__(self, p0, p1):
+        self.p0 = p0
+        self.p1 = p1
+
+    def value(self, direction):
+        return 0.5 * self.p0.value(direction) + 0.5 * self.p1.value(direction)
+
+    # every row draws from both and keeps one, which keeps the arrays aligned
+    def generate(self):
+        d0 = self.p0.generate()
+        d1 = self.p1.generate()
+        pick0 = batch_random.random(len(d0)) < 0.5
+        return where(pick0, d0, d1)
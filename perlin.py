@@ -1,51 +1,97 @@
 import math
 import random
-from vec3 import Vec3
-#from array import array
-#from numpy import zeros
+import numpy as np
 
-local_random = random.Random(14)
-
-def trilinear_interp(c, u, v, w):
-    u = u*u*(3-2*u)
-    v = v*v*(3-2*v)
-    w = w*w*(3-2*w)
-    accum = 0
-    for i in range(2):
-        for j in range(2):
-            for k in range(2):
-                accum += (i*u + (1-i)+(1-u))*(j*v + (1-j)*(1-v))*(k*w + (1-k)*(1-w))*c[i][j][k]
-    return accum
+# Gradient (vector) Perlin noise. The permutation and gradient tables are
+# made once per Perlin from a seeded generator, so scenes stay the same
+# between runs. noise() and turb() take one Vec3 and run in plain Python,
+# noise_batch() and turb_batch() take a Vec3Batch, its arrays of any one
+# shape, and evaluate every point in the same NumPy calls.
 
 class Perlin:
-    def noise(p):
-        u = p.x - math.floor(p.x)
-        v = p.y - math.floor(p.y)
-        w = p.z - math.floor(p.z)
-##        i = int(4*p.x) & 255
-##        j = int(4*p.y) & 255
-##        k = int(4*p.z) & 255
-        i = math.floor(p.x)
-        j = math.floor(p.y)
-        k = math.floor(p.z)
-        c = [[[0,0],[0, 0]],[[0, 0],[0, 0]]]
-        #c = numpy.zeros((2,2,2))
-        for di in range(2):
-            for dj in range(2):
-                for dk in range(2):
-                    c[di][dj][dk] = ranfloat[perm_x[(i+di) & 255] ^ perm_y[(j+dj) & 255] ^ perm_z[(k+dk) & 255]]
-        return trilinear_interp(c, u, v, w)
-        #return ranfloat[perm_x[i] ^ perm_y[j] ^ perm_z[k]]
+    def __init__(self, seed=14):
+        local_random = random.Random(seed)
+        ranvec = []
+        for i in range(256):
+            x, y, z = (-1 + 2*local_random.random() for j in range(3))
+            length = math.sqrt(x*x + y*y + z*z)
+            ranvec.append((x/length, y/length, z/length))
+        self.ranvec = ranvec
+        self.perm_x = perlin_generate_perm(local_random)
+        self.perm_y = perlin_generate_perm(local_random)
+        self.perm_z = perlin_generate_perm(local_random)
+        self.ranvec_array = np.array(ranvec)
+        self.perm_array = np.array([self.perm_x, self.perm_y, self.perm_z])
 
-#@staticmethod
-def perlin_generate():
-    p = []
-    for i in range(256):
-        p.append(local_random.random())
-        #p.append(Vec3(-1 + 2*local_random.random(), -1 + 2*local_random.random(), -1 + 2*local_random.random()).unit())
-    return p
+    def noise(self, p):
+        fi = math.floor(p.x)
+        fj = math.floor(p.y)
+        fk = math.floor(p.z)
+        u = p.x - fi
+        v = p.y - fj
+        w = p.z - fk
+        uu = u*u*(3-2*u)
+        vv = v*v*(3-2*v)
+        ww = w*w*(3-2*w)
+        i = int(fi)
+        j = int(fj)
+        k = int(fk)
+        ranvec = self.ranvec
+        perm_y = self.perm_y
+        perm_z = self.perm_z
+        accum = 0.0
+        for di in (0, 1):
+            px = self.perm_x[(i+di) & 255]
+            wi = uu if di else 1 - uu
+            for dj in (0, 1):
+                pxy = px ^ perm_y[(j+dj) & 255]
+                wij = wi * (vv if dj else 1 - vv)
+                for dk in (0, 1):
+                    gx, gy, gz = ranvec[pxy ^ perm_z[(k+dk) & 255]]
+                    accum += wij * (ww if dk else 1 - ww) * (gx*(u-di) + gy*(v-dj) + gz*(w-dk))
+        return accum
+
+    def noise_batch(self, p):
+        points = np.stack(np.broadcast_arrays(p.x, p.y, p.z)).astype(np.float64)
+        floors = np.floor(points)
+        f = points - floors
+        smooth = f*f*(3-2*f)
+        cell = floors.astype(np.int64)
+        # hashes[d][a]: the permuted index of lattice plane cell + d of axis a
+        hashes = [[perm[(cell[a] + d) & 255] for a, perm in enumerate(self.perm_array)] for d in (0, 1)]
+        accum = np.zeros(points.shape[1:])
+        for di in (0, 1):
+            wi = smooth[0] if di else 1 - smooth[0]
+            for dj in (0, 1):
+                hxy = hashes[di][0] ^ hashes[dj][1]
+                wij = wi * (smooth[1] if dj else 1 - smooth[1])
+                for dk in (0, 1):
+                    g = self.ranvec_array[hxy ^ hashes[dk][2]]
+                    wijk = wij * (smooth[2] if dk else 1 - smooth[2])
+                    accum += wijk * (g[..., 0]*(f[0]-di) + g[..., 1]*(f[1]-dj) + g[..., 2]*(f[2]-dk))
+        return accum
+
+    # sum of depth octaves of noise, each at twice the frequency and half
+    # the weight of the one before
+    def turb(self, p, depth=7):
+        accum = 0.0
+        weight = 1.0
+        for i in range(depth):
+            accum += weight * self.noise(p)
+            weight *= 0.5
+            p = 2*p
+        return abs(accum)
+
+    def turb_batch(self, p, depth=7):
+        accum = 0.0
+        weight = 1.0
+        for i in range(depth):
+            accum = accum + weight * self.noise_batch(p)
+            weight *= 0.5
+            p = 2*p
+        return np.abs(accum)
 
-def permute(p, n):
+def permute(p, n, local_random):
     for i in range(n-1, 0, -1):
         target = int(local_random.random()*(i+1))
         tmp = p[i]
@@ -53,24 +99,5 @@ def permute(p, n):
         p[target] = tmp
     return p
 
-#@staticmethod
-def perlin_generate_perm():
-    p = []
-    for i in range(256):
-        p.append(i)
-    p = permute(p, 256)
-    return p
-
-perm_x = perlin_generate_perm()
-perm_y = perlin_generate_perm()
-perm_z = perlin_generate_perm()
-ranfloat = perlin_generate()
-ranvec = perlin_generate()
-
-##def smoothstep(t):
-##    return t * t * (3. - 2. * t)
-##
-##
-##def lerp(t, a, b):
-##    return a + t * (b - a)
-
+def perlin_generate_perm(local_random):
+    return permute(list(range(256)), 256, local_random)
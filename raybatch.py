@@ -0,0 +1,28 @@
+import numpy as np
+from vec3batch import concatenate
+
+# Batch of rays sharing one set of arrays, the batched counterpart of Ray
+class RayBatch:
+    def __init__(self, origin, direction, time=0):
+        self.origin = origin
+        self.direction = direction
+        if np.ndim(time) == 0:
+            time = np.full(len(direction), float(time))
+        self.time = time
+
+    def __len__(self):
+        return len(self.direction)
+
+    def __getitem__(self, index):
+        return RayBatch(self.origin[index], self.direction[index], self.time[index])
+
+    def __call__(self, t):
+        return self.origin + t * self.direction
+
+    def point_at_parameter(self, t):
+        return self.origin + t * self.direction
+
+def concatenate_rays(batches):
+    return RayBatch(concatenate([b.origin for b in batches]),
+                    concatenate([b.direction for b in batches]),
+                    np.concatenate([b.time for b in batches]))
@@ -0,0 +1,73 @@
+import itertools
+import random as _random
+import numpy as np
+
+# Counter based random numbers. Every value is a hash of (seed, pixel,
+# sample, dimension), so a sample comes out the same whichever process
+# renders it, in whatever order, with whatever tile size. The values of a
+# whole tile are made in one NumPy call; while a sample is traced, random()
+# below is rebound to a C level iterator over that sample's values, so
+# drawing one costs no more than random.random() did.
+
+# values per sample made up front, draws past these are hashed one by one
+dimensions = 64
+
+mask = (1 << 64) - 1
+golden = 0x9E3779B97F4A7C15
+
+# splitmix64 finalizer, on NumPy uint64 arrays (wrapping) or Python ints
+def mix(z):
+    if isinstance(z, int):
+        z = (z ^ (z >> 30)) * 0xBF58476D1CE4E5B9 & mask
+        z = (z ^ (z >> 27)) * 0x94D049BB133111EB & mask
+        return z ^ (z >> 31)
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return z ^ (z >> np.uint64(31))
+
+# one 64 bit key per (seed, pixel, sample), arrays broadcast
+def key(seed, pixel, sample):
+    if isinstance(pixel, int) and isinstance(sample, int):
+        k = mix((seed + golden) & mask)
+        k = mix((k ^ pixel) + golden & mask)
+        return mix((k ^ sample) + golden & mask)
+    with np.errstate(over='ignore'):
+        k = mix(np.uint64((seed + golden) & mask))
+        k = mix((k ^ np.asarray(pixel, dtype=np.uint64)) + np.uint64(golden))
+        return mix((k ^ np.asarray(sample, dtype=np.uint64)) + np.uint64(golden))
+
+def to_unit(bits):
+    if isinstance(bits, int):
+        return (bits >> 11) * (1.0 / (1 << 53))
+    return (bits >> np.uint64(11)).astype(np.float64) * (1.0 / (1 << 53))
+
+# uniform [0, 1) values for the first count dimensions of each pixel and
+# sample index, the two arrays broadcast against each other and the
+# dimensions go last
+def uniforms(seed, pixels, samples, count=dimensions):
+    k = key(seed, np.asarray(pixels), np.asarray(samples))
+    with np.errstate(over='ignore'):
+        d = np.arange(count, dtype=np.uint64) * np.uint64(golden)
+        return to_unit(mix(k[..., None] ^ d))
+
+# the draws of a sample past the precomputed ones
+def overflow(seed, pixel, sample, start):
+    k = key(seed, pixel, sample)
+    d = start
+    while True:
+        yield to_unit(mix(k ^ (d * golden & mask)))
+        d += 1
+
+# draws from the values of one sample, then on from its hash
+def begin(seed, pixel, sample, values):
+    global random
+    random = itertools.chain(values.tolist(), overflow(seed, pixel, sample, len(values))).__next__
+
+# outside of a render (scene construction, tests) draws come from a
+# plain generator
+def reset(seed=14):
+    global random
+    random = _random.Random(seed).random
+
+random = None
+reset()
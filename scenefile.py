@@ -0,0 +1,287 @@
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+from vec3 import Vec3
+from hitable import HitableList, Sphere, MovingSphere, XYRect, XZRect, YZRect, Box, FlipNormals, Instance, ConstantMedium
+from camera import Camera, FOVCamera, PosCamera, DofCamera, MoBlurCamera
+from material import Lambertian, Metal, Dielectric, DiffuseLight, Isotropic
+from texture import ConstantTexture, CheckerTexture, NoiseTexture, TurbulenceTexture, MarbleTexture, ImageTexture
+import transform
+import lbvh
+from lights import LightSet, find_lights
+
+# Scenes as JSON files, compiled once into flat arrays and cached.
+#
+#   {"camera": {"type": "moblur_camera", "lookfrom": [278, 278, -800], "lookat": [278, 278, 0],
+#               "vfov": 40, "aperture": 0, "focus_dist": 10},
+#    "textures": {"white": [0.73, 0.73, 0.73]},
+#    "materials": {"white": {"type": "lambertian", "albedo": "white"}},
+#    "objects": [{"type": "box", "p0": [0, 0, 0], "p1": [165, 330, 165], "material": "white",
+#                 "transform": [{"rotate_y": 15}, {"translate": [265, 0, 295]}]}],
+#    "lights": [{"type": "xz_rect", "x0": 213, "x1": 343, "z0": 227, "z1": 332, "k": 554}]}
+#
+# Textures and materials are named in their own tables or written in place;
+# a texture may also be just an rgb triple. Objects take the arguments of
+# their classes, "flip" to turn their normals around and "transform", a
+# list of translate, rotate_x/y/z, rotate ({"axis", "angle"}) and scale
+# steps applied in order. A "medium" fills its "boundary" object. "lights"
+# are the shapes the light pdf samples, as hlist; without them it samples
+# every sphere and rect with a diffuse_light, chosen by power (lights.py).
+#
+# The compiled scene is a structured array of objects, world objects in the
+# order of the leaves of a linear BVH (lbvh.py) and then the lights, the
+# nodes of that BVH and meta.json with the camera, textures and materials.
+# It goes to __scenecache__/<hash of the file>/ next to the scene and is
+# mapped from there by every later load; only the primitives themselves
+# are made again from their rows.
+
+version = 2
+leaf_size = 1
+
+kinds = ('sphere', 'moving_sphere', 'xy_rect', 'xz_rect', 'yz_rect', 'box')
+parameters = {
+    'sphere': ('center', 'radius'),
+    'moving_sphere': ('center0', 'center1', 'time0', 'time1', 'radius'),
+    'xy_rect': ('x0', 'x1', 'y0', 'y1', 'k'),
+    'xz_rect': ('x0', 'x1', 'z0', 'z1', 'k'),
+    'yz_rect': ('y0', 'y1', 'z0', 'z1', 'k'),
+    'box': ('p0', 'p1'),
+}
+vectors = ('center', 'center0', 'center1', 'p0', 'p1')
+
+# material and medium are indices into meta.json's lists, -1 for none; a
+# medium row is the boundary filled with density
+object_dtype = np.dtype([('kind', '<i1'), ('flip', '<i1'), ('transformed', '<i1'), ('material', '<i4'),
+                         ('medium', '<i4'), ('density', '<f8'), ('params', '<f8', 9), ('transform', '<f8', 12)])
+
+class SceneError(ValueError):
+    pass
+
+def vec(value):
+    x, y, z = value
+    return Vec3(float(x), float(y), float(z))
+
+# the JSON, made flat: textures and materials as lists that refer to each
+# other by index, objects as rows
+class Compiler:
+    def __init__(self, description, folder):
+        self.description = description
+        self.folder = folder
+        self.textures = []
+        self.materials = []
+        self.texture_names = {}
+        self.material_names = {}
+
+    def texture(self, value):
+        if isinstance(value, str):
+            if value not in self.texture_names:
+                if value not in self.description.get('textures', {}):
+                    raise SceneError('unknown texture {!r}'.format(value))
+                self.texture_names[value] = self.texture(self.description['textures'][value])
+            return self.texture_names[value]
+        if isinstance(value, list):
+            value = {'type': 'constant', 'color': value}
+        value = dict(value)
+        kind = value.get('type')
+        if kind == 'checker':
+            value['odd'] = self.texture(value['odd'])
+            value['even'] = self.texture(value['even'])
+        elif kind == 'image':
+            value['file'] = os.path.join(self.folder, value['file'])
+        elif kind not in ('constant', 'noise', 'turbulence', 'marble'):
+            raise SceneError('unknown texture type {!r}'.format(kind))
+        self.textures.append(value)
+        return len(self.textures) - 1
+
+    def material(self, value):
+        if value is None:
+            return -1
+        if isinstance(value, str):
+            if value not in self.material_names:
+                if value not in self.description.get('materials', {}):
+                    raise SceneError('unknown material {!r}'.format(value))
+                self.material_names[value] = self.material(self.description['materials'][value])
+            return self.material_names[value]
+        value = dict(value)
+        kind = value.get('type')
+        if kind in ('lambertian', 'isotropic'):
+            value['albedo'] = self.texture(value['albedo'])
+        elif kind == 'diffuse_light':
+            value['emit'] = self.texture(value['emit'])
+        elif kind not in ('metal', 'dielectric'):
+            raise SceneError('unknown material type {!r}'.format(kind))
+        self.materials.append(value)
+        return len(self.materials) - 1
+
+    def row(self, value):
+        row = np.zeros((), dtype=object_dtype)
+        if value.get('type') == 'medium':
+            row['medium'] = self.texture(value['texture'])
+            row['density'] = value['density']
+            value = value['boundary']
+        else:
+            row['medium'] = -1
+        kind = value.get('type')
+        if kind not in kinds:
+            raise SceneError('unknown object type {!r}'.format(kind))
+        row['kind'] = kinds.index(kind)
+        row['flip'] = bool(value.get('flip', False))
+        row['material'] = self.material(value.get('material'))
+        params = []
+        for name in parameters[kind]:
+            params.extend(value[name] if name in vectors else [value[name]])
+        row['params'][:len(params)] = params
+        steps = value.get('transform', [])
+        row['transformed'] = bool(steps)
+        row['transform'] = transform.rows(matrix(steps))
+        return row
+
+def matrix(steps):
+    m = transform.identity()
+    for step in steps:
+        (name, value), = step.items()
+        if name == 'translate':
+            m = transform.translation(vec(value)) @ m
+        elif name in ('rotate_x', 'rotate_y', 'rotate_z'):
+            m = getattr(transform, 'rotation_' + name[-1])(value) @ m
+        elif name == 'rotate':
+            m = transform.rotation(vec(value['axis']), value['angle']) @ m
+        elif name == 'scale':
+            m = (transform.scaling(*value) if isinstance(value, list) else transform.scaling(value)) @ m
+        else:
+            raise SceneError('unknown transform {!r}'.format(name))
+    return m
+
+# textures only refer to ones before them in the list, made already
+def make_texture(value, made):
+    kind = value['type']
+    if kind == 'constant':
+        return ConstantTexture(vec(value['color']))
+    if kind == 'checker':
+        return CheckerTexture(made[value['odd']], made[value['even']])
+    if kind == 'noise':
+        return NoiseTexture(value.get('scale', 1))
+    if kind == 'turbulence':
+        return TurbulenceTexture(value.get('scale', 1), value.get('depth', 7))
+    if kind == 'marble':
+        return MarbleTexture(value.get('scale', 4), value.get('depth', 7))
+    return ImageTexture(value['file'], value.get('size'))
+
+def make_material(value, textures):
+    kind = value['type']
+    if kind == 'lambertian':
+        return Lambertian(textures[value['albedo']])
+    if kind == 'isotropic':
+        return Isotropic(textures[value['albedo']])
+    if kind == 'diffuse_light':
+        return DiffuseLight(textures[value['emit']])
+    if kind == 'metal':
+        return Metal(vec(value['albedo']), value.get('fuzz', 0))
+    return Dielectric(value['ref_idx'])
+
+def make_camera(value, aspect):
+    kind = value.get('type', 'moblur_camera')
+    if kind == 'camera':
+        return Camera()
+    if kind == 'fov_camera':
+        return FOVCamera(value['vfov'], aspect)
+    args = [vec(value['lookfrom']), vec(value['lookat']), vec(value.get('vup', (0, 1, 0))), value['vfov'], aspect]
+    if kind == 'pos_camera':
+        return PosCamera(*args)
+    args += [value.get('aperture', 0.0), value.get('focus_dist', 10)]
+    if kind == 'dof_camera':
+        return DofCamera(*args)
+    if kind == 'moblur_camera':
+        return MoBlurCamera(*args, value.get('time0', 0), value.get('time1', 1))
+    raise SceneError('unknown camera type {!r}'.format(kind))
+
+# the primitives of the rows of an objects array, read a column at a time
+def make_objects(objects, materials, textures):
+    primitives = []
+    columns = [objects[field].tolist() for field in object_dtype.names]
+    for kind, flip, transformed, material, medium, density, p, m in zip(*columns):
+        material = materials[material] if material >= 0 else None
+        if kind == 0:
+            shape = Sphere(Vec3(p[0], p[1], p[2]), p[3], material)
+        elif kind == 1:
+            shape = MovingSphere(Vec3(p[0], p[1], p[2]), Vec3(p[3], p[4], p[5]), p[6], p[7], p[8], material)
+        elif kind == 5:
+            shape = Box(Vec3(p[0], p[1], p[2]), Vec3(p[3], p[4], p[5]), material)
+        else:
+            shape = (XYRect, XZRect, YZRect)[kind - 2](p[0], p[1], p[2], p[3], p[4], material)
+        if transformed:
+            shape = Instance(shape, np.vstack((np.reshape(m, (3, 4)), (0, 0, 0, 1))), flip=bool(flip))
+        elif flip:
+            shape = FlipNormals(shape)
+        if medium >= 0:
+            shape = ConstantMedium(shape, density, textures[medium])
+        primitives.append(shape)
+    return primitives
+
+def scene_hash(name):
+    with open(name, 'rb') as f:
+        text = f.read()
+    return hashlib.sha1('{} {}\n'.format(version, leaf_size).encode() + text).hexdigest()
+
+def cache_folder(name):
+    return os.path.join(os.path.dirname(os.path.abspath(name)), '__scenecache__', scene_hash(name))
+
+# parses, builds and writes the compiled scene, returns its folder
+def compile_scene(name):
+    target = cache_folder(name)
+    with open(name) as f:
+        description = json.load(f)
+    compiler = Compiler(description, os.path.dirname(os.path.abspath(name)))
+    world = [compiler.row(value) for value in description['objects']]
+    lights = [compiler.row(value) for value in description.get('lights', [])]
+    # only the shapes matter for the boxes
+    shapes = make_objects(np.array(world, dtype=object_dtype), [None] * len(compiler.materials), [None] * len(compiler.textures))
+    boxes = [shape.bounding_box(0, 1) for shape in shapes]
+    nodes, order = lbvh.build([(b.min_hit.x, b.min_hit.y, b.min_hit.z) for b in boxes],
+                              [(b.max_hit.x, b.max_hit.y, b.max_hit.z) for b in boxes], leaf_size)
+    objects = np.array([world[i] for i in order] + lights, dtype=object_dtype)
+    meta = {'camera': description.get('camera', {}), 'textures': compiler.textures, 'materials': compiler.materials,
+            'world': len(world), 'lights': len(lights), 'find_lights': 'lights' not in description}
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    part = tempfile.mkdtemp(dir=os.path.dirname(target))
+    np.save(os.path.join(part, 'objects.npy'), objects)
+    np.save(os.path.join(part, 'nodes.npy'), nodes)
+    with open(os.path.join(part, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+    try:
+        os.rename(part, target)
+    except OSError:
+        # another process got there first
+        shutil.rmtree(part)
+    return target
+
+# world, camera and light shapes (None without lights) of a scene file,
+# compiled first if its cache is missing or out of date
+def load(name, aspect):
+    folder = cache_folder(name)
+    if not os.path.exists(os.path.join(folder, 'meta.json')):
+        compile_scene(name)
+    with open(os.path.join(folder, 'meta.json')) as f:
+        meta = json.load(f)
+    objects = np.load(os.path.join(folder, 'objects.npy'), mmap_mode='r')
+    nodes = np.load(os.path.join(folder, 'nodes.npy'), mmap_mode='r')
+    textures = []
+    for value in meta['textures']:
+        textures.append(make_texture(value, textures))
+    materials = [make_material(value, textures) for value in meta['materials']]
+    primitives = make_objects(objects, materials, textures)
+    world = lbvh.FlatBVH(nodes, primitives[:meta['world']])
+    lights = primitives[meta['world']:]
+    light_shape = None
+    if meta['find_lights']:
+        lights = find_lights(world)
+        if lights:
+            light_shape = LightSet(lights)
+    elif len(lights) == 1:
+        light_shape = lights[0]
+    elif lights:
+        light_shape = HitableList(lights)
+    return world, make_camera(meta['camera'], aspect), light_shape
@@ -0,0 +1,61 @@
+import math
+from collections import namedtuple
+from time import perf_counter
+
+# pixels [x0, x1) x [y0, y1), row 0 at the top; index is the scanline position
+Tile = namedtuple('Tile', 'index x0 y0 x1 y1')
+
+# square tiles covering the whole image, the last row/column clipped
+def make_tiles(width, height, size):
+    tiles = []
+    for y0 in range(0, height, size):
+        for x0 in range(0, width, size):
+            tiles.append(Tile(len(tiles), x0, y0, min(x0 + size, width), min(y0 + size, height)))
+    return tiles
+
+# rings of tiles around the image center, each ring walked by angle
+def spiral_order(tiles, width, height):
+    size = max(t.x1 - t.x0 for t in tiles)
+    cx = width / 2
+    cy = height / 2
+    def key(t):
+        dx = (t.x0 + t.x1) / 2 - cx
+        dy = (t.y0 + t.y1) / 2 - cy
+        return (round(max(abs(dx), abs(dy)) / size), math.atan2(dy, dx))
+    return sorted(tiles, key=key)
+
+# most expensive first, so the cheap tiles fill in the gaps at the end
+def cost_order(tiles, costs):
+    return sorted(tiles, key=lambda t: -costs[t.index])
+
+# probe(x, y) renders one pixel cheaply, its time is the cost of the pixel;
+# a tile costs its area times the mean of a few pixels spread over it
+def estimate_costs(tiles, probe, samples=2):
+    costs = {}
+    for t in tiles:
+        start = perf_counter()
+        for j in range(samples):
+            for i in range(samples):
+                probe(t.x0 + (2 * i + 1) * (t.x1 - t.x0) // (2 * samples),
+                      t.y0 + (2 * j + 1) * (t.y1 - t.y0) // (2 * samples))
+        costs[t.index] = (perf_counter() - start) / (samples * samples) * (t.x1 - t.x0) * (t.y1 - t.y0)
+    return costs
+
+def order_tiles(tiles, order, width, height, probe=None):
+    if order == 'spiral':
+        return spiral_order(tiles, width, height)
+    if order == 'cost':
+        return cost_order(tiles, estimate_costs(tiles, probe))
+    return list(tiles)
+
+# render(tile) returns (tile, seconds); results come back as workers
+# finish them, one tile at a time so no worker waits on a slow chunk
+def run(pool, render, tiles):
+    return pool.imap_unordered(render, tiles, chunksize=1)
+
+def report(timings, wall, workers):
+    times = sorted(timings.values())
+    total = sum(times)
+    print("Tiles: {}, tile seconds min {:.3f} / mean {:.3f} / max {:.3f}".format(
+        len(times), times[0], total / len(times), times[-1]))
+    print("Worker utilisation: {:.0%} of {} workers over {:.2f}s".format(total / (wall * workers), workers, wall))
@@ -0,0 +1,81 @@
+import gc
+import pickle
+import multiprocessing
+from multiprocessing import shared_memory
+
+# Hands the scene the parent built to the pool workers, so none of them
+# builds it again.
+#
+# Forked workers have it already, in pages shared with the parent until
+# written to. The cyclic collector writes to the header of every object it
+# looks at, so publish() moves everything the parent has made into the
+# permanent generation with gc.freeze() first and collections in the
+# workers leave the scene alone; only the reference counts of the objects
+# a worker touches still copy their pages. Array backed primitives
+# (SphereSet, RectSet, lbvh.FlatBVH) keep that to a few objects.
+#
+# Spawned workers import main_next01 afresh. For them the scene is pickled
+# once into a shared memory block, or, when it came from a scene file,
+# reopened from the file's compiled cache. The pickle keeps the data of
+# the scene's arrays out of band, after the pickle stream in the block, and
+# a worker unpickles them as read only views of the block: the array backed
+# primitives (SphereSet, RectSet, meshes, grids) stay in pages every worker
+# shares, only the Python objects around them are made again in each. The
+# plain objects of a scene (a BVHNode over Spheres, as the scalar
+# integrators have it) are all made again, from constructor calls rather
+# than state dicts (vec3.py), for a little less than building them would
+# cost. Either way the worker freezes what it made.
+
+# the parent's blocks, kept open until the pool is done with them
+blocks = []
+# the worker's block, which the arrays of its scene are views of
+attached = []
+
+# out of band buffers start at multiples of this in the block
+alignment = 64
+
+# the handle to pass to attach() in the workers of a pool started with
+# method (the default start method if None), None under fork
+def publish(scene, scene_file=None, method=None):
+    if (method or multiprocessing.get_start_method()) == 'fork':
+        gc.collect()
+        gc.freeze()
+        return None
+    if scene_file:
+        return ('file', scene_file)
+    buffers = []
+    data = pickle.dumps(scene, 5, buffer_callback=buffers.append)
+    views = [buffer.raw() for buffer in buffers]
+    layout = []
+    end = len(data)
+    for view in views:
+        offset = -(-end // alignment) * alignment
+        layout.append((offset, view.nbytes))
+        end = offset + view.nbytes
+    block = shared_memory.SharedMemory(create=True, size=max(end, 1))
+    block.buf[:len(data)] = data
+    for view, (offset, size) in zip(views, layout):
+        block.buf[offset:offset + size] = view
+    blocks.append(block)
+    return ('shared', block.name, len(data), layout)
+
+# world, camera and light shapes from a handle of publish()
+def attach(handle, aspect):
+    if handle[0] == 'file':
+        import scenefile
+        scene = scenefile.load(handle[1], aspect)
+    else:
+        block = shared_memory.SharedMemory(handle[1])
+        view = block.buf.toreadonly()
+        scene = pickle.loads(view[:handle[2]], buffers=[view[offset:offset + size] for offset, size in handle[3]])
+        attached.append(block)
+    gc.collect()
+    gc.freeze()
+    return scene
+
+def release():
+    while blocks:
+        block = blocks.pop()
+        block.close()
+        block.unlink()
+    gc.unfreeze()
@@ -0,0 +1,113 @@
+import math
+from collections import Counter
+import numpy as np
+from aabb import AABB
+import camera
+import hitable
+import lights
+import material
+import pdf
+import wavefront
+
+# Optional counters for the hot path. Nothing is counted and nothing costs
+# anything until enable() is called: it replaces the methods below with
+# counting wrappers, so a render without stats runs the original code.
+# Counts are keyed by (kind, class name) and taken per job with take(),
+# the parent adds up what its workers send back.
+
+counts = Counter()
+enabled = False
+
+# rows of the call: a batch counts once per ray / direction
+def size(arg):
+    return len(arg) if hasattr(arg, '__len__') else 1
+
+# rows for which the call succeeded: a hit record, or a mask of hits
+def successes(result):
+    if isinstance(result, np.ndarray):
+        return int(np.count_nonzero(result))
+    return 1 if result else 0
+
+# samples with a NaN component, scalar Vec3 or Vec3Batch
+def nans(c):
+    if isinstance(c.x, float):
+        return 1 if math.isnan(c.x) or math.isnan(c.y) or math.isnan(c.z) else 0
+    return int(np.count_nonzero(np.isnan(c.x) | np.isnan(c.y) | np.isnan(c.z)))
+
+def subclasses(cls):
+    for sub in cls.__subclasses__():
+        yield sub
+        yield from subclasses(sub)
+
+# counts[kind, class name] += rows of each call to cls.method, and
+# counts[success, class name] for the rows that succeeded
+def count_calls(cls, method, kind, success=None):
+    function = cls.__dict__[method]
+    name = cls.__name__
+    def counted(self, *args):
+        counts[kind, name] += size(args[0])
+        result = function(self, *args)
+        if success:
+            counts[success, name] += successes(result)
+        return result
+    setattr(cls, method, counted)
+
+# counts[kind, 'samples'] for the samples with NaNs that de_nan zeroes
+def count_nans(module, kind='nan'):
+    function = module.de_nan
+    def counted(c):
+        counts[kind, 'samples'] += nans(c)
+        return function(c)
+    module.de_nan = counted
+
+# wraps the methods in this and each of modules' de_nan, once per process
+def enable(*modules):
+    global enabled
+    if enabled:
+        return
+    enabled = True
+    for cls in (camera.Camera, camera.FOVCamera, camera.PosCamera, camera.DofCamera, camera.MoBlurCamera):
+        count_calls(cls, 'get_ray', 'camera rays')
+        count_calls(cls, 'get_ray_batch', 'camera rays')
+    for cls in [AABB] + list(subclasses(hitable.Hitable)):
+        for method in ('hit', 'hit_batch'):
+            if method in cls.__dict__:
+                count_calls(cls, method, 'hit', 'hits')
+    for cls in subclasses(material.Material):
+        for method in ('scatter', 'scatter_batch'):
+            if method in cls.__dict__:
+                count_calls(cls, method, 'scatter')
+    for cls in subclasses(pdf.PDF):
+        if 'value' in cls.__dict__:
+            count_calls(cls, 'value', 'pdf')
+    # the light shapes' own densities, which sample_mixture() and the
+    # pdfs above evaluate; LightSet is one of these
+    for cls in [hitable.Hitable] + list(subclasses(hitable.Hitable)):
+        for method in ('pdf_value', 'pdf_value_batch'):
+            if method in cls.__dict__:
+                count_calls(cls, method, 'pdf')
+    for module in (wavefront,) + modules:
+        count_nans(module)
+
+# the counts since the last take
+def take():
+    taken = Counter(counts)
+    counts.clear()
+    return taken
+
+# (count, class name) of one kind, most first
+def rows(totals, kind):
+    return sorted(((n, name) for (k, name), n in totals.items() if k == kind), reverse=True)
+
+def report(totals):
+    if not totals:
+        return
+    print("Camera rays: {}".format(sum(n for n, name in rows(totals, 'camera rays'))))
+    print("NaN samples caught: {}".format(totals['nan', 'samples']))
+    for kind, title in (('hit', 'hit tests'), ('scatter', 'scatter calls'), ('pdf', 'pdf evaluations')):
+        if not rows(totals, kind):
+            continue
+        print("{:<16} {:>12} {:>8}".format(title, 'calls', 'hit' if kind == 'hit' else ''))
+        for n, name in rows(totals, kind):
+            rate = '{:.1%}'.format(totals['hits', name] / n) if kind == 'hit' else ''
+            print("  {:<14} {:>12} {:>8}".format(name, n, rate))
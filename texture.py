@@ -1,35 +1,110 @@
 from math import sin
+import numpy as np
 from vec3 import Vec3
+from vec3batch import Vec3Batch, where
 from perlin import Perlin
+from mipmap import MipMap
 
+# footprint is the width of the ray's cone where it hit, in world units,
+# 0 where nothing is known about it
 class Texture:
 ##    def __init__(self, color):
 ##        self.color = color
-    def value(self, u, v, p):
+    def value(self, u, v, p, footprint=0):
         return Vec3(0, 0, 0)
 
+    # u, v arrays and p a Vec3Batch, falls back to one value() per row
+    def value_batch(self, u, v, p):
+        return Vec3Batch.from_vec3_list([self.value(u[i], v[i], p[i]) for i in range(len(u))])
+
 class ConstantTexture(Texture):
     def __init__(self, color):
         self.color = color
 
-    def value(self, u, v, p):
+    def __reduce__(self):
+        return ConstantTexture, (self.color,)
+
+    def value(self, u, v, p, footprint=0):
         return self.color
 
+    def value_batch(self, u, v, p):
+        return Vec3Batch.full(len(u), self.color)
+
 class CheckerTexture(Texture):
     def __init__(self, t0, t1):
         self.t0 = t0
         self.t1 = t1
 
-    def value(self, u, v, p):
+    def value(self, u, v, p, footprint=0):
         sines = sin(10*p.x) * sin(10*p.y) * sin(10*p.z)
         if sines < 0:
-            return self.t0.value(u, v, p)
-        return self.t1.value(u, v, p)
+            return self.t0.value(u, v, p, footprint)
+        return self.t1.value(u, v, p, footprint)
+
+    def value_batch(self, u, v, p):
+        sines = np.sin(10*p.x) * np.sin(10*p.y) * np.sin(10*p.z)
+        return where(sines < 0, self.t0.value_batch(u, v, p), self.t1.value_batch(u, v, p))
 
+# gray noise, 0.5 where it crosses zero
 class NoiseTexture(Texture):
-    def __init__(self):
-        self.color = Vec3(1,1,1)
+    def __init__(self, scale=1):
+        self.scale = scale
+        self.noise = Perlin()
+
+    def value(self, u, v, p, footprint=0):
+        gray = 0.5 * (1 + self.noise.noise(self.scale*p))
+        return Vec3(gray, gray, gray)
+
+    def value_batch(self, u, v, p):
+        gray = 0.5 * (1 + self.noise.noise_batch(self.scale*p))
+        return Vec3Batch(gray, gray, gray)
+
+class TurbulenceTexture(Texture):
+    def __init__(self, scale=1, depth=7):
+        self.scale = scale
+        self.depth = depth
+        self.noise = Perlin()
+
+    def value(self, u, v, p, footprint=0):
+        gray = self.noise.turb(self.scale*p, self.depth)
+        return Vec3(gray, gray, gray)
+
+    def value_batch(self, u, v, p):
+        gray = self.noise.turb_batch(self.scale*p, self.depth)
+        return Vec3Batch(gray, gray, gray)
+
+# stripes along z, their phase shifted by turbulence
+class MarbleTexture(Texture):
+    def __init__(self, scale=4, depth=7):
+        self.scale = scale
+        self.depth = depth
+        self.noise = Perlin()
+
+    def value(self, u, v, p, footprint=0):
+        gray = 0.5 * (1 + sin(self.scale*p.z + 10*self.noise.turb(p, self.depth)))
+        return Vec3(gray, gray, gray)
+
+    def value_batch(self, u, v, p):
+        gray = 0.5 * (1 + np.sin(self.scale*p.z + 10*self.noise.turb_batch(p, self.depth)))
+        return Vec3Batch(gray, gray, gray)
+
+# A PPM or PFM image wrapped around u, v through a tiled mipmap cache (see
+# mipmap.py). size is the world width the image spans once, along its
+# longer side: with it the footprint picks the mip level, without it (and
+# in value_batch, whose records have no footprint) the full resolution
+# level is used.
+class ImageTexture(Texture):
+    def __init__(self, name, size=None):
+        self.image = MipMap(name)
+        self.size = size
+
+    def value(self, u, v, p, footprint=0):
+        width = 0
+        if footprint and self.size:
+            width = footprint / self.size * max(self.image.width, self.image.height)
+        r, g, b = self.image.lookup(u, v, width)
+        return Vec3(r, g, b)
 
-    def value(self, u, v, p):
-        noise = Perlin.noise(p)
-        return noise*Vec3(1,1,1)
+    def value_batch(self, u, v, p):
+        rgb = self.image.lookup_batch(np.asarray(u, dtype=np.float64), np.asarray(v, dtype=np.float64))
+        return Vec3Batch(rgb[:, 0], rgb[:, 1], rgb[:, 2])
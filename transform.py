@@ -0,0 +1,57 @@
+from math import sin, cos, pi
+import numpy as np
+from vec3 import Vec3
+
+# 4x4 affine matrices as NumPy arrays acting on column vectors, so a @ b
+# applies b first: translation(v) @ rotation_y(15) turns, then moves.
+# Angles are in degrees like RotateY's.
+
+def identity():
+    return np.eye(4)
+
+def translation(offset):
+    m = np.eye(4)
+    m[:3, 3] = (offset.x, offset.y, offset.z)
+    return m
+
+def scaling(x, y=None, z=None):
+    if y is None:
+        y = z = x
+    return np.diag((float(x), float(y), float(z), 1.0))
+
+# about the x, y or z axis
+def rotation_x(angle):
+    return axis_rotation(1, 2, angle)
+
+def rotation_y(angle):
+    return axis_rotation(2, 0, angle)
+
+def rotation_z(angle):
+    return axis_rotation(0, 1, angle)
+
+# turns axis a towards axis b
+def axis_rotation(a, b, angle):
+    radians = (pi / 180) * angle
+    m = np.eye(4)
+    m[a, a] = m[b, b] = cos(radians)
+    m[b, a] = sin(radians)
+    m[a, b] = -sin(radians)
+    return m
+
+# about any axis through the origin (Rodrigues)
+def rotation(axis, angle):
+    k = np.array((axis.x, axis.y, axis.z), dtype=np.float64) / axis.length()
+    radians = (pi / 180) * angle
+    cross = np.array(((0, -k[2], k[1]), (k[2], 0, -k[0]), (-k[1], k[0], 0)))
+    m = np.eye(4)
+    m[:3, :3] = np.eye(3) + sin(radians) * cross + (1 - cos(radians)) * (cross @ cross)
+    return m
+
+# the top three rows as 12 floats, for the scalar code
+def rows(m):
+    return tuple(float(value) for value in np.asarray(m)[:3].ravel())
+
+def point(m, p):
+    return Vec3(m[0]*p.x + m[1]*p.y + m[2]*p.z + m[3],
+                m[4]*p.x + m[5]*p.y + m[6]*p.z + m[7],
+                m[8]*p.x + m[9]*p.y + m[10]*p.z + m[11])
@@ -1,9 +1,21 @@
 from math import sqrt
-import numbers
 
+# Slotted so a Vec3 is one small object without a __dict__; the fused
+# methods at the end save the temporaries of common two step expressions.
 class Vec3:
+    __slots__ = ('x', 'y', 'z')
+
     def __init__(self, x=0, y=0, z=0):
-        (self.x, self.y, self.z) = (x, y, z)
+        self.x = x
+        self.y = y
+        self.z = z
+
+    # Pickled as a call of the constructor, here and in the primitives,
+    # materials and textures a scene has many of: unpickling their state
+    # would keep a dict per object alive until the whole scene is loaded
+    # and give each object a dict of its own (see sharedscene.py).
+    def __reduce__(self):
+        return type(self), (self.x, self.y, self.z)
 
     def __repr__(self):
         return '{}({}, {}, {})'.format(__class__.__name__, self.x, self.y, self.z)
@@ -34,9 +46,9 @@ class Vec3:
 
     # u / k or u / v
     def __truediv__(self, other):
-        if isinstance(other, numbers.Real):
-            return Vec3(self.x / other, self.y / other, self.z / other)
-        return Vec3(self.x / other.x, self.y / other.y, self.z / other.z)
+        if type(other) is Vec3:
+            return Vec3(self.x / other.x, self.y / other.y, self.z / other.z)
+        return Vec3(self.x / other, self.y / other, self.z / other)
 
     def length(self):
         return sqrt(self.x * self.x + self.y * self.y + self.z * self.z)
@@ -54,5 +66,13 @@ class Vec3:
         return Vec3(x, y, z)
 
     def unit(self):
-        l = self.length()
-        return self / l
+        l = sqrt(self.x * self.x + self.y * self.y + self.z * self.z)
+        return Vec3(self.x / l, self.y / l, self.z / l)
+
+    # u + k * v
+    def scaled_add(self, k, other):
+        return Vec3(self.x + k * other.x, self.y + k * other.y, self.z + k * other.z)
+
+    # u * v + w
+    def mul_add(self, other, addend):
+        return Vec3(self.x * other.x + addend.x, self.y * other.y + addend.y, self.z * other.z + addend.z)
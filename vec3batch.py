@@ -0,0 +1,133 @@
+import numpy as np
+from vec3 import Vec3
+
+# Structure-of-arrays counterpart of Vec3: three parallel float64 arrays
+# so a whole tile of vectors is processed in single NumPy calls.
+# Subclassing Vec3 makes Python try our reflected operators first,
+# so Vec3 + Vec3Batch and Vec3 * Vec3Batch broadcast correctly.
+class Vec3Batch(Vec3):
+    # make ndarray * Vec3Batch fall through to our __rmul__
+    __array_ufunc__ = None
+
+    def __init__(self, x, y, z):
+        (self.x, self.y, self.z) = (np.asarray(x, dtype=np.float64),
+                                    np.asarray(y, dtype=np.float64),
+                                    np.asarray(z, dtype=np.float64))
+
+    @classmethod
+    def zeros(cls, n):
+        return cls(np.zeros(n), np.zeros(n), np.zeros(n))
+
+    # v a Vec3, or a Vec3Batch of n vectors
+    @classmethod
+    def full(cls, n, v):
+        return cls(np.full(n, v.x), np.full(n, v.y), np.full(n, v.z))
+
+    @classmethod
+    def from_vec3_list(cls, vectors):
+        return cls([v.x for v in vectors], [v.y for v in vectors], [v.z for v in vectors])
+
+    @classmethod
+    def from_array(cls, a):
+        a = np.asarray(a, dtype=np.float64)
+        return cls(a[:, 0], a[:, 1], a[:, 2])
+
+    def to_vec3_list(self):
+        return [Vec3(x, y, z) for x, y, z in zip(self.x.tolist(), self.y.tolist(), self.z.tolist())]
+
+    def to_array(self):
+        return np.stack((self.x, self.y, self.z), axis=-1)
+
+    def __repr__(self):
+        return '{}(n={})'.format(__class__.__name__, len(self))
+
+    def __len__(self):
+        return len(self.x)
+
+    # index, slice or boolean mask - a plain int gives back a Vec3
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            return Vec3(float(self.x[index]), float(self.y[index]), float(self.z[index]))
+        return Vec3Batch(self.x[index], self.y[index], self.z[index])
+
+    def __setitem__(self, index, other):
+        self.x[index] = other.x
+        self.y[index] = other.y
+        self.z[index] = other.z
+
+    def copy(self):
+        return Vec3Batch(self.x.copy(), self.y.copy(), self.z.copy())
+
+    # +u
+    def __pos__(self):
+        return self
+
+    # -u
+    def __neg__(self):
+        return Vec3Batch(-self.x, -self.y, -self.z)
+
+    # u + v, v may be a Vec3 that is broadcast over the batch
+    def __add__(self, other):
+        return Vec3Batch(self.x + other.x, self.y + other.y, self.z + other.z)
+
+    __radd__ = __add__
+
+    # u - v
+    def __sub__(self, other):
+        return Vec3Batch(self.x - other.x, self.y - other.y, self.z - other.z)
+
+    def __rsub__(self, other):
+        return Vec3Batch(other.x - self.x, other.y - self.y, other.z - self.z)
+
+    # u * v, or u * k for a scalar or per-row array k
+    def __mul__(self, other):
+        if isinstance(other, (Vec3Batch, Vec3)):
+            return Vec3Batch(self.x * other.x, self.y * other.y, self.z * other.z)
+        return Vec3Batch(self.x * other, self.y * other, self.z * other)
+
+    # k * u or Vec3 * u
+    def __rmul__(self, other):
+        return self.__mul__(other)
+
+    # u / k or u / v
+    def __truediv__(self, other):
+        if isinstance(other, (Vec3Batch, Vec3)):
+            return Vec3Batch(self.x / other.x, self.y / other.y, self.z / other.z)
+        return Vec3Batch(self.x / other, self.y / other, self.z / other)
+
+    def __rtruediv__(self, other):
+        if not isinstance(other, Vec3):
+            return Vec3Batch(other / self.x, other / self.y, other / self.z)
+        return Vec3Batch(other.x / self.x, other.y / self.y, other.z / self.z)
+
+    def length(self):
+        return np.sqrt(self.x * self.x + self.y * self.y + self.z * self.z)
+
+    def squared_length(self):
+        return self.x * self.x + self.y * self.y + self.z * self.z
+
+    def dot(self, other):
+        return self.x * other.x + self.y * other.y + self.z * other.z
+
+    def cross(self, other):
+        x = self.y * other.z - self.z * other.y
+        y = self.z * other.x - self.x * other.z
+        z = self.x * other.y - self.y * other.x
+        return Vec3Batch(x, y, z)
+
+    def unit(self):
+        l = self.length()
+        return Vec3Batch(self.x / l, self.y / l, self.z / l)
+
+# k * v for a per-row array k and a single Vec3 v
+def scaled(v, k):
+    return Vec3Batch(k * v.x, k * v.y, k * v.z)
+
+# pick rows from a where mask is true and from b elsewhere
+def where(mask, a, b):
+    return Vec3Batch(np.where(mask, a.x, b.x), np.where(mask, a.y, b.y), np.where(mask, a.z, b.z))
+
+def concatenate(batches):
+    return Vec3Batch(np.concatenate([b.x for b in batches]),
+                     np.concatenate([b.y for b in batches]),
+                     np.concatenate([b.z for b in batches]))
@@ -0,0 +1,158 @@
+import numpy as np
+from vec3batch import Vec3Batch, concatenate
+from raybatch import RayBatch, concatenate_rays
+from hitable import HitRecordBatch
+from pdf import HitablePDFBatch, MixturePDFBatch, batch_random
+import rng
+
+# Wavefront (breadth first) path tracer. Each bounce intersects every live
+# path in one batch, shades the hits grouped by material and compacts the
+# rays that scattered into the batch for the next bounce. It computes the
+# same estimate as color() in main_next01.py, with the recursion replaced
+# by an explicit throughput per path.
+
+# yields (material, rows) for every distinct material object in materials,
+# in order of first appearance so the random streams do not depend on
+# where the materials happen to live in memory. Materials with the same
+# batch_key() share one group, shaded by their class's batched() material,
+# so a scene of many small objects each with a material of its own does
+# not go through the shading once per object.
+def group_by_material(materials):
+    ids = np.fromiter((id(m) for m in materials), dtype=np.int64, count=len(materials))
+    unique_ids, first, inverse = np.unique(ids, return_index=True, return_inverse=True)
+    keys = {}
+    key_of = np.empty(len(unique_ids), dtype=np.intp)
+    for material in np.argsort(first):
+        key = materials[first[material]].batch_key()
+        key_of[material] = keys.setdefault(material if key is None else key, len(keys))
+    shared = np.bincount(key_of, minlength=len(keys)) > 1
+    inverse = key_of[inverse]
+    order = np.argsort(inverse, kind='stable')
+    splits = np.cumsum(np.bincount(inverse, minlength=len(keys)))[:-1]
+    for key, group in enumerate(np.split(order, splits)):
+        material = materials[group[0]]
+        if shared[key]:
+            material = type(material).batched(materials[group])
+        yield material, group
+
+# radiance carried back along each ray of the RayBatch, ray_count gets the
+# number of rays intersected per bounce appended when given. From segment
+# rr_depth on, paths go through the same Russian roulette as trace() in
+# main_next01.py; lengths[k] is incremented for every path of k segments,
+# path_segments[i] gets the segments of path i added when given.
+def trace_batch(rays, world, light_shape, max_depth=8, ray_count=None, rr_depth=None, lengths=None, path_segments=None):
+    n = len(rays)
+    radiance = Vec3Batch.zeros(n)
+    throughput = Vec3Batch(np.ones(n), np.ones(n), np.ones(n))
+    path = np.arange(n)
+    segments = np.zeros(n, dtype=np.intp)
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        for depth in range(max_depth + 1):
+            if ray_count is not None:
+                ray_count.append(len(rays))
+            segments[path] += 1
+            rec = HitRecordBatch.empty(len(rays))
+            rows = np.flatnonzero(world.hit_batch(rays, 0.001, rec))
+            if not len(rows):
+                break
+            rays, rec, path, throughput = rays[rows], rec[rows], path[rows], throughput[rows]
+            next_rays, next_path, next_throughput = [], [], []
+            for material, group in group_by_material(rec.material):
+                group_rays = rays[group]
+                group_rec = rec[group]
+                group_path = path[group]
+                beta = throughput[group]
+                emitted = material.emitted_batch(group_rays, group_rec)
+                if emitted is not None:
+                    radiance[group_path] = radiance[group_path] + beta * emitted
+                if depth == max_depth:
+                    continue
+                srec = material.scatter_batch(group_rays, group_rec)
+                if srec is None:
+                    continue
+                if srec.is_specular:
+                    scattered = srec.specular_ray
+                    weight = srec.attenuation
+                else:
+                    p = srec.pdf_ptr if light_shape is None else MixturePDFBatch(HitablePDFBatch(light_shape, group_rec.p), srec.pdf_ptr)
+                    scattered = RayBatch(group_rec.p, p.generate(), group_rays.time)
+                    pdf_val = p.value(scattered.direction)
+                    pdf_val = np.where(pdf_val == 0, 0.0001, pdf_val)
+                    weight = srec.attenuation * (material.scattering_pdf_batch(group_rays, group_rec, scattered) / pdf_val)
+                next_rays.append(scattered)
+                next_path.append(group_path)
+                next_throughput.append(beta * weight)
+            if not next_rays:
+                break
+            rays = concatenate_rays(next_rays)
+            path = np.concatenate(next_path)
+            throughput = concatenate(next_throughput)
+            if rr_depth is not None and depth + 1 >= rr_depth:
+                survive = np.minimum(np.maximum(np.maximum(throughput.x, throughput.y), throughput.z), 0.95)
+                rows = np.flatnonzero(batch_random.random(len(path)) < survive)
+                rays, path = rays[rows], path[rows]
+                throughput = throughput[rows] * (1 / survive[rows])
+    if lengths is not None:
+        np.add.at(lengths, np.minimum(segments, len(lengths) - 1), 1)
+    if path_segments is not None:
+        path_segments += segments
+    return radiance
+
+def de_nan(c):
+    return Vec3Batch(np.nan_to_num(c.x, nan=0, posinf=np.inf, neginf=-np.inf),
+                     np.nan_to_num(c.y, nan=0, posinf=np.inf, neginf=-np.inf),
+                     np.nan_to_num(c.z, nan=0, posinf=np.inf, neginf=-np.inf))
+
+# camera rays for the pixels [x0, x1) x [y0, y1) of an nx * ny image,
+# row 0 is the top of the image; mask limits them to some of those pixels,
+# repeat gives that many samples of each pixel, one copy of all after another;
+# with first, the (y1-y0, x1-x0) index of each pixel's first sample, the
+# jitter comes from the rng streams of the pixels and samples under seed
+def camera_rays(cam, nx, ny, x0, y0, x1, y1, mask=None, repeat=1, first=None, seed=0):
+    rows, cols = np.mgrid[y0:y1, x0:x1]
+    if mask is not None:
+        rows = rows[mask]
+        cols = cols[mask]
+        if first is not None:
+            first = first[mask]
+    cols = np.tile(cols.ravel(), repeat)
+    rows = np.tile(rows.ravel(), repeat)
+    if first is None:
+        jitter = batch_random.random((len(cols), 2))
+    else:
+        samples = np.repeat(np.arange(repeat), first.size) + np.tile(first.ravel(), repeat)
+        jitter = rng.uniforms(seed, rows * nx + cols, samples, 2)
+    u = (cols + jitter[:, 0]) / nx
+    v = (ny - 1 - rows + jitter[:, 1]) / ny
+    return cam.get_ray_batch(u, v)
+
+# averaged linear radiance of one tile as a (y1-y0, x1-x0, 3) array,
+# pixels outside mask are left black; with moments a fourth channel holds
+# the mean squared luminance of the samples; first and seed key the camera
+# jitter as in camera_rays; segments, a (y1-y0, x1-x0) array, gets the path
+# segments traced for each pixel added when given
+def render_tile(cam, world, light_shape, nx, ny, ns, x0, y0, x1, y1, max_depth=8, ray_count=None, mask=None, moments=False,
+                rr_depth=None, lengths=None, first=None, seed=0, segments=None):
+    if mask is None:
+        mask = np.ones((y1 - y0, x1 - x0), dtype=bool)
+    n = int(mask.sum())
+    c = np.zeros((n, 3))
+    c2 = np.zeros(n)
+    # trace several samples of a sparse mask per batch so it is as
+    # large as one sample of the whole tile
+    s = 0
+    while s < ns:
+        repeat = min(max(-(-mask.size // max(n, 1)), 1), ns - s)
+        rays = camera_rays(cam, nx, ny, x0, y0, x1, y1, mask, repeat, None if first is None else first + s, seed)
+        traced = None if segments is None else np.zeros(len(rays), dtype=np.intp)
+        sample = de_nan(trace_batch(rays, world, light_shape, max_depth, ray_count, rr_depth, lengths, traced)).to_array().reshape(repeat, n, 3)
+        if segments is not None:
+            segments[mask] += traced.reshape(repeat, n).sum(axis=0)
+        c += sample.sum(axis=0)
+        c2 += ((sample @ np.array((0.2126, 0.7152, 0.0722))) ** 2).sum(axis=0)
+        s += repeat
+    tile = np.zeros((y1 - y0, x1 - x0, 4 if moments else 3))
+    tile[mask, :3] = c / ns
+    if moments:
+        tile[mask, 3] = c2 / ns
+    return tile